@@ -0,0 +1,307 @@
+"""Benchmarks for jgm.patched_player.FFmpegPCMAudio
+
+Plays a generated WAV file (or FFmpeg's lavfi sine generator), so nothing
+needs to be downloaded, and measures:
+
+- read: frames per second `read()` gets out of FFmpeg, for a whole clip
+- unread: cost of `unread()`, and of reading the unread frames back
+- skip: `;ff` and `;rr` style bulk skips of 15 seconds
+- jump: time from making a source with `-ss` (like `;jump`) to its first frame
+- memory: Python memory held by a source's buffers, and FFmpeg's RSS
+- filters: FFmpeg CPU time for each effect (nightcore, bassboost, ...)
+
+Run it from the repo's root:
+
+    python -m benchmarks.bench_player -o before.json
+    python -m benchmarks.bench_player -o after.json
+
+A summary is printed to stderr and the results are written as JSON.
+
+"""
+import os
+import sys
+import json
+import math
+import time
+import wave
+import array
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows, FFmpeg's CPU time won't be measured
+    resource = None
+
+from jgm import patched_player
+from jgm.extensions.music import Audio, FilterData, Music
+
+SAMPLE_RATE = 48000
+# 20ms of 16-bit stereo
+FRAME_SIZE = 3840
+FRAMES_PER_SECOND = 50
+
+# Name -> (tempo, pitch, filter name), like the effect commands set them
+PRESETS = {
+    "default": (1, 1, "default"),
+    "nightcore": (1.2, 1.2, "default"),
+    "daycore": (0.8, 0.8, "default"),
+    "speed_2x": (2, 1, "default"),
+    "bassboost": (1, 1, "bassboost"),
+    "deepfry": (1, 1, "deepfry"),
+}
+
+def write_sine(path, seconds, frequency=440):
+    """Write a stereo 16-bit sine wave, like FFmpeg's sine source"""
+    with wave.open(path, "wb") as file:
+        file.setnchannels(2)
+        file.setsampwidth(2)
+        file.setframerate(SAMPLE_RATE)
+        # One second at a time so a long clip isn't all in memory
+        step = 2 * math.pi * frequency / SAMPLE_RATE
+        for second in range(math.ceil(seconds)):
+            samples = array.array("h")
+            for i in range(second * SAMPLE_RATE, (second + 1) * SAMPLE_RATE):
+                value = int(16000 * math.sin(step * i))
+                samples.extend((value, value))
+            if sys.byteorder == "big":
+                samples.byteswap()
+            file.writeframes(samples.tobytes())
+
+class Clip:
+    """Where the synthetic audio comes from"""
+
+    def __init__(self, kind, seconds, directory, ffmpeg):
+        self.kind = kind
+        self.seconds = seconds
+        self.ffmpeg = ffmpeg
+        if kind == "wav":
+            self.url = os.path.join(directory, "sine.wav")
+            write_sine(self.url, seconds)
+            self.before = ""
+        else:
+            self.url = f"sine=frequency=440:sample_rate={SAMPLE_RATE}:duration={seconds}"
+            self.before = "-f lavfi"
+
+    def source(self, preset="default", seek=None):
+        """Return a new source, as Music would make for this clip"""
+        tempo, pitch, filter_name = PRESETS[preset]
+        audio = Audio(ty="local", query=self.url)
+        audio.filter_data = FilterData()
+        audio.filter_data.tempo = tempo
+        audio.filter_data.pitch = pitch
+        audio.filter_data.filter_name = filter_name
+        audio.metadata = {"url": self.url, "duration": self.seconds}
+        opts = audio.filter_data.to_ffmpeg_opts(Music._FFMPEG_FILTER_DICT, local=True)
+        opts["before_options"] = f"{self.before} {opts['before_options']}"
+        if seek is not None:
+            opts["before_options"] += f" -ss {seek}"
+        return patched_player.FFmpegPCMAudio(audio, executable=self.ffmpeg, **opts)
+
+def children_cpu():
+    """Return the CPU seconds used by waited on child processes"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def rss_kib(pid):
+    """Return a process's resident memory on Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def summarize(values):
+    return {
+        "median": statistics.median(values),
+        "min": min(values),
+        "max": max(values),
+        "runs": len(values),
+    }
+
+def read_all(source):
+    frames = 0
+    while source.read():
+        frames += 1
+    return frames
+
+def bench_read(clip, repeat):
+    """Frames per second when reading a whole clip"""
+    rates = []
+    frames = 0
+    for _ in range(repeat):
+        source = clip.source()
+        start = time.perf_counter()
+        frames = read_all(source)
+        elapsed = time.perf_counter() - start
+        source.cleanup()
+        rates.append(frames / elapsed)
+    return {"frames": frames, "frames_per_second": summarize(rates), "realtime_factor": statistics.median(rates) / FRAMES_PER_SECOND}
+
+def bench_unread(clip, repeat):
+    """Cost per frame of unread(), and of reading unread frames back"""
+    unread_costs = []
+    reread_costs = []
+    count = 0
+    for _ in range(repeat):
+        source = clip.source()
+        count = min(source.MAX_BUF_SZ, clip.seconds * FRAMES_PER_SECOND - 1)
+        for _ in range(count):
+            source.read()
+        start = time.perf_counter()
+        for _ in range(count):
+            source.unread()
+        unread_costs.append((time.perf_counter() - start) / count)
+        start = time.perf_counter()
+        for _ in range(count):
+            source.read()
+        reread_costs.append((time.perf_counter() - start) / count)
+        source.cleanup()
+    return {"frames": count, "unread_seconds_per_frame": summarize(unread_costs), "reread_seconds_per_frame": summarize(reread_costs)}
+
+def bench_skip(clip, repeat, seconds=15):
+    """;ff and ;rr of the longest allowed skip, frame by frame like they do"""
+    frames = seconds * FRAMES_PER_SECOND
+    forward = []
+    backward = []
+    for _ in range(repeat):
+        source = clip.source()
+        start = time.perf_counter()
+        for _ in range(frames):
+            if not source.read():
+                break
+        forward.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for _ in range(frames):
+            if not source.unread():
+                break
+        backward.append(time.perf_counter() - start)
+        source.cleanup()
+    return {"seconds": seconds, "frames": frames, "ff_seconds": summarize(forward), "rr_seconds": summarize(backward)}
+
+def bench_jump(clip, repeat):
+    """Time from starting a seeking FFmpeg (like ;jump) to its first frame"""
+    results = {}
+    positions = sorted({0, clip.seconds // 4, clip.seconds // 2, clip.seconds * 9 // 10})
+    for position in positions:
+        spawns = []
+        first_frames = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            source = clip.source(seek=position)
+            spawned = time.perf_counter()
+            source.read()
+            first_frames.append(time.perf_counter() - start)
+            spawns.append(spawned - start)
+            source.cleanup()
+        results[str(position)] = {"spawn_seconds": summarize(spawns), "first_frame_seconds": summarize(first_frames)}
+    return results
+
+def bench_memory(clip):
+    """Memory held by one source once its buffers are full"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    source = clip.source()
+    frames = min(source.MAX_BUF_SZ, clip.seconds * FRAMES_PER_SECOND - 1)
+    for _ in range(frames):
+        source.read()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    python_bytes = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    rss = rss_kib(source._process.pid)
+    source.cleanup()
+    return {
+        "buffered_frames": frames,
+        "python_bytes": python_bytes,
+        "python_bytes_per_frame": python_bytes / frames,
+        "ffmpeg_rss_kib": rss,
+    }
+
+def bench_filters(clip, repeat):
+    """FFmpeg CPU time and wall time to process the clip with each preset"""
+    results = {}
+    for preset in PRESETS:
+        cpus = []
+        walls = []
+        frames = 0
+        for _ in range(repeat):
+            cpu = children_cpu()
+            start = time.perf_counter()
+            source = clip.source(preset)
+            frames = read_all(source)
+            walls.append(time.perf_counter() - start)
+            # Waits for FFmpeg, which has to happen before its usage counts
+            source.cleanup()
+            if cpu is not None:
+                cpus.append(children_cpu() - cpu)
+        audio_seconds = frames / FRAMES_PER_SECOND
+        results[preset] = {
+            "frames": frames,
+            "wall_seconds": summarize(walls),
+            "ffmpeg_cpu_seconds": summarize(cpus) if cpus else None,
+            "ffmpeg_cpu_per_audio_second": statistics.median(cpus) / audio_seconds if cpus and audio_seconds else None,
+        }
+    return results
+
+BENCHMARKS = ("read", "unread", "skip", "jump", "memory", "filters")
+
+def ffmpeg_version(ffmpeg):
+    try:
+        output = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as exc:
+        sys.exit(f"Can't run {ffmpeg}: {exc}")
+    return output.partition("\n")[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_player", description=__doc__.partition("\n")[0])
+    parser.add_argument("-o", "--output", default="-", help="where to write the JSON results (default: stdout)")
+    parser.add_argument("--source", choices=("wav", "lavfi"), default="wav", help="generated WAV file or FFmpeg's sine generator (default: wav)")
+    parser.add_argument("--seconds", type=int, default=60, help="length of the clip (default: 60)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark (default: 5)")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="FFmpeg executable (default: ffmpeg)")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="benchmarks to run (default: all)")
+    args = parser.parse_args(argv)
+    if args.seconds < 20:
+        parser.error("--seconds must be at least 20 for the skip benchmarks")
+
+    results = {
+        "meta": {
+            "time": time.time(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "ffmpeg": ffmpeg_version(args.ffmpeg),
+            "source": args.source,
+            "seconds": args.seconds,
+            "repeat": args.repeat,
+        },
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        clip = Clip(args.source, args.seconds, directory, args.ffmpeg)
+        for name in args.only:
+            start = time.perf_counter()
+            if name == "memory":
+                results[name] = bench_memory(clip)
+            else:
+                results[name] = globals()[f"bench_{name}"](clip, args.repeat)
+            print(f"{name}: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            print(json.dumps(results[name], indent=2), file=sys.stderr)
+
+    text = json.dumps(results, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
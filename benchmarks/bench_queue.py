@@ -0,0 +1,233 @@
+"""Benchmarks for the queue commands at large queue sizes
+
+Builds a server's music state through `Music.get_info`, fills its queue with
+made up songs, and times the part of each command that works on the queue
+(everything but sending the reply) at increasing sizes:
+
+- append: adding a song with the duplicate check, like `;play`
+- contains: the duplicate check on its own
+- remove: `;remove` of the middle song
+- move: `;move` of the first song to the end
+- shuffle: `;shuffle`
+- queue: `;queue` building its pages
+- loop: moving the finished song to the back when looping, like the advancer
+
+It also measures the memory used per queued song. The table at the end has
+the median time per operation at each size, and how it grows with the size:
+0 means it takes the same time at any size, 1 means it grows linearly, and
+anything over 1 grows faster than the queue does.
+
+To try out another queue structure, pass `--queue-class module:Class`. It's
+used in place of `AudioQueue`, so it needs the same methods.
+
+Run it from the repo's root:
+
+    python -m benchmarks.bench_queue --sizes 1000 10000 100000 -o queue.json
+
+"""
+import sys
+import math
+import json
+import time
+import types
+import platform
+import argparse
+import importlib
+import statistics
+import tracemalloc
+
+from jgm.extensions.music import Audio, Music
+
+OPERATIONS = ("append", "contains", "remove", "move", "shuffle", "queue", "loop")
+
+async def _discard(*args, **kwargs):
+    pass
+
+def run(coro):
+    """Run a command that never suspends, without an event loop in the way"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("command suspended, it can't be timed like this")
+
+def make_music():
+    # Skips __init__, which starts the advancer. get_info only needs data.
+    music = Music.__new__(Music)
+    music.bot = types.SimpleNamespace(outbound=types.SimpleNamespace(send_pages=_discard))
+    music.data = {}
+    return music
+
+def make_ctx(guild_id):
+    return types.SimpleNamespace(
+        guild=types.SimpleNamespace(id=guild_id),
+        channel=types.SimpleNamespace(id=guild_id),
+        author=types.SimpleNamespace(id=1),
+        voice_client=object(),
+        send=_discard,
+    )
+
+def song(i):
+    # Real looking URLs so normalize_query does its usual work
+    return Audio("stream", f"https://www.youtube.com/watch?v={i:011d}", user_id=1)
+
+def fill(music, ctx, size, *, journal=False, queue_class=None):
+    info = music.get_info(ctx)
+    if queue_class is not None:
+        info.queue = queue_class()
+    info.queue.clear()
+    info.queue.journal = [] if journal else None
+    info.dedupe = "collapse"
+    # Something's playing, so adding songs doesn't schedule the advancer
+    info.current = song(-1)
+    music.enqueue_many(ctx, (song(i) for i in range(size)))
+    # Otherwise the journal would keep every op from filling it up
+    if journal:
+        info.queue.journal = []
+    return info
+
+def timed(func, repeat, *, setup=None):
+    """Return the median seconds func takes"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def bench_size(music, ctx, size, repeat, journal, queue_class):
+    info = fill(music, ctx, size, journal=journal, queue_class=queue_class)
+    queue = info.queue
+    middle = size // 2 + 1
+    results = {}
+
+    def trim():
+        while len(queue) > size:
+            queue.pop()
+
+    # New songs each time, the duplicate check has to miss
+    counter = iter(range(size, size + repeat))
+    def append():
+        audio = song(next(counter))
+        if music.check_duplicate(info, audio):
+            queue.append(audio)
+    results["append"] = timed(append, repeat, setup=trim)
+    trim()
+
+    probe = song(size // 3)
+    results["contains"] = timed(lambda: queue.contains(probe), repeat)
+
+    # Put the removed song back where it was between runs
+    removed = []
+    def put_back():
+        if len(queue) < size:
+            queue.insert(middle - 1, removed[0])
+        removed[:] = [queue[middle - 1]]
+    results["remove"] = timed(lambda: run(Music.remove.callback(music, ctx, middle)), repeat, setup=put_back)
+    queue.insert(middle - 1, removed[0])
+
+    results["move"] = timed(lambda: run(Music.move.callback(music, ctx, 1, size)), repeat)
+    # Moving them back from the end in turn undoes it
+    for _ in range(repeat):
+        run(Music.move.callback(music, ctx, size, 1))
+
+    results["shuffle"] = timed(lambda: music.shuffle_helper(queue), repeat)
+    results["queue"] = timed(lambda: run(Music.queue.callback(music, ctx)), repeat)
+
+    info.loop = 1
+    def loop():
+        info.current = queue.popleft()
+        queue.append(info.current)
+    results["loop"] = timed(loop, repeat)
+    info.loop = 0
+    return results
+
+def memory_per_song(music, ctx, size, queue_class):
+    """Return the bytes allocated per queued song, including the dedupe index"""
+    music.pop_info(ctx)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    fill(music, ctx, size, queue_class=queue_class)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    music.pop_info(ctx)
+    return total / size
+
+def growth(sizes, times):
+    """Return the exponent k in time ~ size**k, fitted to the first and last"""
+    if len(sizes) < 2 or times[0] <= 0 or times[-1] <= 0:
+        return None
+    return math.log(times[-1] / times[0]) / math.log(sizes[-1] / sizes[0])
+
+def format_seconds(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f}us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds:.2f}s"
+
+def table(sizes, results, memory):
+    rows = [["operation", *(f"{size:,}" for size in sizes), "growth"]]
+    for operation in OPERATIONS:
+        times = [results[str(size)][operation] for size in sizes]
+        exponent = growth(sizes, times)
+        flag = "" if exponent is None else f"{exponent:.2f}{' !' if exponent > 1.2 else ''}"
+        rows.append([operation, *map(format_seconds, times), flag])
+    rows.append(["bytes/song", *(f"{memory[str(size)]:.0f}" for size in sizes), ""])
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) if column == 0 else cell.rjust(width) for column, (cell, width) in enumerate(zip(row, widths)))
+        for row in rows
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_queue", description=__doc__.partition("\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="queue sizes (default: 1000 10000 100000)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each operation at each size (default: 5)")
+    parser.add_argument("--journal", action="store_true", help="journal queue changes like the session extension does")
+    parser.add_argument("--queue-class", help="module:Class to use instead of AudioQueue")
+    parser.add_argument("-o", "--output", help="also write the results as JSON here")
+    args = parser.parse_args(argv)
+    sizes = sorted(args.sizes)
+    queue_class = None
+    if args.queue_class is not None:
+        module, _, name = args.queue_class.partition(":")
+        queue_class = getattr(importlib.import_module(module), name)
+
+    music = make_music()
+    ctx = make_ctx(1)
+    results = {}
+    memory = {}
+    for size in sizes:
+        start = time.perf_counter()
+        results[str(size)] = bench_size(music, ctx, size, args.repeat, args.journal, queue_class)
+        memory[str(size)] = memory_per_song(music, ctx, size, queue_class)
+        print(f"{size:,} songs: {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    print(table(sizes, results, memory))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump({
+                "meta": {
+                    "time": time.time(),
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "repeat": args.repeat,
+                    "journal": args.journal,
+                    "queue_class": args.queue_class or "jgm.extensions.music:AudioQueue",
+                },
+                "seconds": results,
+                "bytes_per_song": memory,
+                "growth": {
+                    operation: growth(sizes, [results[str(size)][operation] for size in sizes])
+                    for operation in OPERATIONS
+                },
+            }, file, indent=2)
+            file.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,69 @@
+import os
+import sys
+import asyncio
+import argparse
+
 from jgm.jgmusic import *
 
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m jgm",
+        description="Runs JoshGone, or moves playlists in and out of its database (JOSHGONE_DB)",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    export = subparsers.add_parser("export", help="write playlists as JSON Lines")
+    export.add_argument("file", nargs="?", default="-", help="where to write them (default: stdout)")
+    export.add_argument("--guild", type=int, help="only this server's playlists")
+    import_ = subparsers.add_parser("import", help="add playlists from JSON Lines, skipping existing ones")
+    import_.add_argument("file", nargs="?", default="-", help="where to read them from (default: stdin)")
+    import_.add_argument("--guild", type=int, help="put every playlist in this server")
+    cluster = subparsers.add_parser("cluster", help="run the bot as several processes and restart them if they crash")
+    cluster.add_argument("--processes", type=int, default=os.cpu_count(), help="number of worker processes (default: one per core)")
+    cluster.add_argument("--shards", type=int, help="total number of shards (default: what Discord recommends)")
+    return parser
+
+async def _export(path, guild_id):
+    from jgm.extensions.playlists import export_playlists
+    pool = DatabasePool(os.environ["JOSHGONE_DB"], readers=1)
+    file = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+    try:
+        count = 0
+        async with pool.read() as db:
+            async for line in export_playlists(db, guild_id):
+                file.write(line)
+                count += 1
+    finally:
+        if file is not sys.stdout:
+            file.close()
+        await pool.close()
+    print(f"Exported {count} playlists.", file=sys.stderr)
+
+async def _import(path, guild_id):
+    from jgm.extensions.playlists import MAX_PLAYLISTS, read_playlists, import_playlists
+    pool = DatabasePool(os.environ["JOSHGONE_DB"], readers=1)
+    file = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        # Read line by line as the chunks get written
+        servers, skipped, full = await import_playlists(pool, read_playlists(file, guild_id))
+    finally:
+        if file is not sys.stdin:
+            file.close()
+        await pool.close()
+    print(f"Imported {sum(servers.values())} playlists into {len(servers)} servers, skipped {skipped} that already exist.", file=sys.stderr)
+    for guild_id, count in full.items():
+        print(f"Skipped {count} playlists for server {guild_id}, which has {MAX_PLAYLISTS} already.", file=sys.stderr)
+
 if __name__ == "__main__":
-    main()
+    args = _parser().parse_args()
+    if args.command == "export":
+        asyncio.run(_export(args.file, args.guild))
+    elif args.command == "import":
+        try:
+            asyncio.run(_import(args.file, args.guild))
+        except ValueError as exc:
+            sys.exit(f"Import stopped: {exc}")
+    elif args.command == "cluster":
+        from jgm.cluster import supervise
+        supervise(os.environ["JOSHGONE_TOKEN"], args.processes, args.shards)
+    else:
+        main()
@@ -0,0 +1,140 @@
+"""Runs the bot as several processes, each connected to some of the shards
+
+One process means one event loop and one GIL for every voice connection, so
+past a certain number of servers the bot can't keep up no matter how many
+cores there are. `supervise` starts a worker process per group of shards
+(`python -m jgm` with the `JOSHGONE_WORKER`, `JOSHGONE_SHARD_IDS` and
+`JOSHGONE_SHARD_COUNT` variables set) and restarts workers that crash. A worker
+that exits cleanly (`;shutdown`) is left stopped.
+
+Workers share the SQLite database, and the `cluster` extension uses it to pass
+owner commands between them.
+
+"""
+import os
+import sys
+import time
+import signal
+import asyncio
+import subprocess
+
+import discord
+
+__all__ = ("shard_of", "owns_guild", "split_shards", "recommended_shards", "supervise")
+
+# Seconds between starting workers, so their shards don't all identify at once
+START_DELAY = 5
+# Seconds a worker has to run for before a crash resets its restart delay
+STABLE_AFTER = 60
+MAX_RESTART_DELAY = 60
+
+def shard_of(guild_id, shard_count):
+    """Return the shard a server is on"""
+    return (guild_id >> 22) % shard_count
+
+def owns_guild(bot, guild_id):
+    """Whether this process is connected to the shard the server is on"""
+    shard_ids = getattr(bot, "shard_ids", None)
+    if shard_ids is None or bot.shard_count is None:
+        return True
+    return shard_of(guild_id, bot.shard_count) in shard_ids
+
+def split_shards(shard_count, processes):
+    """Split the shards into contiguous groups, one per process"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    groups = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (i < extra)
+        groups.append(list(range(start, end)))
+        start = end
+    return groups
+
+async def recommended_shards(token):
+    """Ask Discord how many shards the bot should have"""
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    try:
+        await http.static_login(token)
+        shards, _ = await http.get_bot_gateway()
+    finally:
+        await http.close()
+    return shards
+
+class Worker:
+    def __init__(self, worker_id, shard_ids, shard_count):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.started_at = 0
+        self.restart_delay = 1
+        # When to start again after a crash
+        self.restart_at = None
+
+    def start(self):
+        env = os.environ | {
+            "JOSHGONE_WORKER": str(self.worker_id),
+            "JOSHGONE_SHARD_IDS": ",".join(map(str, self.shard_ids)),
+            "JOSHGONE_SHARD_COUNT": str(self.shard_count),
+        }
+        self.process = subprocess.Popen([sys.executable, "-m", "jgm"], env=env)
+        self.started_at = time.monotonic()
+        self.restart_at = None
+        print(f"[cluster] Started worker {self.worker_id} (pid {self.process.pid}, shards {self.shard_ids[0]}-{self.shard_ids[-1]}).")
+
+    def check(self):
+        """Restarts the worker if it crashed, returns whether it's still wanted"""
+        if self.restart_at is not None:
+            if time.monotonic() >= self.restart_at:
+                self.start()
+            return True
+        code = self.process.poll()
+        if code is None:
+            return True
+        if code == 0:
+            print(f"[cluster] Worker {self.worker_id} shut down.")
+            return False
+        # Back off if it keeps crashing right away
+        if time.monotonic() - self.started_at > STABLE_AFTER:
+            self.restart_delay = 1
+        print(f"[cluster] Worker {self.worker_id} exited with code {code}, restarting in {self.restart_delay}s.")
+        self.restart_at = time.monotonic() + self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, MAX_RESTART_DELAY)
+        return True
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+def supervise(token, processes, shard_count=None):
+    """Runs the workers until they have all shut down"""
+    if shard_count is None:
+        shard_count = asyncio.run(recommended_shards(token))
+    groups = split_shards(shard_count, processes)
+    print(f"[cluster] Running {shard_count} shards in {len(groups)} processes.")
+    workers = [Worker(i, shard_ids, shard_count) for i, shard_ids in enumerate(groups)]
+
+    # Stop the workers when asked to stop, instead of leaving them running
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        for i, worker in enumerate(workers):
+            if i:
+                time.sleep(START_DELAY)
+            worker.start()
+        while workers:
+            time.sleep(1)
+            workers = [worker for worker in workers if worker.check()]
+    except KeyboardInterrupt:
+        print("[cluster] Stopping workers.")
+        for worker in workers:
+            worker.stop()
+        for worker in workers:
+            if worker.process is not None:
+                try:
+                    worker.process.wait(10)
+                except subprocess.TimeoutExpired:
+                    worker.process.kill()
@@ -0,0 +1,126 @@
+"""Bot-wide pool of SQLite connections
+
+Opening a connection with aiosqlite starts a thread and makes SQLite read the
+schema again, which used to happen on every single command. Instead, the bot
+keeps a few long-lived connections around (as `bot.db`):
+
+- `read()` lends out one of several read-only connections, so reads run
+  concurrently with each other and with the writer
+- `write()` lends out the single writer connection, one user at a time, and
+  commits when the block exits (or rolls back if it raised)
+
+The database is put in WAL mode so that readers and the writer don't block each
+other, and each connection keeps a cache of prepared statements.
+
+"""
+import asyncio
+import contextlib
+import time
+
+import aiosqlite
+
+from jgm.metrics import DB_BORROW_SECONDS
+from jgm.regex import regexp
+
+__all__ = ("DatabasePool", "deadline")
+
+# Run on every connection when it is opened
+PRAGMAS = (
+    # Readers see the last commit while a write is in progress
+    "PRAGMA journal_mode = WAL;",
+    # Safe with WAL, a power loss can only drop the last few commits
+    "PRAGMA synchronous = NORMAL;",
+    # Wait on locks held by other processes (e.g. yoyo) instead of failing
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA temp_store = MEMORY;",
+    # 8 MiB page cache per connection
+    "PRAGMA cache_size = -8192;",
+)
+
+class DatabasePool:
+    def __init__(self, path, *, readers=3, cached_statements=256):
+        self.path = path
+        self.readers = readers
+        # Prepared statements kept per connection by the sqlite3 module
+        self.cached_statements = cached_statements
+        self.writer = None
+        self.idle = None
+        self.connections = []
+        self.write_lock = asyncio.Lock()
+        self.open_lock = asyncio.Lock()
+
+    async def connect(self, *, readonly=False):
+        db = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        if readonly:
+            await db.execute("PRAGMA query_only = ON;")
+        # Makes `X REGEXP Y` work
+        await db.create_function("regexp", 2, regexp, deterministic=True)
+        self.connections.append(db)
+        return db
+
+    async def open(self):
+        """Opens the connections if they aren't open yet"""
+        if self.writer is not None:
+            return
+        async with self.open_lock:
+            if self.writer is not None:
+                return
+            # The writer goes first so WAL mode is set before the readers open
+            writer = await self.connect()
+            idle = asyncio.Queue()
+            for _ in range(self.readers):
+                idle.put_nowait(await self.connect(readonly=True))
+            self.idle = idle
+            self.writer = writer
+
+    async def close(self):
+        connections, self.connections = self.connections, []
+        self.writer = None
+        self.idle = None
+        for db in connections:
+            await db.close()
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        """Borrows a read-only connection"""
+        await self.open()
+        idle = self.idle
+        db = await idle.get()
+        try:
+            with DB_BORROW_SECONDS.time("read"):
+                yield db
+        finally:
+            idle.put_nowait(db)
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        """Borrows the writer connection and commits when done"""
+        await self.open()
+        async with self.write_lock:
+            db = self.writer
+            with DB_BORROW_SECONDS.time("write"):
+                try:
+                    yield db
+                except BaseException:
+                    await db.rollback()
+                    raise
+                await db.commit()
+
+@contextlib.asynccontextmanager
+async def deadline(db, seconds):
+    """Interrupts queries on db that are still running after some seconds
+
+    An interrupted query raises `sqlite3.OperationalError("interrupted")`. A
+    Python function called by the query (like REGEXP) can't be interrupted
+    while it runs, only between calls, so keep those quick.
+
+    """
+    end = time.monotonic() + seconds
+    # Checked every 1000 SQLite instructions, a true value interrupts
+    await db.set_progress_handler(lambda: time.monotonic() > end, 1000)
+    try:
+        yield db
+    finally:
+        await db.set_progress_handler(None, 0)
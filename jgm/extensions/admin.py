@@ -1,12 +1,15 @@
 import asyncio
 import os
+import io
 import pydoc
 import functools
+import tracemalloc
 
-import yoyo
 import discord
 from discord.ext import commands
 
+from jgm.profiling import sample, format_samples, dump_stacks
+
 @functools.wraps(pydoc.render_doc)
 def helps(*args, **kwargs):
     stack = []
@@ -24,17 +27,34 @@ async def pages(ctx, obj):
     paginator = commands.Paginator()
     for line in obj.splitlines():
         paginator.add_line(line)
-    for page in paginator.pages:
-        await ctx.send(page)
+    await ctx.bot.outbound.send_pages(ctx.channel, paginator.pages)
+
+async def send_file(ctx, message, text, filename):
+    """Sends text as an attachment"""
+    await ctx.send(message, file=discord.File(io.BytesIO(text.encode()), filename=filename))
 
 class Admin(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.profiling = False
+        # Last tracemalloc snapshot, for `;memory diff`
+        self.snapshot = None
+
+    async def fan_out(self, ctx, op, arg=None):
+        """Runs op on every worker if this is a cluster, returns whether it was"""
+        cluster = self.bot.get_cog("Cluster")
+        if cluster is None:
+            return False
+        replies = await cluster.broadcast(op, arg)
+        await pages(ctx, "\n".join(f"Worker {worker_id}: {reply}" for worker_id, reply in replies.items()))
+        return True
 
     @commands.command(hidden=True)
     @commands.is_owner()
     async def load(self, ctx, *, module: str):
+        if await self.fan_out(ctx, "load", module):
+            return
         # `wrap_async` because ..._extension used to be sync in v1.x
         await self.bot.wrap_async(self.bot.load_extension(f"jgm.extensions.{module}"))
         await ctx.send("Extension loaded.")
@@ -42,6 +62,8 @@ class Admin(commands.Cog):
     @commands.command(hidden=True)
     @commands.is_owner()
     async def unload(self, ctx, *, module: str):
+        if await self.fan_out(ctx, "unload", module):
+            return
         # `wrap_async` because ..._extension used to be sync in v1.x
         await self.bot.wrap_async(self.bot.unload_extension(f"jgm.extensions.{module}"))
         await ctx.send("Extension unloaded.")
@@ -49,6 +71,8 @@ class Admin(commands.Cog):
     @commands.command(hidden=True)
     @commands.is_owner()
     async def reload(self, ctx, *, module: str):
+        if await self.fan_out(ctx, "reload", module):
+            return
         # `wrap_async` because ..._extension used to be sync in v1.x
         await self.bot.wrap_async(self.bot.reload_extension(f"jgm.extensions.{module}"))
         await ctx.send("Extension reloaded.")
@@ -56,15 +80,87 @@ class Admin(commands.Cog):
     @commands.command(hidden=True)
     @commands.is_owner()
     async def extensions(self, ctx):
+        if await self.fan_out(ctx, "extensions"):
+            return
         extensions = ", ".join(self.bot.extensions)
         await ctx.send(f"Extensions loaded: [{extensions}]")
 
     @commands.command(hidden=True)
     @commands.is_owner()
     async def shutdown(self, ctx):
+        # Every worker closes itself once it has replied
+        if await self.fan_out(ctx, "shutdown"):
+            return
         await ctx.send("Shutting bot down.")
         await self.bot.close()
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: float = 30):
+        if not 0 < seconds <= 300:
+            raise commands.CommandError(f"Seconds [{seconds}] not in the range (0, 300]")
+        if self.profiling:
+            raise commands.CommandError("Already profiling")
+        self.profiling = True
+        try:
+            await ctx.send(f"Profiling every thread for {seconds}s.")
+            stacks = await asyncio.to_thread(sample, seconds)
+        finally:
+            self.profiling = False
+        await send_file(ctx, "Profile:", format_samples(stacks, seconds), "profile.txt")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def stacks(self, ctx):
+        await send_file(ctx, "Stacks:", dump_stacks(), "stacks.txt")
+
+    @commands.group(hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def memory(self, ctx):
+        status = "on" if tracemalloc.is_tracing() else "off"
+        current, peak = tracemalloc.get_traced_memory()
+        await ctx.send(f"Tracing allocations is {status}. Traced: {current / 2**20:.1f} MiB (peak {peak / 2**20:.1f} MiB)")
+
+    @memory.command(name="start")
+    @commands.is_owner()
+    async def memory_start(self, ctx, frames: int = 1):
+        # Slows down every allocation until stopped
+        tracemalloc.start(frames)
+        self.snapshot = None
+        await ctx.send(f"Tracing allocations ({frames} frames each).")
+
+    @memory.command(name="stop")
+    @commands.is_owner()
+    async def memory_stop(self, ctx):
+        tracemalloc.stop()
+        self.snapshot = None
+        await ctx.send("Stopped tracing allocations.")
+
+    @memory.command(name="snapshot")
+    @commands.is_owner()
+    async def memory_snapshot(self, ctx, top: int = 50):
+        if not tracemalloc.is_tracing():
+            raise commands.CommandError("Not tracing allocations, use `;memory start` first")
+        self.snapshot = tracemalloc.take_snapshot()
+        stats = self.snapshot.statistics("lineno")
+        total = sum(stat.size for stat in stats)
+        lines = [f"{total / 2**20:.1f} MiB in {len(stats)} places, top {top}:"]
+        lines += map(str, stats[:top])
+        await send_file(ctx, "Snapshot taken:", "\n".join(lines), "snapshot.txt")
+
+    @memory.command(name="diff")
+    @commands.is_owner()
+    async def memory_diff(self, ctx, top: int = 50):
+        if self.snapshot is None:
+            raise commands.CommandError("No snapshot to compare to, use `;memory snapshot` first")
+        snapshot = tracemalloc.take_snapshot()
+        stats = snapshot.compare_to(self.snapshot, "lineno")
+        self.snapshot = snapshot
+        change = sum(stat.size_diff for stat in stats)
+        lines = [f"{change / 2**20:+.1f} MiB since the last snapshot, top {top}:"]
+        lines += map(str, stats[:top])
+        await send_file(ctx, "Compared to the last snapshot:", "\n".join(lines), "diff.txt")
+
     @commands.command(hidden=True)
     @commands.is_owner()
     async def ctx_(self, ctx):
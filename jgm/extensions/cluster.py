@@ -0,0 +1,138 @@
+"""Passes owner commands between the processes of a cluster
+
+Only loaded in workers started by `python -m jgm cluster`. A command is fanned
+out by inserting it into `cluster_commands`; every worker polls that table,
+runs new commands and writes its answer to `cluster_replies`. Workers also
+keep their row in `cluster_workers` fresh, which is how the sender knows how
+many answers to wait for.
+
+"""
+import os
+import json
+import time
+import asyncio
+import traceback
+
+from discord.ext import commands
+from discord.ext import tasks
+
+# A worker that hasn't sent a heartbeat in this many seconds is gone
+HEARTBEAT_TIMEOUT = 30
+# Polls between heartbeats
+HEARTBEAT_EVERY = 10
+# Commands older than this many seconds are deleted
+KEEP_COMMANDS = 3600
+
+class Cluster(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.worker_id = int(os.environ["JOSHGONE_WORKER"])
+        # Commands up to this ID have been run (or were sent before we started)
+        self.last_seen = None
+        self.poller.start()
+
+    async def cog_unload(self):
+        self.poller.cancel()
+
+    @tasks.loop(seconds=1)
+    async def poller(self):
+        try:
+            if self.poller.current_loop % HEARTBEAT_EVERY == 0:
+                await self.heartbeat()
+            async with self.bot.db.read() as db:
+                async with db.execute(
+                    "SELECT command_id, op, arg FROM cluster_commands WHERE command_id > ? ORDER BY command_id;",
+                    (self.last_seen,),
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            for command_id, op, arg in rows:
+                self.last_seen = command_id
+                # Separate task, so `reload cluster` doesn't cancel itself
+                # before answering
+                asyncio.create_task(self.execute(command_id, op, arg))
+        except Exception as exc:
+            print("Exception occured while polling cluster commands:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+
+    @poller.before_loop
+    async def before_poller(self):
+        async with self.bot.db.read() as db:
+            async with db.execute("SELECT COALESCE(MAX(command_id), 0) FROM cluster_commands;") as cursor:
+                [self.last_seen] = await cursor.fetchone()
+
+    async def heartbeat(self):
+        now = time.time()
+        async with self.bot.db.write() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO cluster_workers (worker_id, pid, shard_ids, heartbeat_at) VALUES (?, ?, ?, ?);",
+                (self.worker_id, os.getpid(), json.dumps(self.bot.shard_ids), now),
+            )
+            if self.worker_id == 0:
+                await db.execute(
+                    "DELETE FROM cluster_replies WHERE command_id IN (SELECT command_id FROM cluster_commands WHERE issued_at < ?);",
+                    (now - KEEP_COMMANDS,),
+                )
+                await db.execute("DELETE FROM cluster_commands WHERE issued_at < ?;", (now - KEEP_COMMANDS,))
+
+    async def execute(self, command_id, op, arg):
+        try:
+            reply = await self.run(op, arg)
+        except Exception as exc:
+            reply = f"Oops, an error occurred: `{exc!r}`"
+        async with self.bot.db.write() as db:
+            await db.execute(
+                "INSERT OR REPLACE INTO cluster_replies (command_id, worker_id, reply) VALUES (?, ?, ?);",
+                (command_id, self.worker_id, reply),
+            )
+        if op == "shutdown":
+            # Give the sender a moment to collect the replies
+            await asyncio.sleep(2)
+            await self.bot.close()
+
+    async def run(self, op, arg):
+        """Runs a fanned out command here, returning the reply"""
+        if op == "extensions":
+            return f"Extensions loaded: [{', '.join(self.bot.extensions)}]"
+        if op in ("load", "unload", "reload"):
+            await getattr(self.bot, f"{op}_extension")(f"jgm.extensions.{arg}")
+            return f"Extension {op}ed."
+        if op == "shutdown":
+            return "Shutting down."
+        raise ValueError(f"unknown cluster command: {op!r}")
+
+    async def broadcast(self, op, arg=None, *, timeout=10):
+        """Runs a command on every worker, returning worker ID -> reply
+
+        Waits until every live worker has answered, or for timeout seconds.
+
+        """
+        now = time.time()
+        async with self.bot.db.write() as db:
+            async with db.execute(
+                "INSERT INTO cluster_commands (op, arg, issued_at) VALUES (?, ?, ?);",
+                (op, arg, now),
+            ) as cursor:
+                command_id = cursor.lastrowid
+            async with db.execute(
+                "SELECT worker_id FROM cluster_workers WHERE heartbeat_at >= ?;",
+                (now - HEARTBEAT_TIMEOUT,),
+            ) as cursor:
+                workers = {worker_id async for [worker_id] in cursor}
+        # Including ourselves, even if the first heartbeat is still pending
+        workers.add(self.worker_id)
+        replies = {}
+        end = time.monotonic() + timeout
+        while not workers <= replies.keys() and time.monotonic() < end:
+            await asyncio.sleep(0.5)
+            async with self.bot.db.read() as db:
+                async with db.execute(
+                    "SELECT worker_id, reply FROM cluster_replies WHERE command_id = ?;",
+                    (command_id,),
+                ) as cursor:
+                    replies = {worker_id: reply async for worker_id, reply in cursor}
+        for worker_id in workers - replies.keys():
+            replies[worker_id] = "No reply."
+        return dict(sorted(replies.items()))
+
+def setup(bot):
+    return bot.add_cog(Cluster(bot))
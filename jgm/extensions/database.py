@@ -1,29 +1,69 @@
-import os
+import time
+import json
+import asyncio
+import traceback
 
-import aiosqlite
 from discord.ext import commands
 
 class Database(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.sync_task = None
+
+    async def cog_unload(self):
+        if self.sync_task is not None:
+            self.sync_task.cancel()
 
     @commands.Cog.listener()
     async def on_ready(self):
-        # Ensure that guilds the bot was previous in have been initialized
-        for guild in self.bot.guilds:
-            await self.on_guild_join(guild)
+        # Ensure that guilds the bot was previous in have been initialized.
+        # This runs in the background so other on_ready listeners don't wait
+        # on it, and restarts if on_ready fires again on a reconnect.
+        if self.sync_task is not None:
+            self.sync_task.cancel()
+        self.sync_task = asyncio.create_task(self.sync_guilds())
+
+    async def sync_guilds(self):
+        """Makes the server table match the guilds the bot is in"""
+        start = time.perf_counter()
+        guild_ids = [guild.id for guild in self.bot.guilds]
+        try:
+            # One transaction for all of them instead of a commit per guild
+            async with self.bot.db.write() as db:
+                async with db.executemany(
+                    "INSERT OR IGNORE INTO server (server_id) VALUES (?);",
+                    [(guild_id,) for guild_id in guild_ids],
+                ) as cursor:
+                    added = max(cursor.rowcount, 0)
+                removed = 0
+                # Without the guilds intent the guild list is always empty
+                if self.bot.intents.guilds:
+                    condition = "server_id NOT IN (SELECT value FROM json_each(?))"
+                    params = [json.dumps(guild_ids)]
+                    # In a cluster, servers on other workers' shards aren't
+                    # in our guild list
+                    shard_ids = getattr(self.bot, "shard_ids", None)
+                    if shard_ids is not None:
+                        condition += " AND (server_id >> 22) % ? IN (SELECT value FROM json_each(?))"
+                        params += [self.bot.shard_count, json.dumps(shard_ids)]
+                    async with db.execute(f"DELETE FROM server WHERE {condition};", params) as cursor:
+                        removed = cursor.rowcount
+        except Exception as exc:
+            print("Exception occured while syncing guilds:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+            return
+        elapsed = time.perf_counter() - start
+        print(f"Synced {len(guild_ids)} guilds in {elapsed * 1000:.1f}ms ({added} added, {removed} removed).")
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+        async with self.bot.db.write() as db:
             await db.execute("INSERT OR IGNORE INTO server (server_id) VALUES (?);", (guild.id,))
-            await db.commit()
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+        async with self.bot.db.write() as db:
             await db.execute("DELETE FROM server WHERE server_id = ?;", (guild.id,))
-            await db.commit()
 
     @commands.command(ignore_extra=False, hidden=True)
     @commands.is_owner()
@@ -0,0 +1,169 @@
+"""Records every played song in the database
+
+Songs are reported by the music extension through the `song_played` event and
+buffered in memory, then written in batches so playback never waits on the
+database. Triggers on `play_history` keep the per-song and per-user rollups up
+to date, so the stats commands never have to scan the full history.
+
+"""
+import time
+import math
+import typing
+import traceback
+from collections import OrderedDict
+
+import discord
+from discord.ext import commands
+from discord.ext import tasks
+from discord.ext.commands import BucketType
+
+from jgm.extensions.music import seconds_to_hhmmss
+
+# Pages of history whose last song is remembered, so the next page can start
+# right after it
+MAX_CURSORS = 256
+
+class History(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # Rows waiting to be written by the flusher
+        self.pending = []
+        # (server ID, songs per page, page) -> play_id of its last song
+        self.cursors = OrderedDict()
+        self.flusher.start()
+
+    async def cog_unload(self):
+        self.flusher.cancel()
+        await self.flush()
+
+    @commands.Cog.listener()
+    async def on_song_played(self, guild_id, ty, query, user_id, seconds, filter_data):
+        self.pending.append((
+            guild_id, int(time.time()), ty, query, user_id, seconds,
+            filter_data.filter_name, filter_data.tempo, filter_data.pitch,
+        ))
+
+    @tasks.loop(seconds=5)
+    async def flusher(self):
+        try:
+            await self.flush()
+        except Exception as exc:
+            print("Exception occured while saving play history:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        async with self.bot.db.write() as db:
+            await db.executemany(
+                '''INSERT INTO play_history (server_id, played_at, ty, query, user_id, seconds_played, filter_name, tempo, pitch)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);''',
+                rows,
+            )
+        # New plays shift every page of those servers down, so the cursors
+        # would start pages in the wrong place
+        guild_ids = {row[0] for row in rows}
+        for key in [key for key in self.cursors if key[0] in guild_ids]:
+            del self.cursors[key]
+
+    async def send_history(self, ctx, per_page, page):
+        """Sends one page of the server's play history, newest first"""
+        if per_page <= 0:
+            raise commands.CommandError(f"Cannot display last {per_page} songs")
+        if page <= 0:
+            raise commands.CommandError(f"Page [{page}] not a positive integer")
+        # So the song that just ended shows up
+        await self.flush()
+        async with self.bot.db.read() as db:
+            async with db.execute("SELECT COALESCE(SUM(plays), 0) FROM play_counts WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
+                [played] = await cursor.fetchone()
+            if not played:
+                await ctx.send("No playback history")
+                return
+            pages = math.ceil(played / per_page)
+            paginator = commands.Paginator()
+            paginator.add_line(f"Playback history (page {page}/{pages}, {played} played):")
+            after = await self.page_start(db, ctx.guild.id, per_page, page)
+            async with db.execute(
+                "SELECT play_id, ty, query FROM play_history WHERE server_id = ? AND play_id < ? ORDER BY play_id DESC LIMIT ?;",
+                (ctx.guild.id, after, per_page),
+            ) as cursor:
+                i = (page - 1) * per_page
+                async for play_id, ty, query in cursor:
+                    i += 1
+                    paginator.add_line(f"{i}: {query} {f'({ty})' if ty == 'local' else ''}")
+        if i > (page - 1) * per_page:
+            self.cursors[ctx.guild.id, per_page, page] = play_id
+            self.cursors.move_to_end((ctx.guild.id, per_page, page))
+            if len(self.cursors) > MAX_CURSORS:
+                self.cursors.popitem(last=False)
+        await self.bot.outbound.send_pages(ctx.channel, paginator.pages)
+
+    async def page_start(self, db, guild_id, per_page, page):
+        """Return the play_id a page's songs come before
+
+        Paging forward continues from the last song of the page before it. Any
+        other page is found by skipping along the (server_id, play_id) index,
+        which doesn't read the rows themselves.
+
+        """
+        if page == 1:
+            return math.inf
+        play_id = self.cursors.get((guild_id, per_page, page - 1))
+        if play_id is not None:
+            return play_id
+        async with db.execute(
+            "SELECT play_id FROM play_history WHERE server_id = ? ORDER BY play_id DESC LIMIT 1 OFFSET ?;",
+            (guild_id, (page - 1) * per_page - 1),
+        ) as cursor:
+            row = await cursor.fetchone()
+        return 0 if row is None else row[0]
+
+    @commands.command(aliases=["top"])
+    @commands.cooldown(1, 1, BucketType.user)
+    async def top_tracks(self, ctx, amount: int = 10):
+        """Shows the most played songs in this server"""
+        if not 1 <= amount <= 100:
+            raise commands.CommandError(f"Amount [{amount}] not in the range [1, 100].")
+        await self.flush()
+        paginator = commands.Paginator()
+        paginator.add_line(f"Top {amount} songs:")
+        async with self.bot.db.read() as db:
+            async with db.execute(
+                "SELECT ty, query, plays, seconds_played FROM play_counts WHERE server_id = ? ORDER BY plays DESC LIMIT ?;",
+                (ctx.guild.id, amount),
+            ) as cursor:
+                i = 0
+                async for ty, query, plays, seconds in cursor:
+                    i += 1
+                    paginator.add_line(f"{i}: {query} {f'({ty}) ' if ty == 'local' else ''}[{plays} plays, {seconds_to_hhmmss(seconds)} listened]")
+        if not i:
+            paginator.add_line("None")
+        await self.bot.outbound.send_pages(ctx.channel, paginator.pages)
+
+    @commands.command(aliases=["ustats"])
+    @commands.cooldown(1, 1, BucketType.user)
+    async def user_stats(self, ctx, user: typing.Optional[discord.User] = None):
+        """Shows how many songs someone has queued in this server"""
+        user = user or ctx.author
+        await self.flush()
+        async with self.bot.db.read() as db:
+            async with db.execute(
+                "SELECT plays, seconds_played FROM user_play_counts WHERE server_id = ? AND user_id = ?;",
+                (ctx.guild.id, user.id),
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                await ctx.send(f"{user.name} hasn't queued any songs yet")
+                return
+            plays, seconds = row
+            async with db.execute(
+                "SELECT query FROM play_history WHERE server_id = ? AND user_id = ? ORDER BY play_id DESC LIMIT 1;",
+                (ctx.guild.id, user.id),
+            ) as cursor:
+                [last] = await cursor.fetchone()
+        await ctx.send(f"{user.name} queued {plays} played songs ({seconds_to_hhmmss(seconds)} listened), most recently {last}")
+
+def setup(bot):
+    return bot.add_cog(History(bot))
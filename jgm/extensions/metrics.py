@@ -0,0 +1,92 @@
+"""Serves the bot's metrics to Prometheus
+
+Set `JOSHGONE_METRICS` to a port (or `host:port`, the host defaults to
+127.0.0.1) and the metrics from `jgm.metrics` are served at `/metrics`. Cluster
+workers add their worker number to the port. Without it, metrics are still
+recorded, just not served.
+
+"""
+import os
+import traceback
+
+from aiohttp import web
+from discord.ext import commands
+from discord.ext import tasks
+
+from jgm.metrics import REGISTRY, COMMANDS, VOICE_CLIENTS, QUEUE_LENGTH, guild_label
+
+class Metrics(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.runner = None
+
+    async def cog_load(self):
+        address = os.environ.get("JOSHGONE_METRICS")
+        if address:
+            await self.start_server(address)
+        # Only once the server is up, since nothing cleans up after a cog_load
+        # that failed
+        REGISTRY.collectors.append(self.collect)
+        self.drainer.start()
+
+    async def start_server(self, address):
+        host, _, port = address.rpartition(":")
+        port = int(port) + int(os.environ.get("JOSHGONE_WORKER", "0"))
+        app = web.Application()
+        app.router.add_get("/metrics", self.serve)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, host or "127.0.0.1", port).start()
+        except BaseException:
+            # Like the port being taken
+            await self.runner.cleanup()
+            self.runner = None
+            raise
+        print(f"Serving metrics on http://{host or '127.0.0.1'}:{port}/metrics")
+
+    async def cog_unload(self):
+        self.drainer.cancel()
+        if self.collect in REGISTRY.collectors:
+            REGISTRY.collectors.remove(self.collect)
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+    # Keeps the recorded values from piling up between scrapes
+    @tasks.loop(seconds=10)
+    async def drainer(self):
+        REGISTRY.drain()
+
+    def collect(self):
+        VOICE_CLIENTS.set(len(self.bot.voice_clients))
+        lengths = {}
+        for guild_id, info in getattr(self.bot, "_music_data", {}).items():
+            # Left behind by an older version, converted on next use
+            if isinstance(info, dict):
+                continue
+            label = guild_label(guild_id)
+            lengths[label] = lengths.get(label, 0) + len(info.queue)
+        QUEUE_LENGTH.clear()
+        for label, length in lengths.items():
+            QUEUE_LENGTH.set(length, label)
+
+    async def serve(self, request):
+        try:
+            body = REGISTRY.render()
+        except Exception as exc:
+            traceback.print_exception(None, exc, exc.__traceback__)
+            raise web.HTTPInternalServerError()
+        return web.Response(text=body, content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        COMMANDS.inc(ctx.command.qualified_name, "ok")
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        # Unknown commands would make a label value out of anything typed
+        if ctx.command is not None:
+            COMMANDS.inc(ctx.command.qualified_name, "error")
+
+def setup(bot):
+    return bot.add_cog(Metrics(bot))
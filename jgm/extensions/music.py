@@ -14,22 +14,37 @@ import re
 import time
 import datetime
 import textwrap
-import mutagen  # Alphabetize later
-from collections import deque
-from urllib.parse import urlparse
+from collections import deque, Counter
+from urllib.parse import urlparse, urlunparse, parse_qs
 
 import discord
 from discord.ext import commands
 from discord.ext import tasks
 from discord.ext.commands import BucketType
 
-import yt_dlp as youtube_dl
-
 import jgm.patched_player as patched_player
-import soundit as s
+import jgm.tracing as tracing
+from jgm import logs
+from jgm.lazy import LazyModule
+from jgm.metrics import RESOLVE_SECONDS, ADVANCE_SECONDS, guild_label
+
+_old_bug_reports_message = None
+
+# Suppress noise about console usage from errors
+def _quiet_youtube_dl(module):
+    global _old_bug_reports_message
+    _old_bug_reports_message = module.utils.bug_reports_message
+    module.utils.bug_reports_message = lambda: ''
+
+# These take a while to import and aren't needed until something plays
+youtube_dl = LazyModule("yt_dlp", on_load=_quiet_youtube_dl)
+mutagen = LazyModule("mutagen")
+s = LazyModule("soundit")
 
 
 class FilterData:
+    __slots__ = ("tempo", "pitch", "filter_name")
+
     def __init__(self):
         self.tempo = 1
         self.pitch = 1
@@ -61,41 +76,81 @@ class FilterData:
         return ret
 
     def copy_from(self, other):
-        self.__dict__.update(other.__dict__)
+        for field in self.__slots__:
+            setattr(self, field, getattr(other, field))
 
 
 class Audio:
-    def __init__(self, ty, query):
+    # Queued songs only hold `ty` and `query`. The rest is filled in by
+    # `resolve` once the song actually starts playing, so a long queue doesn't
+    # carry a metadata dict and a FilterData per entry.
+    __slots__ = ("ty", "query", "key", "user_id", "metadata", "filter_data", "sframes")
+
+    # Shared by every instance instead of being rebuilt in each __init__
+    METADATA_FIELDS_STREAM = (
+        "id",
+        "title",
+        "uploader",
+        "duration",
+        "url",  # The URL queried from the API (for seeking)
+        "webpage_url",  # For display purposes (e.g. soundcloud generating an API audio link)
+        "live_status",
+        "webpage_url_domain",
+        "duration_string"
+    )
+    METADATA_FUNCS_LOCAL = {
+        "duration": lambda mut: mut.info.length,
+        "contents": lambda mut: mut.info.pprint(),
+        "url": lambda mut: mut.filename  # For consistency with stream ["url"] query for seeking
+    }
+
+    def __init__(self, ty, query, user_id=None):
         self.ty = ty
         self.query = query
-        self.metadata_fields_stream = [
-            "id",
-            "title",
-            "uploader",
-            "duration",
-            "url",  # The URL queried from the API (for seeking)
-            "webpage_url",  # For display purposes (e.g. soundcloud generating an API audio link)
-            "live_status",
-            "webpage_url_domain",
-            "duration_string"
-        ]
-        self.metadata_funcs_local = {
-            "duration": lambda mut: mut.info.length,
-            "contents": lambda mut: mut.info.pprint(),
-            "url": lambda mut: mut.filename  # For consistency with stream ["url"] query for seeking
-        }
-        self.metadata = {}
-        self.filter_data = FilterData()
+        # Duplicate detection key, worked out once since the queue needs it on
+        # every change
+        self.key = normalize_query(ty, query)
+        # Who queued the song, for the persistent play history
+        self.user_id = user_id
+        self.metadata = None
+        self.filter_data = None
 
         # TODO seek head things ...
         # Scaled frames (we don't know how long a frame is, just the number of frames)
         self.sframes = 0
 
+    def resolve(self, data, filter_data):
+        """Fills in the playback fields right before the song gets played"""
+        # Cleaning up before playing (to prevent persistent history instance vars)
+        self.reset_playhead()
+        if self.filter_data is None:
+            self.filter_data = FilterData()
+        self.filter_data.copy_from(filter_data)  # Before playing current, override its filterdata
+        self.filter_metadata(data)
+
+    # Compact JSON-friendly form used when persisting queues
+    def to_record(self):
+        return [self.ty, self.query, self.user_id]
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(*record)
+
+    @classmethod
+    def from_older(cls, old):
+        # Copy of a song made by an older version of this class (before a
+        # reload), which may be missing fields like `key`
+        self = cls(old.ty, old.query, getattr(old, "user_id", None))
+        for field in ("metadata", "filter_data", "sframes"):
+            if hasattr(old, field):
+                setattr(self, field, getattr(old, field))
+        return self
+
     def filter_metadata(self, data):
         if self.ty == "stream":
-            self.metadata = {field:data.get(field) for field in self.metadata_fields_stream}
+            self.metadata = {field:data.get(field) for field in self.METADATA_FIELDS_STREAM}
         else:
-            self.metadata = {k:v(data) for k, v in self.metadata_funcs_local.items()}
+            self.metadata = {k:v(data) for k, v in self.METADATA_FUNCS_LOCAL.items()}
 
     # More readable in the code following
     def reset_playhead(self):
@@ -127,6 +182,245 @@ class Audio:
         return f"{timestamp}/{seconds_to_hhmmss(int(duration))}"
 
 
+def normalize_query(ty, query):
+    """Returns the key used to detect duplicate songs on queue
+
+    Streams are keyed by YouTube video ID when possible, otherwise by the URL
+    without its fragment (or the whitespace-collapsed search terms). Local
+    files are keyed by their path.
+
+    """
+    if ty != "stream":
+        return f"{ty}:{query}"
+    url = query
+    if url[:1] == "<" and url[-1:] == ">":
+        url = url[1:-1]
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        parsed = None
+    if parsed is None or not (parsed.scheme and parsed.netloc):
+        return f"search:{' '.join(query.split()).casefold()}"
+    host = parsed.netloc.lower()
+    for prefix in ("www.", "m.", "music."):
+        host = host.removeprefix(prefix)
+    video_id = None
+    if host == "youtu.be":
+        video_id = parsed.path.strip("/").partition("/")[0]
+    elif host == "youtube.com":
+        if parsed.path.startswith(("/shorts/", "/live/")):
+            video_id = parsed.path.split("/")[2]
+        else:
+            video_id = parse_qs(parsed.query).get("v", [None])[0]
+    if video_id:
+        return f"youtube:{video_id}"
+    return f"url:{urlunparse((parsed.scheme.lower(), host, parsed.path.rstrip('/'), parsed.params, parsed.query, ''))}"
+
+
+class AudioQueue(deque):
+    """A deque of Audio objects with a multiset index of their keys
+
+    Every mutating method keeps `self.counts` in sync so checking whether a
+    song is already on queue is O(1) instead of a scan over the deque.
+
+    If `self.journal` is a list, every mutation is also appended to it as a
+    small replayable op (see `replay`). The session extension drains it to
+    persist queues without rewriting them on every change. The one op that
+    can't be replayed is `("replaced",)`, logged when the whole queue is
+    reordered at once (see `shuffle`), which means it needs a fresh snapshot.
+
+    """
+
+    def __init__(self, iterable=()):
+        super().__init__()
+        self.counts = Counter()
+        self.journal = None
+        self.extend(iterable)
+
+    def _added(self, audio):
+        self.counts[audio.key] += 1
+
+    def _removed(self, audio):
+        count = self.counts[audio.key] - 1
+        if count > 0:
+            self.counts[audio.key] = count
+        else:
+            del self.counts[audio.key]
+
+    def _log(self, *op):
+        if self.journal is not None:
+            self.journal.append(op)
+
+    def contains(self, audio):
+        return audio.key in self.counts
+
+    def append(self, audio):
+        super().append(audio)
+        self._added(audio)
+        self._log("append", audio.to_record())
+
+    def appendleft(self, audio):
+        super().appendleft(audio)
+        self._added(audio)
+        self._log("appendleft", audio.to_record())
+
+    def insert(self, i, audio):
+        super().insert(i, audio)
+        self._added(audio)
+        self._log("insert", i, audio.to_record())
+
+    def extend(self, audios):
+        for audio in audios:
+            self.append(audio)
+
+    def extendleft(self, audios):
+        for audio in audios:
+            self.appendleft(audio)
+
+    def pop(self):
+        audio = super().pop()
+        self._removed(audio)
+        self._log("pop")
+        return audio
+
+    def popleft(self):
+        audio = super().popleft()
+        self._removed(audio)
+        self._log("popleft")
+        return audio
+
+    def remove(self, audio):
+        del self[self.index(audio)]
+
+    def __delitem__(self, i):
+        if i < 0:
+            i += len(self)
+        audio = self[i]
+        super().__delitem__(i)
+        self._removed(audio)
+        self._log("delete", i)
+
+    def __setitem__(self, i, audio):
+        if i < 0:
+            i += len(self)
+        self._removed(self[i])
+        super().__setitem__(i, audio)
+        self._added(audio)
+        self._log("set", i, audio.to_record())
+
+    def __iadd__(self, audios):
+        self.extend(audios)
+        return self
+
+    def rotate(self, n=1):
+        super().rotate(n)
+        if n:
+            self._log("rotate", n)
+
+    def clear(self):
+        super().clear()
+        self.counts.clear()
+        self._log("clear")
+
+    def shuffle(self):
+        # Same songs so counts stay as they are. Logged as a single op instead
+        # of a pop and an append per song, since the journal can't describe it
+        # in less than a snapshot anyway.
+        audios = list(self)
+        random.shuffle(audios)
+        super().clear()
+        super().extend(audios)
+        self._log("replaced")
+
+    def replay(self, ops):
+        """Applies ops previously recorded in a journal"""
+        for name, *args in ops:
+            if args and isinstance(args[-1], list):
+                args[-1] = Audio.from_record(args[-1])
+            if name == "delete":
+                del self[args[0]]
+            elif name == "set":
+                self[args[0]] = args[1]
+            else:
+                getattr(self, name)(*args)
+
+
+# Ways of handling a song that is already on queue
+# - off: always add it
+# - reject: refuse to add it with an error
+# - collapse: silently keep the copy already on queue
+DEDUPE_POLICIES = ("off", "reject", "collapse")
+
+
+class GuildInfo:
+    """Per-guild music state, stored in `bot._music_data`"""
+    # Bump when its fields (or Audio's) change, so info left behind by a
+    # reload gets upgraded
+    VERSION = 6
+
+    __slots__ = (
+        "queue",
+        "history",
+        "filter_data",
+        "songs_played",
+        "current",
+        "waiting",
+        "loop",
+        "processing",
+        "autoshuffle_task",
+        "sleep_timer_task",
+        "channel_id",
+        "dedupe",
+        "resume_sframes",
+        "resume_filter",
+    )
+
+    def __init__(self, channel_id):
+        self.queue = AudioQueue()
+        self.history = deque(maxlen=100)
+        self.filter_data = FilterData()
+        self.songs_played = 0
+        self.current = None
+        self.waiting = False
+        self.loop = 0
+        self.processing = False
+        self.autoshuffle_task = None
+        self.sleep_timer_task = None
+        self.channel_id = channel_id
+        # How duplicate songs on queue are handled, one of DEDUPE_POLICIES
+        self.dedupe = "off"
+        # Playhead and FilterData to start the next song with, set when a saved
+        # session is restored
+        self.resume_sframes = 0
+        self.resume_filter = None
+
+    @classmethod
+    def upgrade(cls, wrapped, channel_id):
+        # Info left behind by an older version of this extension (before a
+        # reload), either a dict or an older GuildInfo. Fields it doesn't have
+        # keep their defaults.
+        if isinstance(wrapped, dict):
+            fields = wrapped
+        else:
+            fields = {field: getattr(wrapped, field) for field in cls.__slots__ if hasattr(wrapped, field)}
+        self = cls(fields.get("channel_id", channel_id))
+        for field in cls.__slots__:
+            if field in fields:
+                setattr(self, field, fields[field])
+        # Queued songs are rebuilt so they don't keep the old per-instance
+        # fields, and the queue may have been a plain deque. The session
+        # extension rewrites it in full since the new one has no journal.
+        self.queue = AudioQueue(Audio(audio.ty, audio.query, getattr(audio, "user_id", None)) for audio in self.queue)
+        self.history = deque(map(Audio.from_older, self.history), maxlen=100)
+        if self.current is not None:
+            self.current = Audio.from_older(self.current)
+        # It would keep shuffling the old queue
+        if self.autoshuffle_task is not None:
+            self.autoshuffle_task.cancel()
+            self.autoshuffle_task = None
+        return self
+
+
 def match_hhmmss_type(pos):
     # Based off simplified version of https://ffmpeg.org/ffmpeg-utils.html#time-duration-syntax
     # Match [[HH:]MM:]SS or integer seconds, brackets optional
@@ -188,7 +482,8 @@ class Music(commands.Cog):
         'ignoreerrors': False,
         'logtostderr': False,
         'quiet': True,
-        'no_warnings': True,
+        # Logged to jgm.ytdlp rather than printed, see ytdl_logger
+        'no_warnings': False,
         'default_search': 'auto',
         'source_address': '0.0.0.0', # bind to ipv4 since ipv6 addresses cause issues sometimes
     }
@@ -217,6 +512,12 @@ class Music(commands.Cog):
             bot._music_advance_queue = asyncio.Queue()
         self.data = bot._music_data
         self.advance_queue = bot._music_advance_queue
+        # Upgrade info left behind by an older GuildInfo right away, since the
+        # other extensions read it too. Dicts are skipped by them and upgraded
+        # by get_info, which knows the channel.
+        for guild_id, info in self.data.items():
+            if not isinstance(info, dict) and getattr(info, "VERSION", None) != GuildInfo.VERSION:
+                self.data[guild_id] = GuildInfo.upgrade(info, info.channel_id)
         # Start the advancer's auto-restart task
         self.advance_task = None
         self.advancer.start()
@@ -230,16 +531,14 @@ class Music(commands.Cog):
 
     # Finds a file using query. Title is query
     async def _play_local(self, ctx, query):
-        # Move from before info["current"] line to here bc need to access the global filter and speed info
+        # Move from before info.current line to here bc need to access the global filter and speed info
         info = self.get_info(ctx)
-        current = info["current"]
-        filter_data = info["filter_data"]
-        # Cleaning up before playing (to prevent persistent history instance vars)
-        current.reset_playhead()
-        current.filter_data.copy_from(filter_data)  # Before playing current, override its filterdata
-        mutagen_query = mutagen.File(query)
-        current.filter_metadata(mutagen_query)
-        source = discord.PCMVolumeTransformer(patched_player.FFmpegPCMAudio(current, **filter_data.to_ffmpeg_opts(self.filter_dict, local=True)))
+        current = info.current
+        filter_data = info.filter_data
+        with tracing.span("mutagen"):
+            mutagen_query = mutagen.File(query)
+        current.resolve(mutagen_query, filter_data)
+        source = discord.PCMVolumeTransformer(patched_player.FFmpegPCMAudio(current, guild_id=ctx.guild.id, **self.ffmpeg_opts(info, local=True)))
         return source, query
 
     def uri_validator(self, x):
@@ -301,46 +600,60 @@ class Music(commands.Cog):
             item = await self.advance_queue.get()
             asyncio.create_task(self.handle_advance(item))
 
-    # The actual music advancing logic
+    # Advances as part of the trace of the command that scheduled it, if any
     async def handle_advance(self, item):
-        ctx, error = item
+        ctx, error, trace, queued = item
+        if trace is None:
+            await self._advance(ctx, error, trace)
+            return
+        trace.add("advancer_hop", queued, time.perf_counter())
+        try:
+            with tracing.resume(trace, "advance"):
+                await self._advance(ctx, error, trace)
+        finally:
+            trace.release()
+
+    # The actual music advancing logic
+    async def _advance(self, ctx, error, trace):
+        start = time.perf_counter()
         info = self.get_info(ctx)
-        channel = ctx.guild.get_channel(info["channel_id"])
+        channel = ctx.guild.get_channel(info.channel_id)
         try:
             # If we are processing it right now...
-            if info["processing"]:
+            if info.processing:
                 # Wait a bit and reschedule it again
                 await asyncio.sleep(1)
-                self.advance_queue.put_nowait(item)
+                if trace is not None:
+                    trace.hold()
+                self.advance_queue.put_nowait((ctx, error, trace, time.perf_counter()))
                 return
-            info["processing"] = True
+            info.processing = True
             # If there's an error, send it to the channel
             if error is not None:
-                await channel.send(f"Player error: {error!r}")
+                await self.bot.outbound.send(channel, f"Player error: {error!r}")
             # If we aren't connected anymore, notify and leave
             if ctx.voice_client is None:
-                await channel.send("Not connected to a voice channel anymore")
+                await self.bot.outbound.send(channel, "Not connected to a voice channel anymore")
                 await self.leave(ctx)
                 return
-            queue = info["queue"]
+            queue = info.queue
             # If we're looping, put the current song at the end of the queue
-            if info["loop"] > 0 and info["current"] is not None:
-                queue.append(info["current"])
+            if info.loop > 0 and info.current is not None:
+                queue.append(info.current)
             # Previous will not intefere cuz number can't be >0 and <0 at the same time
-            if info["loop"] < 0 and info["current"] is not None:
-                queue.appendleft(info["current"])
+            if info.loop < 0 and info.current is not None:
+                queue.appendleft(info.current)
 
             # Before setting it to none, we add it to the history, provided it is not None itself
-            if info["current"] is not None:
-                info["history"].append(info["current"])
-                info["songs_played"] += 1
+            if info.current is not None:
+                self.add_history(ctx, info, info.current)
 
-            info["current"] = None
+            info.current = None
 
             if queue:
                 # Get the next song
                 current = queue.popleft()
-                info["current"] = current
+                info.current = current
                 # Get an audio source and play it
                 after = lambda error, ctx=ctx: self.schedule(ctx, error)
                 async with channel.typing():
@@ -351,47 +664,62 @@ class Music(commands.Cog):
                     # Raising the Internal Error: ClientException('Already playing audio.')
                     ctx.voice_client.pause()
                     ctx.voice_client.play(source, after=after)
-                await channel.send(f"Now playing: {title}")
+                ADVANCE_SECONDS.observe(time.perf_counter() - start, guild_label(ctx.guild.id))
+                with tracing.span("send"):
+                    await self.bot.outbound.send(channel, f"Now playing: {title}")
             else:
-                await channel.send(f"Queue empty")
+                await self.bot.outbound.send(channel, f"Queue empty")
         except Exception as e:
-            await channel.send(f"Internal Error: {e!r}")
-            info["waiting"] = False
+            await self.bot.outbound.send(channel, f"Internal Error: {e!r}")
+            info.waiting = False
             await self.skip(ctx)
             self.schedule(ctx)
         finally:
-            info["waiting"] = False
-            info["processing"] = False
+            info.waiting = False
+            info.processing = False
+
+    # Moves a song that finished (or got skipped) into the playback history
+    def add_history(self, ctx, info, audio):
+        info.history.append(audio)
+        info.songs_played += 1
+        # The song can be played again (e.g. looping) before listeners run,
+        # so they get a copy of everything that gets reset on replay
+        filter_data = FilterData()
+        if audio.filter_data is not None:
+            filter_data.copy_from(audio.filter_data)
+        seconds = scaled_frames_to_seconds(audio.sframes, filter_data.tempo)
+        self.bot.dispatch("song_played", ctx.guild.id, audio.ty, audio.query, audio.user_id, seconds, filter_data)
 
     # Schedules advancement of the queue
     def schedule(self, ctx, error=None, *, force=False):
         info = self.get_info(ctx)
-        if force or not info["waiting"]:
-            self.advance_queue.put_nowait((ctx, error))
-            info["waiting"] = True
+        if force or not info.waiting:
+            # The advancer finishes off the current command's trace
+            trace = tracing.current()
+            if trace is not None:
+                trace.hold()
+            self.advance_queue.put_nowait((ctx, error, trace, time.perf_counter()))
+            info.waiting = True
+
+    # Returns whether audio should be put on queue under the guild's dedupe
+    # policy, raising if the policy is to reject duplicates
+    def check_duplicate(self, info, audio):
+        if info.dedupe == "off" or not info.queue.contains(audio):
+            return True
+        if info.dedupe == "reject":
+            raise commands.CommandError(f"Already on queue: {audio.ty} {audio.query}")
+        return False
 
     # Helper function to create the info for a guild
     def get_info(self, ctx):
         guild_id = ctx.guild.id
         if guild_id not in self.data:
-            wrapped = self.data[guild_id] = {}
-            wrapped["queue"] = deque()
-            wrapped["history"] = deque(maxlen=100)
-            wrapped["filter_data"] = FilterData()
-            wrapped["songs_played"] = 0
-            wrapped["current"] = None
-            wrapped["waiting"] = False
-            wrapped["loop"] = 0
-            wrapped["processing"] = False
-            wrapped["autoshuffle_task"] = None
-            wrapped["sleep_timer_task"] = None
-            wrapped["version"] = 3
+            wrapped = self.data[guild_id] = GuildInfo(ctx.channel.id)
         else:
             wrapped = self.data[guild_id]
         # Smth about for reloading
-        if wrapped["version"] == 3:
-            wrapped["channel_id"] = ctx.channel.id
-            wrapped["version"] = 4
+        if getattr(wrapped, "VERSION", None) != GuildInfo.VERSION:
+            wrapped = self.data[guild_id] = GuildInfo.upgrade(wrapped, ctx.channel.id)
         return wrapped
 
     # Helper function to remove the info for a guild
@@ -399,32 +727,56 @@ class Music(commands.Cog):
         # Do some cleanup first, cancel any tasks in the thin wrapper
         data = self.get_info(ctx)
 
-        if data["autoshuffle_task"] is not None:
-            data["autoshuffle_task"].cancel()
-        if data["sleep_timer_task"] is not None:
-            _, _, task = data["sleep_timer_task"]  # More formal way than [-1]
+        if data.autoshuffle_task is not None:
+            data.autoshuffle_task.cancel()
+        if data.sleep_timer_task is not None:
+            _, _, task = data.sleep_timer_task  # More formal way than [-1]
             task.cancel()
 
         return self.data.pop(ctx.guild.id, None)
 
+    # FFmpeg options for the song that is about to play (already resolved). If
+    # a restored session left the cut off song's filters and playhead behind,
+    # play it with those filters instead of the next song's, seek to where it
+    # was (same as ;jump) and consume them.
+    def ffmpeg_opts(self, info, local=False):
+        current = info.current
+        if info.resume_filter is not None:
+            current.filter_data.copy_from(info.resume_filter)
+            info.resume_filter = None
+        ffmpeg_opts = current.filter_data.to_ffmpeg_opts(self.filter_dict, local)
+        if info.resume_sframes:
+            current.sframes = info.resume_sframes
+            info.resume_sframes = 0
+            ffmpeg_opts["before_options"] += f" -ss {scaled_frames_to_seconds(current.sframes, current.filter_data.tempo)}"
+        return ffmpeg_opts
+
+    # yt-dlp logs its messages here instead of printing them
+    def ytdl_logger(self, ctx):
+        return logs.guild_logger("jgm.ytdlp", ctx.guild.id)
+
     # Creates an audio source from a url
     async def player_from_url(self, ctx, url, *, loop=None, stream=False):
-        ytdl = youtube_dl.YoutubeDL(self.ytdl_opts)
+        ytdl = youtube_dl.YoutubeDL(self.ytdl_opts | {"logger": self.ytdl_logger(ctx)})
         loop = loop or asyncio.get_running_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+        def extract():
+            with tracing.span("extract_info"):
+                return ytdl.extract_info(url, download=not stream)
+        # Waiting for a free executor thread shows up as resolve's own time
+        with RESOLVE_SECONDS.time(), tracing.span("resolve"):
+            data = await tracing.run_in_executor(loop, extract)
         if 'entries' in data:
             # take first item from a playlist
             data = data['entries'][0]
         filename = data['url'] if stream else ytdl.prepare_filename(data)
         # Generate ffmpeg_opts from the function
         info = self.get_info(ctx)
-        current = info["current"]  # Also need to get current
-        filter_data = info["filter_data"]
-        # Cleaning up before playing (to prevent persistent history instance vars)
-        current.reset_playhead()
-        current.filter_data.copy_from(filter_data)  # Before playing current, override its filterdata
-        current.filter_metadata(data)
-        audio = patched_player.FFmpegPCMAudio(current, **filter_data.to_ffmpeg_opts(self.filter_dict))
+        current = info.current  # Also need to get current
+        filter_data = info.filter_data
+        current.resolve(data, filter_data)
+        # Lets saved playlists remember the song's title and duration
+        self.bot.dispatch("song_resolved", ctx.guild.id, current)
+        audio = patched_player.FFmpegPCMAudio(current, guild_id=ctx.guild.id, **self.ffmpeg_opts(info))
         player = discord.PCMVolumeTransformer(audio)
         return player, data
 
@@ -434,7 +786,7 @@ class Music(commands.Cog):
         """Applies the nightcore effect
         """
         info = self.get_info(ctx)
-        filter_data = info["filter_data"]
+        filter_data = info.filter_data
         filter_data.tempo = 1.2
         filter_data.pitch = 1.2
         await ctx.send("Applying nightcore (1.2x tempo and pitch) effect for next song")
@@ -445,7 +797,7 @@ class Music(commands.Cog):
         """Applies the daycore effect
         """
         info = self.get_info(ctx)
-        filter_data = info["filter_data"]
+        filter_data = info.filter_data
         # A little bit less than 0.8333 (1/1.2) because I like more daycore
         filter_data.tempo = 0.8
         filter_data.pitch = 0.8
@@ -457,7 +809,7 @@ class Music(commands.Cog):
         """Reset current effects and filters
         """
         info = self.get_info(ctx)
-        filter_data = info["filter_data"]
+        filter_data = info.filter_data
         filter_data.tempo = 1
         filter_data.pitch = 1
         filter_data.filter_name = "default"
@@ -472,7 +824,7 @@ class Music(commands.Cog):
             raise commands.CommandError(f"Filter '{filter_name}' not in list of available filters.")
         else:
             info = self.get_info(ctx)
-            filter_data = info["filter_data"]
+            filter_data = info.filter_data
             filter_data.filter_name = filter_name
             await ctx.send(f"Applying filter '{filter_name}' to the next song.")
 
@@ -485,7 +837,7 @@ class Music(commands.Cog):
             raise commands.CommandError(f"Speed factor = {factor}x outside of range from 0.25 to 4 inclusive.")
 
         info = self.get_info(ctx)
-        filter_data = info["filter_data"]
+        filter_data = info.filter_data
         filter_data.tempo = factor
         await ctx.send(f"Setting speed factor = x{factor} for next song.")
 
@@ -498,7 +850,7 @@ class Music(commands.Cog):
             raise commands.CommandError(f"Pitch factor = {factor}x outside of range from 0.25 to 4 inclusive.")
 
         info = self.get_info(ctx)
-        filter_data = info["filter_data"]
+        filter_data = info.filter_data
         filter_data.pitch = factor
         await ctx.send(f"Setting pitch factor = x{factor} for next song.")
 
@@ -516,8 +868,8 @@ class Music(commands.Cog):
         else:
             await channel.connect()
         info = self.get_info(ctx)
-        if info["channel_id"] != ctx.channel.id:
-            info["channel_id"] = ctx.channel.id
+        if info.channel_id != ctx.channel.id:
+            info.channel_id = ctx.channel.id
             await ctx.send("Switching music output to this channel")
 
     @commands.command()
@@ -525,8 +877,8 @@ class Music(commands.Cog):
     async def local(self, ctx, *, query):
         """Plays a file from the local filesystem"""
         info = self.get_info(ctx)
-        queue = info["queue"]
-        history = info["history"]
+        queue = info.queue
+        history = info.history
         # Handling prev song
         if query == "prev":
             if not history:
@@ -539,7 +891,7 @@ class Music(commands.Cog):
             # Else
             query = previous.query
         elif query == "cur":
-            current = info["current"]
+            current = info.current
             if current is None:
                 raise commands.CommandError("No current song.")
             # current exists now
@@ -547,9 +899,12 @@ class Music(commands.Cog):
                 raise commands.CommandError("Current song was not added locally. Use ;stream cur.")
             # Else
             query = current.query
-        audio = Audio(ty="local", query=query)
+        audio = Audio(ty="local", query=query, user_id=ctx.author.id)
+        if not self.check_duplicate(info, audio):
+            await ctx.send(f"Already on queue: local {audio.query}")
+            return
         queue.append(audio)
-        if info["current"] is None:
+        if info.current is None:
             self.schedule(ctx)
         await ctx.send(f"Appended to queue: local {audio.query}")
 
@@ -559,8 +914,8 @@ class Music(commands.Cog):
         """Plays from a url (almost anything yt-dlp supports) and places it at the beginning of the queue
         """
         info = self.get_info(ctx)
-        queue = info["queue"]
-        history = info["history"]
+        queue = info.queue
+        history = info.history
         # Handling prev song
         if query == "prev":
             if not history:
@@ -573,7 +928,7 @@ class Music(commands.Cog):
             # Else
             query = previous.query
         elif query == "cur":
-            current = info["current"]
+            current = info.current
             if current is None:
                 raise commands.CommandError("No current song.")
             # current exists now
@@ -581,22 +936,30 @@ class Music(commands.Cog):
                 raise commands.CommandError("Current song was not added locally. Use ;stream_prepend cur.")
             # Else
             query = current.query
-        audio = Audio(ty="local", query=query)
+        audio = Audio(ty="local", query=query, user_id=ctx.author.id)
+        if not self.check_duplicate(info, audio):
+            await ctx.send(f"Already on queue: local {audio.query}")
+            return
         queue.appendleft(audio)
-        if info["current"] is None:
+        if info.current is None:
             self.schedule(ctx)
         await ctx.send(f"Prepended to queue: local {audio.query}")
 
     @commands.command(aliases=["yt", "play", "p"])
     async def stream(self, ctx, *, url):
         """Plays from a url (almost anything yt-dlp supports)"""
+        await self.append_stream(ctx, url)
+
+    # Body of ;stream. With bulk, the status message is sent as a notice so a
+    # batch of them gets merged into a few messages.
+    async def append_stream(self, ctx, url, *, bulk=False):
         if len(url) > 100:
             raise ValueError("url too long (length over 100)")
         if not url.isprintable():
             raise ValueError(f"url not printable: {url!r}")
         info = self.get_info(ctx)
-        queue = info["queue"]
-        history = info["history"]
+        queue = info.queue
+        history = info.history
         # Handling prev song
         if url == "prev":
             if not history:
@@ -609,7 +972,7 @@ class Music(commands.Cog):
             # Else
             url = previous.query
         elif url == "cur":
-            current = info["current"]
+            current = info.current
             if current is None:
                 raise commands.CommandError("No current song.")
             # current exists now
@@ -617,11 +980,43 @@ class Music(commands.Cog):
                 raise commands.CommandError("Current song was added locally. Use ;local cur.")
             # Else
             url = current.query
-        audio = Audio(ty="stream", query=url)
+        audio = Audio(ty="stream", query=url, user_id=ctx.author.id)
+        if not self.check_duplicate(info, audio):
+            await self.status(ctx, f"Already on queue: stream {audio.query}", bulk=bulk)
+            return
         queue.append(audio)
-        if info["current"] is None:
+        if info.current is None:
+            self.schedule(ctx)
+        with tracing.span("status"):
+            await self.status(ctx, f"Appended to queue: stream {audio.query}", bulk=bulk)
+
+    def enqueue_many(self, ctx, audios):
+        """Appends songs to the queue in one go, returning how many were skipped"""
+        info = self.get_info(ctx)
+        queue = info.queue
+        skipped = 0
+        for audio in audios:
+            # Duplicates are skipped for both policies so one repeat doesn't
+            # throw away the rest of the batch
+            if info.dedupe != "off" and queue.contains(audio):
+                skipped += 1
+                continue
+            queue.append(audio)
+        if info.current is None:
             self.schedule(ctx)
-        await ctx.send(f"Appended to queue: stream {audio.query}")
+        return skipped
+
+    def enqueue_streams(self, ctx, queries):
+        """Same as enqueue_many, from stream queries queued by the author"""
+        # For other extensions (e.g. playlists), so they don't have to import
+        # this one for its Audio class
+        return self.enqueue_many(ctx, (Audio("stream", query, ctx.author.id) for query in queries))
+
+    async def status(self, ctx, content, *, bulk=False):
+        if bulk:
+            self.bot.outbound.notice(ctx.channel, content)
+        else:
+            await ctx.send(content)
 
     @commands.command(aliases=["prepend", "pplay", "pp"])
     @commands.cooldown(1, 1, BucketType.user)
@@ -633,8 +1028,8 @@ class Music(commands.Cog):
         if not url.isprintable():
             raise ValueError(f"url not printable: {url!r}")
         info = self.get_info(ctx)
-        queue = info["queue"]
-        history = info["history"]
+        queue = info.queue
+        history = info.history
         # Handling prev song
         if url == "prev":
             if not history:
@@ -647,7 +1042,7 @@ class Music(commands.Cog):
             # Else
             url = previous.query
         elif url == "cur":
-            current = info["current"]
+            current = info.current
             if current is None:
                 raise commands.CommandError("No current song.")
             # current exists now
@@ -655,9 +1050,12 @@ class Music(commands.Cog):
                 raise commands.CommandError("Current song was added locally. Use ;local cur.")
             # Else
             url = current.query
-        audio = Audio(ty="stream", query=url)
+        audio = Audio(ty="stream", query=url, user_id=ctx.author.id)
+        if not self.check_duplicate(info, audio):
+            await ctx.send(f"Already on queue: stream {audio.query}")
+            return
         queue.appendleft(audio)
-        if info["current"] is None:
+        if info.current is None:
             self.schedule(ctx)
         await ctx.send(f"Prepended to queue: stream {audio.query}")
 
@@ -673,50 +1071,48 @@ class Music(commands.Cog):
         if url[0] == "<" and url[-1] == ">":
             bracketed = True
             url = url[1:-1]
-        info = self.get_info(ctx)
-        queue = info["queue"]
         ytdl = youtube_dl.YoutubeDL(self.ytdl_opts | {
             'noplaylist': None,
             'playlistend': None,
             "extract_flat": True,
+            "logger": self.ytdl_logger(ctx),
         })
         data = await asyncio.to_thread(ytdl.extract_info, url, download=False)
-        print(data)
         if 'entries' not in data:
             raise ValueError("cannot find entries of playlist")
         entries = data['entries']
+        audios = []
         for entry in entries:
             playlist_url = entry['url']
             if bracketed:
                 playlist_url = f"<{playlist_url}>"
-            audio = Audio(ty="stream", query=playlist_url)
-            queue.append(audio)
-        if info["current"] is None:
-            self.schedule(ctx)
-        await ctx.send(f"Added playlist to queue: {url}")
+            audios.append(Audio(ty="stream", query=playlist_url, user_id=ctx.author.id))
+        # Not the whole info dict, that's huge for a big playlist
+        self.ytdl_logger(ctx).info("Playlist %s has %d entries", url, len(audios))
+        skipped = self.enqueue_many(ctx, audios)
+        await ctx.send(f"Added playlist to queue: {url}{f' (skipped {skipped} duplicates)' if skipped else ''}")
 
     @commands.command(name="batch_add")
     @commands.cooldown(rate=1, per=2, type=BucketType.user)
     async def _batch_add(self, ctx, *, urls):
         """Plays from multiple urls split by lines"""
         for url in urls.splitlines():
-            await self.stream(ctx, url=url)
-            await asyncio.sleep(0.1)
+            # A rejected duplicate (or a prev/cur with nothing to refer to)
+            # only skips its own line instead of the rest of the batch
+            try:
+                await self.append_stream(ctx, url, bulk=True)
+            except commands.CommandError as exc:
+                await self.status(ctx, str(exc), bulk=True)
 
     def shuffle_helper(self, queue_ref):
-        temp = []
-        while queue_ref:
-            temp.append(queue_ref.popleft())
-        random.shuffle(temp)
-        while temp:
-            queue_ref.appendleft(temp.pop())
+        queue_ref.shuffle()
 
     @commands.command()
     @commands.cooldown(1, 1, BucketType.user)
     async def shuffle(self, ctx):
         """Shuffles the queue"""
         info = self.get_info(ctx)
-        self.shuffle_helper(info["queue"])
+        self.shuffle_helper(info.queue)
         await ctx.send("Queue shuffled")
 
     async def autoshuffler(self, queue_ref):
@@ -730,11 +1126,11 @@ class Music(commands.Cog):
         """Gets or sets queue autoshuffler status
         """
         info = self.get_info(ctx)
-        queue = info["queue"]
+        queue = info.queue
 
         if to_ashuffle is None:
             # None if no task, the acutal task if exists task
-            await ctx.send(f"Autoshuffler is {'off' if info['autoshuffle_task'] is None else 'on'}.")
+            await ctx.send(f"Autoshuffler is {'off' if info.autoshuffle_task is None else 'on'}.")
             return
 
         if to_ashuffle:
@@ -742,18 +1138,18 @@ class Music(commands.Cog):
             # Create a new one if task doesn't exist
             await ctx.send("Enabling queue autoshuffle.")
             task = asyncio.create_task(self.autoshuffler(queue))
-            info["autoshuffle_task"] = task
+            info.autoshuffle_task = task
             await task
         else:
             await ctx.send("Disabling queue autoshuffle.")
-            # For safe measure, turn info["autoshuffle"] to None first
-            task = info["autoshuffle_task"]
+            # For safe measure, turn info.autoshuffle to None first
+            task = info.autoshuffle_task
 
             # So doesn't raise AttributeError for NoneType
             if task is None:
                 return
 
-            info["autoshuffle_task"] = None
+            info.autoshuffle_task = None
             task.cancel()
 
     @commands.command()
@@ -806,8 +1202,8 @@ class Music(commands.Cog):
         query = None
         if ctx.voice_client is not None:
             info = self.get_info(ctx)
-            current = info["current"]
-            if current is not None and not info["waiting"]:
+            current = info.current
+            if current is not None and not info.waiting:
                 query = current.query
         await ctx.send(f"Current: {query}")
 
@@ -821,9 +1217,9 @@ class Music(commands.Cog):
         looping = None
         if ctx.voice_client is not None:
             info = self.get_info(ctx)
-            queue = info["queue"]
+            queue = info.queue
             length = len(queue)
-            looping = loop_messages[info["loop"]]
+            looping = loop_messages[info.loop]
         if not queue:
             queue = (None,)
         paginator = commands.Paginator()
@@ -834,17 +1230,22 @@ class Music(commands.Cog):
                 paginator.add_line("None")
             else:
                 paginator.add_line(f"{i}: {song.query}")
-        for page in paginator.pages:
-            await ctx.send(page)
+        await self.bot.outbound.send_pages(ctx.channel, paginator.pages)
 
     @commands.command(aliases=["history", "hist"])
     @commands.cooldown(1, 1, BucketType.user)
-    async def playback_history(self, ctx, display_last: int = 5):
+    async def playback_history(self, ctx, display_last: int = 5, page: int = 1):
         """Outputs the playback history
         """
+        # Page through the full history in the database if it's being recorded
+        history_cog = self.bot.get_cog("History")
+        if history_cog is not None:
+            await history_cog.send_history(ctx, display_last, page)
+            return
+
         info = self.get_info(ctx)
-        history = info["history"]
-        played = info["songs_played"]
+        history = info.history
+        played = info.songs_played
 
         if not history:
             await ctx.send("No playback history")
@@ -865,19 +1266,24 @@ class Music(commands.Cog):
         if display_last > history.maxlen:
             paginator.add_line(f"\n[WARNING] History size capped at {history.maxlen} items")
 
-        for page in paginator.pages:
-            await ctx.send(page)
+        await self.bot.outbound.send_pages(ctx.channel, paginator.pages)
 
     @commands.command(aliases=["hclear"])
     @commands.cooldown(1, 1, BucketType.user)
     async def playback_history_clear(self, ctx):
         """Clears the playback history
+
+        Only the recent songs used by `prev` are cleared. The history saved in
+        the database (shown by ;history, ;top and ;ustats) is kept.
         """
         info = self.get_info(ctx)
-        info["history"].clear()
-        info["songs_played"] = 0
+        info.history.clear()
+        info.songs_played = 0
 
-        await ctx.send("Successfully cleared payback history.")
+        if self.bot.get_cog("History") is not None:
+            await ctx.send("Successfully cleared payback history. The saved history shown by ;history is kept.")
+        else:
+            await ctx.send("Successfully cleared payback history.")
 
     def normalize_index(self, ctx, position, length):
         index = position
@@ -894,7 +1300,7 @@ class Music(commands.Cog):
     async def remove(self, ctx, position: int):
         """Removes a song on queue"""
         info = self.get_info(ctx)
-        queue = info["queue"]
+        queue = info.queue
         try:
             index = self.normalize_index(ctx, position, len(queue))
         except ValueError:
@@ -909,7 +1315,7 @@ class Music(commands.Cog):
     async def move(self, ctx, origin: int, target: int):
         """Moves a song on queue"""
         info = self.get_info(ctx)
-        queue = info["queue"]
+        queue = info.queue
         try:
             origin_index = self.normalize_index(ctx, origin, len(queue))
         except ValueError:
@@ -930,7 +1336,7 @@ class Music(commands.Cog):
     async def clear(self, ctx):
         """Clears all songs in queue"""
         info = self.get_info(ctx)
-        queue = info["queue"]
+        queue = info.queue
         if not queue:
             await ctx.send("Queue is empty.")
             return
@@ -942,9 +1348,9 @@ class Music(commands.Cog):
     async def skip(self, ctx):
         """Skips current song"""
         info = self.get_info(ctx)
-        current = info["current"]
+        current = info.current
         ctx.voice_client.stop()
-        if current is not None and not info["waiting"]:
+        if current is not None and not info.waiting:
             await ctx.send(f"Skipped: {current.query}")
 
     @commands.command(aliases=["fs"])
@@ -953,15 +1359,12 @@ class Music(commands.Cog):
         """Skips a song and removes it from the queue
         """
         info = self.get_info(ctx)
-        current = info["current"]
-        # The only exception to history command (because it was)
-        history = info["history"]
-        if info["waiting"] or current is None:
+        current = info.current
+        if info.waiting or current is None:
             raise commands.CommandError("Inappropriate time to use this command. Likely nonexistent AudioSource or handling queue advance.")
         ctx.voice_client.pause()
-        info["current"] = None
-        history.append(current)
-        info["songs_played"] += 1
+        info.current = None
+        self.add_history(ctx, info, current)
         self.schedule(ctx, force=True)
         await ctx.send(f"Forceskipped: {current.query}")
 
@@ -973,15 +1376,28 @@ class Music(commands.Cog):
         loop_messages = {1: "loop all", 0: "no loop", -1: "loop one"}
         info = self.get_info(ctx)
         if loop is None:
-            await ctx.send(f"Queue status: {info['loop']} ({loop_messages[info['loop']]})")
+            await ctx.send(f"Queue status: {info.loop} ({loop_messages[info.loop]})")
+            return
+        info.loop = sign
+        await ctx.send(f"Set queue status to {info.loop} ({loop_messages[info.loop]})")
+
+    @commands.command()
+    @commands.cooldown(1, 1, BucketType.user)
+    async def dedupe(self, ctx, policy: typing.Optional[str] = None):
+        """Gets or sets how duplicate songs on queue are handled"""
+        info = self.get_info(ctx)
+        if policy is None:
+            await ctx.send(f"Dedupe policy: {info.dedupe}")
             return
-        info["loop"] = sign
-        await ctx.send(f"Set queue status to {info['loop']} ({loop_messages[info['loop']]})")
+        if policy not in DEDUPE_POLICIES:
+            raise commands.CommandError(f"Dedupe policy '{policy}' not one of {', '.join(DEDUPE_POLICIES)}.")
+        info.dedupe = policy
+        await ctx.send(f"Set dedupe policy to {policy}")
 
     async def sleep_task(self, ctx, dur):
         await asyncio.sleep(dur)
         info = self.get_info(ctx)
-        info["sleep_timer_task"] = None  # Easier to just do it in here rather than have some other function needing to detect when the task is done
+        info.sleep_timer_task = None  # Easier to just do it in here rather than have some other function needing to detect when the task is done
 
         # Doesn't seem to throw any exception when not in voice channel
         await self.leave(ctx)
@@ -993,7 +1409,7 @@ class Music(commands.Cog):
         """
 
         info = self.get_info(ctx)
-        task_tuple = info["sleep_timer_task"]
+        task_tuple = info.sleep_timer_task
 
         if dur is None:
             if task_tuple is None:
@@ -1019,7 +1435,7 @@ class Music(commands.Cog):
         if task_tuple is None:
             await ctx.send(f"Sleep timer created, bot will disconnect in {datetime.timedelta(seconds=dur_seconds)}")
             task = asyncio.create_task(self.sleep_task(ctx, dur_seconds))
-            info["sleep_timer_task"] = (time.time(), dur_seconds, task)
+            info.sleep_timer_task = (time.time(), dur_seconds, task)
             await task
         else:
             await ctx.send("Please cancel the currently running sleep timer first.")
@@ -1030,14 +1446,14 @@ class Music(commands.Cog):
         """Cancels an existing sleep timer
         """
         info = self.get_info(ctx)
-        task_tuple = info["sleep_timer_task"]
+        task_tuple = info.sleep_timer_task
 
         if task_tuple is None:
             raise commands.CommandError(f"No sleep timer task to be cancelled.")
         # Before to prevent the case where the timing is just right where
-        # info["sleep_timer_task"] is not none yet the task is cancelled
+        # info.sleep_timer_task is not none yet the task is cancelled
         # which could be the case if the statement below was put after the tuple unpacking
-        info["sleep_timer_task"] = None
+        info.sleep_timer_task = None
         _, _, task = task_tuple
         task.cancel()
         await ctx.send("Cancelled the current sleep timer.")
@@ -1048,9 +1464,10 @@ class Music(commands.Cog):
         """Shows audio, metadata, and progress bar information for current song
         """
         info = self.get_info(ctx)
-        a = info["current"]  # A for audio
+        a = info.current  # A for audio
 
-        if a is None or info["waiting"]:
+        # Metadata is only filled in once the song starts playing
+        if a is None or info.waiting or a.metadata is None:
             await ctx.send("Nothing currently playing.")
             return
 
@@ -1087,18 +1504,18 @@ class Music(commands.Cog):
         info = self.get_info(ctx)
         await ctx.send(textwrap.dedent(f"""
         ```
-        AUTOSHUFFLE_TASK {"running" if info["autoshuffle_task"] else None}
-        NEXT_EFFECTS     x{info["filter_data"].tempo} speed, x{info["filter_data"].pitch} pitch
-        NEXT_FILTER      {info["filter_data"].filter_name}
-        HISTORY_SIZE     {len(info["history"])}
-        LOOP_TYPE        {dict([(1, "loop all"), (0, "no loop"), (-1, "loop one")])[info["loop"]]}
+        AUTOSHUFFLE_TASK {"running" if info.autoshuffle_task else None}
+        NEXT_EFFECTS     x{info.filter_data.tempo} speed, x{info.filter_data.pitch} pitch
+        NEXT_FILTER      {info.filter_data.filter_name}
+        HISTORY_SIZE     {len(info.history)}
+        LOOP_TYPE        {dict([(1, "loop all"), (0, "no loop"), (-1, "loop one")])[info.loop]}
         PAUSED           {False if ctx.voice_client is None else ctx.voice_client.is_paused()}
         PLAYING          {False if ctx.voice_client is None else ctx.voice_client.is_playing()}
-        PROCESSING       {info["processing"]}
-        QUEUE_LENGTH     {len(info["queue"])}
-        SLEEP_TIMER_TASK {"running" if info["sleep_timer_task"] else None}
-        SONGS_PLAYED     {info["songs_played"]}
-        WAITING          {info["waiting"]}
+        PROCESSING       {info.processing}
+        QUEUE_LENGTH     {len(info.queue)}
+        SLEEP_TIMER_TASK {"running" if info.sleep_timer_task else None}
+        SONGS_PLAYED     {info.songs_played}
+        WAITING          {info.waiting}
         ```
         """))
 
@@ -1118,7 +1535,7 @@ class Music(commands.Cog):
         if match_any_seconds(pos) and int(pos) > hhmmss_to_seconds("99:59:59"):
             raise commands.CommandError(f"Time in seconds greater than 99:59:59.")
 
-        current = info["current"]
+        current = info.current
         is_cur_local = current.ty=="local"  # More intuitive to put this outside function call below
         ffmpeg_opts = current.filter_data.to_ffmpeg_opts(self.filter_dict, is_cur_local)
         pre_jump_volume = ctx.voice_client.source.volume
@@ -1130,7 +1547,7 @@ class Music(commands.Cog):
         # hhmmss_to_seconds(<seconds>) will return seconds
         current.sframes = seconds_to_scaled_frames(hhmmss_to_seconds(pos), current.filter_data.tempo)
         # Metadata generated before this line
-        seek_stream = discord.PCMVolumeTransformer(patched_player.FFmpegPCMAudio(current, **ffmpeg_opts_after_jump))  # "url" is the same when querying
+        seek_stream = discord.PCMVolumeTransformer(patched_player.FFmpegPCMAudio(current, guild_id=ctx.guild.id, **ffmpeg_opts_after_jump))  # "url" is the same when querying
         # Set volume before playing in case of delay
         seek_stream.volume = pre_jump_volume
         # `current` doesn't get overridden, a copy of the same `ffmpeg_opts` is just used with a seek flag
@@ -1146,7 +1563,7 @@ class Music(commands.Cog):
             raise commands.CommandError(f"Seek time [{sec}] not a positive integer number of seconds ranging from 1 to 15 seconds inclusive.")
 
         info = self.get_info(ctx)
-        current = info["current"]
+        current = info.current
         tempo = current.filter_data.tempo
 
         # Scaled seeking: a frame may not correspond to 20ms for different tempos
@@ -1182,7 +1599,7 @@ class Music(commands.Cog):
             raise commands.CommandError(f"Seek time [{sec}] not a positive integer number of seconds ranging from 1 to 15 seconds inclusive.")
 
         info = self.get_info(ctx)
-        current = info["current"]
+        current = info.current
         tempo = current.filter_data.tempo
 
         # Scaled seeking: a frame may not correspond to 20ms for different tempos
@@ -1224,7 +1641,8 @@ class Music(commands.Cog):
     async def ensure_connected(self, ctx):
         if ctx.voice_client is None:
             if ctx.author.voice:
-                await ctx.author.voice.channel.connect()
+                with tracing.span("connect"):
+                    await ctx.author.voice.channel.connect()
             else:
                 raise commands.CommandError("Author not connected to a voice channel")
 
@@ -1251,6 +1669,7 @@ class Music(commands.Cog):
     @forceskip.before_invoke
     @info.before_invoke
     @loop.before_invoke
+    @dedupe.before_invoke
     @queue.before_invoke
     @shuffle.before_invoke
     @apply_filter.before_invoke
@@ -1267,12 +1686,10 @@ class Music(commands.Cog):
             raise commands.CommandError("Not connected to a voice channel")
 
 def setup(bot):
-    # Suppress noise about console usage from errors
-    bot._music_old_ytdl_bug_report_message = youtube_dl.utils.bug_reports_message
-    youtube_dl.utils.bug_reports_message = lambda: ''
-
     return bot.add_cog(Music(bot))
 
 def teardown(bot):
-    youtube_dl.utils.bug_reports_message = bot._music_old_ytdl_bug_report_message
+    # Only patched if yt-dlp got imported
+    if youtube_dl.loaded:
+        youtube_dl.utils.bug_reports_message = _old_bug_reports_message
     return bot.wrap_async(None)
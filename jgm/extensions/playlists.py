@@ -1,15 +1,26 @@
-import os
 import typing
 import re
 import asyncio
 import math
+import json
+import io
+import tempfile
+import itertools
+import sqlite3
+import traceback
+import contextlib
+import functools
+from collections import Counter, OrderedDict
 
-import aiosqlite
 import discord
 from discord.ext import commands
+from discord.ext import tasks
 from discord.utils import escape_markdown
 from discord.ext.commands import BucketType
 
+from jgm.db import deadline
+from jgm.regex import check_regex
+
 class Dash(commands.Converter):
     async def convert(self, ctx, argument):
         if not argument:
@@ -18,6 +29,106 @@ class Dash(commands.Converter):
             raise commands.BadArgument("argument does not consist of a single dash")
         return "-"
 
+class _Segment:
+    """Part of a glob-ish pattern between two %s, where ? matches any character"""
+
+    __slots__ = ("text", "regex")
+
+    def __init__(self, text):
+        self.text = text
+        # Plain substrings are left to the str methods, which are faster
+        self.regex = None
+        if "?" in text:
+            self.regex = re.compile(
+                "".join("." if char == "?" else re.escape(char) for char in text),
+                re.DOTALL,
+            )
+
+    def __len__(self):
+        return len(self.text)
+
+    def match_at(self, string, pos):
+        if self.regex is None:
+            return string.startswith(self.text, pos)
+        return self.regex.match(string, pos) is not None
+
+    def find(self, string, start, end):
+        """Return the end of the first match within string[start:end], or -1"""
+        if self.regex is None:
+            index = string.find(self.text, start, end)
+            return -1 if index < 0 else index + len(self.text)
+        found = self.regex.search(string, start, end)
+        return -1 if found is None else found.end()
+
+class GlobMatcher:
+    """A glob-ish pattern compiled for matching many strings
+
+    The pattern is split on % into a prefix, a suffix and the segments in
+    between. The prefix and suffix are checked in place at either end of the
+    string, then each middle segment is searched for left to right, taking the
+    first match each time. Taking the first match is always safe with only %
+    and ?, so nothing is ever retried and matching takes at most
+    O(len(pattern) * len(string)) time.
+
+    """
+
+    __slots__ = ("pattern", "exact", "prefix", "middle", "suffix", "min_length", "test")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        segments = pattern.split("%")
+        self.exact = len(segments) == 1
+        self.prefix = _Segment(segments[0])
+        self.middle = [_Segment(segment) for segment in segments[1:-1] if segment]
+        self.suffix = _Segment(segments[-1] if not self.exact else "")
+        self.min_length = len(pattern) - (len(segments) - 1)
+        # Fast paths for specific simple cases
+        self.test = self.general
+        if "?" not in pattern:
+            if self.exact:  # Simple equality
+                self.test = pattern.__eq__
+            elif not self.middle:  # Simple prefix + suffix
+                prefix, suffix, min_length = segments[0], segments[-1], self.min_length
+                self.test = lambda string: (
+                    len(string) >= min_length
+                    and string.startswith(prefix)
+                    and string.endswith(suffix)
+                )
+
+    def __call__(self, string):
+        return self.test(string)
+
+    def general(self, string):
+        if len(string) < self.min_length:
+            return False
+        if self.exact:
+            return len(string) == self.min_length and self.prefix.match_at(string, 0)
+        start = len(self.prefix)
+        end = len(string) - len(self.suffix)
+        if not (self.prefix.match_at(string, 0) and self.suffix.match_at(string, end)):
+            return False
+        for segment in self.middle:
+            start = segment.find(string, start, end)
+            if start < 0:
+                return False
+        return True
+
+    def match_many(self, strings, limit=-1):
+        """Return the strings that match, stopping after limit if not negative"""
+        if limit == 0:
+            return []
+        found = []
+        for string in filter(self.test, strings):
+            found.append(string)
+            if len(found) == limit:
+                break
+        return found
+
+@functools.lru_cache(256)
+def compile_glob(pattern: str) -> GlobMatcher:
+    """Return a compiled matcher for pattern, cached for reuse"""
+    return GlobMatcher(pattern)
+
 def match(pattern: str, string: str) -> bool:
     """Return whether pattern matches string in linear time
 
@@ -27,71 +138,689 @@ def match(pattern: str, string: str) -> bool:
     The only special characters supported are ? and %, for matching one and any
     number of characters respectively.
 
-    Adapted from https://research.swtch.com/glob.
+    """
+    return compile_glob(pattern)(string)
+
+def match_many(pattern: str, strings, limit=-1):
+    """Return which of strings pattern matches, keeping their order
+
+    Compiles the pattern once for all of them. Stops after limit matches if
+    limit isn't negative.
 
     """
-    # Fast paths for specific simple cases
-    if "?" not in pattern:
-        any_count = pattern.count("%")
-        if any_count == 0:  # Simple equality
-            return string == pattern
-        if any_count == 1:  # Simple prefix + suffix
-            prefix, _, suffix = pattern.partition("%")
-            return (
-                len(prefix) + len(suffix) < len(string)  # Ensure no overlap
-                and string.startswith(prefix)
-                and string.endswith(suffix)
-            )
+    return compile_glob(pattern).match_many(strings, limit)
 
-    # General code
-    pi = pj = 0
-    i = j = 0
-    while pi < len(pattern) or i < len(string):
-        if pi < len(pattern):
-            char = pattern[pi]
-            if char == "?":
-                if i < len(string):
-                    pi += 1
-                    i += 1
-                    continue
-            elif char == "%":
-                pi, pj = pi + 1, pi
-                j = i + 1
-                continue
-            else:
-                if i < len(string) and string[i] == char:
-                    pi += 1
-                    i += 1
-                    continue
-        if 0 < j <= len(string):
-            pi, pj = pj, 0
-            i, j = j, 0
+def to_glob(pattern: str) -> str:
+    """Translate a match() pattern into an SQLite GLOB pattern"""
+    return "".join(
+        "*" if char == "%" else f"[{char}]" if char in "*[" else char
+        for char in pattern
+    )
+
+def glob_to_sql(pattern: str):
+    """Return an SQL condition and parameters for names matching pattern
+
+    - pattern: same pattern as accepted by match()
+
+    The pattern is translated to SQLite's GLOB, with * for % and special
+    characters escaped. Any literal prefix (the part before the first
+    wildcard) is also turned into a range on playlist_name, so it can be looked
+    up in the (server_id, playlist_name) index instead of checking every name.
+
+    Patterns without wildcards are treated as a substring, like `find` always
+    has (an exact match is also a substring).
+
+    """
+    if "%" not in pattern and "?" not in pattern:
+        return "instr(playlist_name, ?) > 0", [pattern]
+    prefix, _, _ = pattern.partition("%")
+    prefix, _, _ = prefix.partition("?")
+    glob = to_glob(pattern)
+    if not prefix:
+        return "playlist_name GLOB ?", [glob]
+    # Everything starting with prefix sorts between prefix and this
+    after = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return "playlist_name >= ? AND playlist_name < ? AND playlist_name GLOB ?", [prefix, after, glob]
+
+def search_to_sql(pattern: str):
+    """Return SQL queries for playlists whose text contains or matches pattern
+
+    - pattern: same pattern as accepted by match()
+
+    Returns (ranked, unranked), each a (query, parameters) pair or None. The
+    server ID and the limit go before and after the parameters respectively.
+
+    - ranked finds texts containing the pattern using the full-text index,
+      best match first, along with a snippet around the match
+    - unranked finds texts that match the pattern as a whole, and texts
+      containing patterns too short for the index (the trigram tokenizer needs
+      at least 3 characters)
+
+    """
+    ranked = None
+    condition, params = [], []
+    if len(pattern) >= 3:
+        ranked = (
+            f'''SELECT p.playlist_name, snippet(playlists_fts, 0, char(2), char(3), '...', {SNIPPET_TOKENS})
+            FROM playlists_fts JOIN playlists p ON p.playlist_id = playlists_fts.rowid
+            WHERE p.server_id = ? AND playlists_fts MATCH ? ORDER BY rank LIMIT ?;''',
+            ['"' + pattern.replace('"', '""') + '"'],
+        )
+    else:
+        condition.append("instr(playlist_text, ?) > 0")
+        params.append(pattern)
+    if "%" in pattern or "?" in pattern:
+        condition.append("playlist_text GLOB ?")
+        params.append(to_glob(pattern))
+    unranked = None
+    if condition:
+        unranked = (
+            f"SELECT playlist_name, NULL FROM playlists WHERE server_id = ? AND ({' OR '.join(condition)}) ORDER BY playlist_name LIMIT ?;",
+            params,
+        )
+    return ranked, unranked
+
+# Characters (roughly) shown around a match by `;playlists search`
+SNIPPET_TOKENS = 40
+
+# Seconds a regex command's query can run before it's interrupted
+REGEX_TIMEOUT = 5
+
+# Maximum number of playlists a server can have
+MAX_PLAYLISTS = 500
+
+# Maximum number of songs in a playlist
+MAX_ENTRIES = 1000
+
+# Songs listed per page by `;playlists songs`
+SONGS_PER_PAGE = 20
+
+def check_query(query: str):
+    """Raise ValueError if query can't be played, same limits as `;stream`"""
+    if len(query) > 100:
+        raise ValueError("query too long (length over 100)")
+    if not query.isprintable():
+        raise ValueError(f"query not printable: {query!r}")
+
+# Markdown list markers in front of a song, like "- ", "* " or "1. "
+LIST_MARKER = re.compile(r"^(?:[-*+]|\d+[.)])\s+")
+# A link on its own, anything else that isn't in a list is just text
+URL = re.compile(r"https?://\S+")
+
+def _song_lines(lines):
+    """Yield the index and song of each line that lists a song"""
+    found = 0
+    for index, line in enumerate(lines):
+        if found >= MAX_ENTRIES:
+            return
+        line = line.strip()
+        if not line or line.startswith(("#", ">", "```")):
+            continue
+        marker = LIST_MARKER.match(line)
+        if marker is not None:
+            line = line[marker.end():].strip()
+        if line.startswith("<") and line.endswith(">"):
+            line = line[1:-1].strip()
+        if marker is None and not URL.fullmatch(line):
+            continue
+        if line and len(line) <= 100 and line.isprintable():
+            found += 1
+            yield index, line
+
+def parse_entries(text: str):
+    """Return the songs listed in a playlist's text, one per line
+
+    Same rules as the migration that created `playlist_entries`: headings,
+    quotes, code fences and blank lines are skipped, list markers are stripped
+    and so are the <> used to stop Discord from embedding links. Only list
+    items and links count as songs, other lines are taken to be notes.
+
+    """
+    return [query for _, query in _song_lines(text.splitlines())]
+
+def render_text(text: str, entries):
+    """Return a playlist's text with its songs replaced by entries
+
+    The text stays the source of the songs, so every change to the songs is
+    written back into it. The nth song line becomes the nth entry (left as
+    written if it's the same song), leftover song lines are dropped and extra
+    entries are added as list items after the last song line.
+
+    """
+    lines = text.splitlines()
+    songs = dict(_song_lines(lines))
+    rendered = []
+    entries = iter(entries)
+    last = None
+    for index, line in enumerate(lines):
+        if index not in songs:
+            rendered.append(line)
+            continue
+        query = next(entries, None)
+        if query is None:
+            continue
+        rendered.append(line if songs[index] == query else f"- {query}")
+        last = len(rendered)
+    extra = [f"- {query}" for query in entries]
+    if last is None:
+        rendered.extend(extra)
+    else:
+        rendered[last:last] = extra
+    return "\n".join(rendered)
+
+async def sync_text(db, list_id):
+    """Write a playlist's songs back into its text, returning the new text"""
+    async with db.execute("SELECT playlist_text FROM playlists WHERE playlist_id = ?;", (list_id,)) as cursor:
+        [text] = await cursor.fetchone()
+    async with db.execute("SELECT query FROM playlist_entries WHERE playlist_id = ? ORDER BY position;", (list_id,)) as cursor:
+        entries = [query async for [query] in cursor]
+    text = render_text(text, entries)
+    await db.execute("UPDATE playlists SET playlist_text = ? WHERE playlist_id = ?;", (text, list_id))
+    return text
+
+async def playlist_id(db, server_id, name):
+    """Return the ID of a playlist, or None if it doesn't exist"""
+    async with db.execute(
+        "SELECT playlist_id FROM playlists WHERE server_id = ? AND playlist_name = ?;",
+        (server_id, name),
+    ) as cursor:
+        row = await cursor.fetchone()
+    return None if row is None else row[0]
+
+def check_name(name: str):
+    """Raise ValueError if name can't be used for a new playlist"""
+    if len(name) > 35:
+        raise ValueError("Name too long (length over 35)")
+    if not re.fullmatch(r"[a-zA-Z0-9_]*", name):
+        raise ValueError("Name does not conform to the regex ^[a-zA-Z0-9_]*$")
+
+async def find_names(db, server_id, pattern, limit=-1):
+    """Return the names of playlists matching a find pattern, in name order"""
+    condition, params = glob_to_sql(pattern)
+    # A negative LIMIT means no limit
+    async with db.execute(
+        f"SELECT playlist_name FROM playlists WHERE server_id = ? AND {condition} ORDER BY playlist_name LIMIT ?;",
+        [server_id, *params, limit],
+    ) as cursor:
+        return [name async for [name] in cursor]
+
+def find_in(names, pattern, limit=-1):
+    """Same as find_names, but for names that are already in memory"""
+    names = sorted(names)
+    if "%" not in pattern and "?" not in pattern:
+        found = [name for name in names if pattern in name]
+        return found if limit < 0 else found[:limit]
+    return match_many(pattern, names, limit)
+
+# The bulk functions below change many playlists with a single executemany.
+# They should be run inside `bot.db.write()` so either every change is made or
+# none are, and each returns what it actually changed.
+
+async def bulk_remove(db, server_id, names):
+    """Remove playlists by name, returning the names that existed"""
+    names = await _existing(db, server_id, names)
+    await db.executemany(
+        "DELETE FROM playlists WHERE server_id = ? AND playlist_name = ?;",
+        [(server_id, name) for name in names],
+    )
+    return names
+
+async def move_entry(db, list_id, origin, target):
+    """Move a playlist's song from one 0-based position to another"""
+    # Park the song, shift the ones in between over by one, then put the song
+    # in the freed spot
+    await db.execute(
+        "UPDATE playlist_entries SET position = -1 WHERE playlist_id = ? AND position = ?;",
+        (list_id, origin),
+    )
+    if origin < target:
+        await db.execute(
+            "UPDATE playlist_entries SET position = position - 1 WHERE playlist_id = ? AND position > ? AND position <= ?;",
+            (list_id, origin, target),
+        )
+    else:
+        await db.execute(
+            "UPDATE playlist_entries SET position = position + 1 WHERE playlist_id = ? AND position >= ? AND position < ?;",
+            (list_id, target, origin),
+        )
+    await db.execute(
+        "UPDATE playlist_entries SET position = ? WHERE playlist_id = ? AND position = -1;",
+        (target, list_id),
+    )
+
+async def bulk_set_owner(db, server_id, names, owner_id):
+    """Set the owner of playlists by name, returning the names that existed"""
+    names = await _existing(db, server_id, names)
+    await db.executemany(
+        "UPDATE playlists SET owner_id = ? WHERE server_id = ? AND playlist_name = ?;",
+        [(owner_id, server_id, name) for name in names],
+    )
+    return names
+
+async def bulk_rename(db, server_id, renames):
+    """Rename playlists from a list of (name, new name) pairs
+
+    Returns the pairs whose playlist existed. Raises ValueError without
+    renaming anything if a new name is invalid or would be taken.
+
+    """
+    renames = dict(renames)
+    for new_name in renames.values():
+        check_name(new_name)
+    existing = await _existing(db, server_id, renames)
+    renames = {name: renames[name] for name in existing}
+    new_names = list(renames.values())
+    if len(set(new_names)) != len(new_names):
+        raise ValueError("multiple playlists would get the same name")
+    # Names being renamed away are free to take
+    taken = set(await _existing(db, server_id, new_names)) - renames.keys()
+    if taken:
+        raise ValueError(f"playlists already exist: {', '.join(sorted(taken))}")
+    # Move everything out of the way first, so renames like a -> b, b -> c
+    # don't collide halfway through
+    await db.executemany(
+        "UPDATE playlists SET playlist_name = ? WHERE server_id = ? AND playlist_name = ?;",
+        [(f"\0{name}", server_id, name) for name in renames],
+    )
+    await db.executemany(
+        "UPDATE playlists SET playlist_name = ? WHERE server_id = ? AND playlist_name = ?;",
+        [(new_name, server_id, f"\0{name}") for name, new_name in renames.items()],
+    )
+    return list(renames.items())
+
+async def _existing(db, server_id, names):
+    """Return which of names are playlists in the server, in name order"""
+    names = list(names)
+    if not names:
+        return []
+    # Passed as a JSON array so any number of names fits in one parameter
+    async with db.execute(
+        "SELECT playlist_name FROM playlists WHERE server_id = ? AND playlist_name IN (SELECT value FROM json_each(?)) ORDER BY playlist_name;",
+        (server_id, json.dumps(names)),
+    ) as cursor:
+        return [name async for [name] in cursor]
+
+# Playlists written per transaction by `import_playlists`
+IMPORT_CHUNK = 500
+
+# Each playlist's song queries, in order, as a JSON array
+_ENTRIES_JSON = """(
+    SELECT json_group_array(query) FROM (
+        SELECT query FROM playlist_entries AS e WHERE e.playlist_id = p.playlist_id ORDER BY position
+    )
+)"""
+
+async def export_playlists(db, server_id=None):
+    """Yield the playlists of a server (or every server) as lines of JSON
+
+    Rows are streamed off the cursor, so the whole export is never in memory.
+
+    """
+    if server_id is None:
+        sql = f"SELECT server_id, playlist_name, owner_id, playlist_text, {_ENTRIES_JSON} FROM playlists AS p ORDER BY server_id, playlist_name;"
+        params = ()
+    else:
+        sql = f"SELECT server_id, playlist_name, owner_id, playlist_text, {_ENTRIES_JSON} FROM playlists AS p WHERE server_id = ? ORDER BY playlist_name;"
+        params = (server_id,)
+    async with db.execute(sql, params) as cursor:
+        async for server_id, name, owner_id, text, entries in cursor:
+            record = {
+                "server_id": server_id,
+                "name": name,
+                "owner_id": owner_id,
+                "text": text,
+                "entries": json.loads(entries),
+            }
+            yield json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+def read_playlists(lines, server_id=None):
+    """Parse the lines written by `export_playlists`
+
+    Yields (server_id, name, owner_id, text, entries) for each line, putting
+    every playlist in server_id if it's given. Raises ValueError on the first
+    bad line. Lines without entries get them from their text, like `add`, and
+    lines with entries get their text's songs replaced by them.
+
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
             continue
-        return False
-    return True
+        try:
+            record = json.loads(line)
+            name = record["name"]
+            text = record["text"]
+            owner_id = record.get("owner_id")
+            entries = record.get("entries")
+            if not isinstance(name, str) or not isinstance(text, str):
+                raise ValueError("name and text must be strings")
+            if owner_id is not None and not isinstance(owner_id, int):
+                raise ValueError("owner_id must be an integer")
+            check_name(name)
+            if entries is None:
+                entries = parse_entries(text)
+            if not isinstance(entries, list) or not all(isinstance(query, str) for query in entries):
+                raise ValueError("entries must be a list of strings")
+            if len(entries) > MAX_ENTRIES:
+                raise ValueError(f"too many songs in playlist: {len(entries)} (limit {MAX_ENTRIES})")
+            for query in entries:
+                check_query(query)
+            guild_id = record["server_id"] if server_id is None else server_id
+            if not isinstance(guild_id, int):
+                raise ValueError("server_id must be an integer")
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            raise ValueError(f"line {number}: {exc!s}") from None
+        # The text lists the same songs as the entries
+        yield guild_id, name, owner_id, render_text(text, entries), entries
+
+async def import_playlists(pool, records, *, chunk=IMPORT_CHUNK):
+    """Add the playlists from `read_playlists`, chunk playlists per transaction
+
+    Playlists whose names are already taken in their server are skipped, so
+    running the same import twice is harmless, and so are the ones that don't
+    fit in a server that has MAX_PLAYLISTS already. Servers are created as
+    needed. Every chunk bumps `playlist_generation`, which tells running bots
+    to drop their playlist caches. Returns a Counter of playlists added per
+    server, the number skipped for their names, and a Counter of playlists
+    skipped per full server.
+
+    """
+    servers = Counter()
+    skipped = 0
+    full = Counter()
+    records = iter(records)
+    while batch := list(itertools.islice(records, chunk)):
+        async with pool.write() as db:
+            guild_ids = {record[0] for record in batch}
+            await db.executemany(
+                "INSERT OR IGNORE INTO server (server_id) VALUES (?);",
+                [(guild_id,) for guild_id in guild_ids],
+            )
+            # Counted in the same transaction, so commands can't add playlists
+            # in between
+            counts = {}
+            for guild_id in guild_ids:
+                async with db.execute("SELECT COUNT(*) FROM playlists WHERE server_id = ?;", (guild_id,)) as cursor:
+                    [counts[guild_id]] = await cursor.fetchone()
+            for guild_id, name, owner_id, text, entries in batch:
+                if counts[guild_id] >= MAX_PLAYLISTS:
+                    # Still counted as taken if it is, like importing twice
+                    if await playlist_id(db, guild_id, name) is None:
+                        full[guild_id] += 1
+                    else:
+                        skipped += 1
+                    continue
+                async with db.execute(
+                    "INSERT OR IGNORE INTO playlists (server_id, playlist_name, playlist_text, owner_id) VALUES (?, ?, ?, ?);",
+                    (guild_id, name, text, owner_id),
+                ) as cursor:
+                    if cursor.rowcount <= 0:
+                        skipped += 1
+                        continue
+                    list_id = cursor.lastrowid
+                await db.executemany(
+                    "INSERT INTO playlist_entries (playlist_id, position, query) VALUES (?, ?, ?);",
+                    [(list_id, position, query) for position, query in enumerate(entries)],
+                )
+                servers[guild_id] += 1
+                counts[guild_id] += 1
+            await db.execute("UPDATE playlist_generation SET generation = generation + 1;")
+    return servers, skipped, full
+
+class GuildPlaylists:
+    """Cached playlists of one server"""
+
+    __slots__ = ("owners", "texts")
+
+    def __init__(self, owners):
+        # Name -> owner ID for every playlist in the server
+        self.owners = owners
+        # Name -> text for recently used playlists, loaded on demand
+        self.texts = OrderedDict()
+
+class PlaylistCache:
+    """Write-through cache of playlist names, owners and texts per server
+
+    A server's names and owners are loaded the first time they are needed and
+    kept for the most recently used servers. Commands that change playlists
+    update the cache right after their SQL (inside the same write), so reads
+    never have to go back to the database.
+
+    The update methods can be called even if the server isn't cached and can
+    safely be applied twice.
+
+    """
+
+    def __init__(self, db, *, maxsize=256, texts=64):
+        self.db = db
+        self.maxsize = maxsize
+        # Texts kept per server
+        self.max_texts = texts
+        self.guilds = OrderedDict()
+        # Bumped on every change, so a load that raced with a change is
+        # thrown away instead of cached
+        self.versions = Counter()
+        # Same, for changes to every server at once (see `clear`)
+        self.generation = 0
+
+    async def get(self, guild_id):
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            self.guilds.move_to_end(guild_id)
+            return guild
+        version = (self.generation, self.versions[guild_id])
+        async with self.db.read() as db:
+            async with db.execute(
+                "SELECT playlist_name, owner_id FROM playlists WHERE server_id = ? ORDER BY playlist_name;",
+                (guild_id,),
+            ) as cursor:
+                guild = GuildPlaylists({name: owner_id async for name, owner_id in cursor})
+        if version != (self.generation, self.versions[guild_id]):
+            return guild
+        self.guilds[guild_id] = guild
+        if len(self.guilds) > self.maxsize:
+            self.guilds.popitem(last=False)
+        return guild
+
+    def peek(self, guild_id):
+        """Return the server's cached playlists, or None if they aren't cached"""
+        guild = self.guilds.get(guild_id)
+        if guild is not None:
+            self.guilds.move_to_end(guild_id)
+        return guild
+
+    async def text(self, guild_id, name):
+        """Return a playlist's text, or None if it doesn't exist"""
+        guild = await self.get(guild_id)
+        if name not in guild.owners:
+            return None
+        text = guild.texts.get(name)
+        if text is not None:
+            guild.texts.move_to_end(name)
+            return text
+        version = self.versions[guild_id]
+        async with self.db.read() as db:
+            async with db.execute(
+                "SELECT playlist_text FROM playlists WHERE server_id = ? AND playlist_name = ?;",
+                (guild_id, name),
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return None
+        if version == self.versions[guild_id]:
+            self._set_text(guild, name, row[0])
+        return row[0]
+
+    def _set_text(self, guild, name, text):
+        guild.texts[name] = text
+        guild.texts.move_to_end(name)
+        if len(guild.texts) > self.max_texts:
+            guild.texts.popitem(last=False)
+
+    def _changed(self, guild_id):
+        self.versions[guild_id] += 1
+        return self.guilds.get(guild_id)
+
+    def invalidate(self, guild_id):
+        self._changed(guild_id)
+        self.guilds.pop(guild_id, None)
+
+    def clear(self):
+        """Invalidate every server, including ones that are being loaded"""
+        self.generation += 1
+        self.guilds.clear()
+
+    def added(self, guild_id, name, text, owner_id):
+        if (guild := self._changed(guild_id)) is not None:
+            guild.owners[name] = owner_id
+            self._set_text(guild, name, text)
+
+    def updated(self, guild_id, name, text):
+        if (guild := self._changed(guild_id)) is not None and name in guild.owners:
+            self._set_text(guild, name, text)
+
+    def owner_set(self, guild_id, names, owner_id):
+        if (guild := self._changed(guild_id)) is not None:
+            for name in names:
+                if name in guild.owners:
+                    guild.owners[name] = owner_id
+
+    def renamed(self, guild_id, renames):
+        if (guild := self._changed(guild_id)) is not None:
+            moved = []
+            for name, new_name in renames:
+                if name in guild.owners:
+                    moved.append((new_name, guild.owners.pop(name), guild.texts.pop(name, None)))
+            for new_name, owner_id, text in moved:
+                guild.owners[new_name] = owner_id
+                if text is not None:
+                    self._set_text(guild, new_name, text)
+
+    def removed(self, guild_id, names):
+        if (guild := self._changed(guild_id)) is not None:
+            for name in names:
+                guild.owners.pop(name, None)
+                guild.texts.pop(name, None)
 
 class Playlists(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        self.cache = PlaylistCache(bot.db)
+        # Last seen `playlist_generation`
+        self.generation = None
+        self.watcher.start()
+
+    async def cog_unload(self):
+        self.watcher.cancel()
+
+    # Drops the cache when playlists get imported from outside this process
+    # (`python -m jgm import`, or another cluster worker)
+    @tasks.loop(seconds=5)
+    async def watcher(self):
+        try:
+            generation = await self.read_generation()
+            if generation != self.generation:
+                self.generation = generation
+                self.cache.clear()
+        except Exception as exc:
+            print("Exception occured while checking for imported playlists:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+
+    @watcher.before_loop
+    async def before_watcher(self):
+        self.generation = await self.read_generation()
+
+    async def read_generation(self):
+        async with self.bot.db.read() as db:
+            async with db.execute("SELECT generation FROM playlist_generation;") as cursor:
+                return (await cursor.fetchone())[0]
+
+    @contextlib.asynccontextmanager
+    async def write(self, guild_id):
+        """Borrows the database writer, dropping the server's cache if it fails
+
+        Update the cache inside the block, right after the SQL, so no other
+        write can see the cache in between.
+
+        """
+        try:
+            async with self.bot.db.write() as db:
+                yield db
+        except BaseException:
+            self.cache.invalidate(guild_id)
+            raise
+
+    def can_change(self, ctx, owner_id):
+        """Whether the author may change a playlist with this owner"""
+        return owner_id is None or ctx.author.id in (self.bot.owner_id, ctx.guild.owner_id, owner_id)
+
+    async def member_name(self, guild, user_id):
+        """Return someone's name, fetching them if they aren't cached
+
+        The member cache may only hold people in voice channels (see
+        JOSHGONE_CACHE), so anyone else is looked up on demand.
+
+        """
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member.name
+        try:
+            return (await guild.fetch_member(user_id)).name
+        except discord.NotFound:
+            pass
+        # Not in the server anymore
+        try:
+            return (await self.bot.fetch_user(user_id)).name
+        except discord.NotFound:
+            return f"unknown user {user_id}"
+
+    def refusal(self, ctx, guild, name, action="change"):
+        """Return why the author can't change a playlist, or None if they can
+
+        Checked while holding the writer, but the reply is only sent after
+        letting go of it, since sending can wait on the channel's budget.
+
+        """
+        if name not in guild.owners:
+            return f"Playlist `{name}` doesn't exist"
+        if not self.can_change(ctx, guild.owners[name]):
+            return f"You do not have permission to {action} this playlist."
+        return None
+
+    async def editable(self, ctx, db, name):
+        """Return the ID of a playlist the author may change and None, or None
+        and why they can't
+        """
+        refusal = self.refusal(ctx, await self.cache.get(ctx.guild.id), name)
+        if refusal is not None:
+            return None, refusal
+        return await playlist_id(db, ctx.guild.id, name), None
+
+    @commands.Cog.listener()
+    async def on_song_resolved(self, guild_id, audio):
+        # Remember what saved songs are called the first time they're played
+        metadata = audio.metadata
+        if audio.ty != "stream" or not metadata or metadata.get("title") is None:
+            return
+        async with self.bot.db.write() as db:
+            await db.execute(
+                "UPDATE playlist_entries SET title = ?, duration = ? WHERE query = ? AND title IS NULL;",
+                (metadata["title"], metadata.get("duration"), audio.query),
+            )
 
     @commands.group(aliases=["li"], name="playlists", ignore_extra=False, pass_context=True, invoke_without_command=True)
     @commands.cooldown(1, 1, BucketType.user)
     async def _playlists(self, ctx):
         """Configure playlists"""
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_name FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                names = [row[0] async for row in cursor]
-        for i, name in enumerate(names):
-            names[i] = f"`{name}`"
+        guild = await self.cache.get(ctx.guild.id)
+        names = [f"`{name}`" for name in sorted(guild.owners)]
         length = len(names)
         if not names:
             names = ["None"]
         for i in range(1, len(names)):
             names[i] = f", {names[i]}"
         names.insert(0, f"Playlists [{length}]: ")
-        for message in self.pack(names):
-            await ctx.send(message)
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(names))
 
     @staticmethod
     def pack(strings, *, maxlen=2000):
@@ -109,112 +838,238 @@ class Playlists(commands.Cog):
 
     @_playlists.command(name="find", ignore_extra=False)
     @commands.cooldown(1, 1, BucketType.user)
-    async def _find(self, ctx, name_pattern: str):
+    async def _find(self, ctx, name_pattern: str, max_amount: typing.Optional[int] = -1):
         """Find playlists whose names contain or match the given pattern"""
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute(
-                "SELECT playlist_name FROM playlists WHERE server_id = ?;",
-                [ctx.guild.id],
-            ) as cursor:
-                names = [
-                    f"`{name}`"
-                    async for [name] in cursor
-                    if match(name_pattern, name) or name_pattern in name
-                ]
+        guild = self.cache.peek(ctx.guild.id)
+        if guild is not None:
+            names = find_in(guild.owners, name_pattern, max_amount)
+        else:
+            async with self.bot.db.read() as db:
+                names = await find_names(db, ctx.guild.id, name_pattern, max_amount)
+        names = [f"`{name}`" for name in names]
         length = len(names)
         if not names:
             names = ["None"]
         for i in range(1, len(names)):
             names[i] = f", {names[i]}"
         names.insert(0, f"Found {length}: ")
-        for message in self.pack(names):
-            await ctx.send(message)
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(names))
 
     @_playlists.command(name="search", ignore_extra=False)
     @commands.cooldown(1, 1, BucketType.user)
     async def _search(self, ctx, name_pattern: str, max_amount: typing.Optional[int] = -1):
         """Find playlists whose contents contain or match the given pattern"""
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_name, playlist_text FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                playlists = [row async for row in cursor]
-        found = []
-        for name, text in playlists:
-            if len(found) == max_amount:
-                break
-            if not (match(name_pattern, text) or name_pattern in text):
-                continue
-            found.append(f"`{name}`")
+        found = {}
+        async with self.bot.db.read() as db:
+            for query in search_to_sql(name_pattern):
+                if query is None or len(found) == max_amount:
+                    continue
+                sql, params = query
+                limit = -1 if max_amount < 0 else max_amount - len(found)
+                async with db.execute(sql, [ctx.guild.id, *params, limit]) as cursor:
+                    async for name, snippet in cursor:
+                        found.setdefault(name, snippet)
         length = len(found)
-        if not found:
-            found = ["None"]
-        for i in range(1, len(found)):
-            found[i] = f", {found[i]}"
-        found.insert(0, f"Found {length}: ")
-        for message in self.pack(found):
-            await ctx.send(message)
+        lines = []
+        for name, snippet in found.items():
+            if snippet is None:
+                lines.append(f"\n`{name}`")
+                continue
+            # Highlight the match without letting the text's own markdown through
+            snippet = escape_markdown(" ".join(snippet.split()))
+            snippet = snippet.replace("\x02", "**").replace("\x03", "**")
+            lines.append(f"\n`{name}`: {snippet}")
+        if not lines:
+            lines = ["None"]
+        lines.insert(0, f"Found {length}: ")
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(lines), suppress_embeds=True)
+
+    async def regex_names(self, db, ctx, column, regex, max_amount):
+        """Return the names of playlists whose column matches regex
+
+        Matching happens in SQLite, in name order, and stops once max_amount
+        playlists are found.
+
+        """
+        check_regex(regex)
+        try:
+            async with deadline(db, REGEX_TIMEOUT):
+                async with db.execute(
+                    f"SELECT playlist_name FROM playlists WHERE server_id = ? AND {column} REGEXP ? ORDER BY playlist_name LIMIT ?;",
+                    (ctx.guild.id, regex, max_amount),
+                ) as cursor:
+                    return [name async for [name] in cursor]
+        except sqlite3.OperationalError as exc:
+            if str(exc) != "interrupted":
+                raise
+            raise ValueError(f"regex took longer than {REGEX_TIMEOUT} seconds") from None
+
+    @_playlists.command(name="songs", aliases=["entries"], ignore_extra=False)
+    @commands.cooldown(1, 1, BucketType.user)
+    async def _songs(self, ctx, name: str, page: int = 1):
+        """List the songs in a playlist"""
+        # Imported here instead of at the top: importing the music extension
+        # before it's loaded would leave a second copy of it behind (with its
+        # own yt-dlp patch), since load_extension always executes it afresh
+        from jgm.extensions.music import seconds_to_hhmmss
+        if page <= 0:
+            raise ValueError(f"page [{page}] not a positive integer")
+        async with self.bot.db.read() as db:
+            if (list_id := await playlist_id(db, ctx.guild.id, name)) is None:
+                await ctx.send(f"Playlist `{name}` doesn't exist")
+                return
+            async with db.execute("SELECT COUNT(*) FROM playlist_entries WHERE playlist_id = ?;", (list_id,)) as cursor:
+                [count] = await cursor.fetchone()
+            # Positions are contiguous, so a page is a range of the index
+            async with db.execute(
+                "SELECT position, query, title, duration FROM playlist_entries WHERE playlist_id = ? AND position >= ? ORDER BY position LIMIT ?;",
+                (list_id, (page - 1) * SONGS_PER_PAGE, SONGS_PER_PAGE),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        pages = max(1, math.ceil(count / SONGS_PER_PAGE))
+        paginator = commands.Paginator()
+        paginator.add_line(f"Playlist {name} (page {page}/{pages}, {count} songs):")
+        for position, query, title, duration in rows:
+            line = f"{position + 1}: {title or query}"
+            if duration is not None:
+                line += f" [{seconds_to_hhmmss(duration)}]"
+            paginator.add_line(line)
+        if not rows:
+            paginator.add_line("None")
+        await self.bot.outbound.send_pages(ctx.channel, paginator.pages)
+
+    @_playlists.command(name="append")
+    @commands.cooldown(1, 1, BucketType.user)
+    async def _append(self, ctx, name, *, queries):
+        """Add songs to the end of a playlist, one per line"""
+        queries = [query.strip() for query in queries.splitlines() if query.strip()]
+        for query in queries:
+            check_query(query)
+        async with self.write(ctx.guild.id) as db:
+            list_id, reply = await self.editable(ctx, db, name)
+            if reply is None:
+                async with db.execute(
+                    "SELECT COUNT(*), COALESCE(MAX(position) + 1, 0) FROM playlist_entries WHERE playlist_id = ?;",
+                    (list_id,),
+                ) as cursor:
+                    count, end = await cursor.fetchone()
+                if count + len(queries) > MAX_ENTRIES:
+                    raise ValueError(f"too many songs in playlist: {count + len(queries)} (limit {MAX_ENTRIES})")
+                await db.executemany(
+                    "INSERT INTO playlist_entries (playlist_id, position, query) VALUES (?, ?, ?);",
+                    [(list_id, end + i, query) for i, query in enumerate(queries)],
+                )
+                self.cache.updated(ctx.guild.id, name, await sync_text(db, list_id))
+                reply = f"Appended {len(queries)} songs to playlist `{name}`"
+        await ctx.send(reply)
+
+    @_playlists.command(name="delete", ignore_extra=False)
+    @commands.cooldown(1, 1, BucketType.user)
+    async def _delete(self, ctx, name: str, position: int):
+        """Remove a song from a playlist"""
+        async with self.write(ctx.guild.id) as db:
+            list_id, reply = await self.editable(ctx, db, name)
+            if reply is None:
+                async with db.execute(
+                    "SELECT query FROM playlist_entries WHERE playlist_id = ? AND position = ?;",
+                    (list_id, position - 1),
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    raise ValueError(f"position [{position}] not in playlist")
+                await db.execute(
+                    "DELETE FROM playlist_entries WHERE playlist_id = ? AND position = ?;",
+                    (list_id, position - 1),
+                )
+                # Close the gap
+                await db.execute(
+                    "UPDATE playlist_entries SET position = position - 1 WHERE playlist_id = ? AND position > ?;",
+                    (list_id, position - 1),
+                )
+                self.cache.updated(ctx.guild.id, name, await sync_text(db, list_id))
+                reply = f"Removed from playlist `{name}`: {row[0]}"
+        await ctx.send(reply)
+
+    @_playlists.command(name="move", ignore_extra=False)
+    @commands.cooldown(1, 1, BucketType.user)
+    async def _move(self, ctx, name: str, origin: int, target: int):
+        """Move a song to another position in a playlist"""
+        async with self.write(ctx.guild.id) as db:
+            list_id, reply = await self.editable(ctx, db, name)
+            if reply is None:
+                async with db.execute("SELECT COUNT(*) FROM playlist_entries WHERE playlist_id = ?;", (list_id,)) as cursor:
+                    [count] = await cursor.fetchone()
+                for position in (origin, target):
+                    if not 1 <= position <= count:
+                        raise ValueError(f"position [{position}] not in the range [1, {count}]")
+                if origin == target:
+                    reply = "Playlist unchanged, song is already there"
+                else:
+                    await move_entry(db, list_id, origin - 1, target - 1)
+                    self.cache.updated(ctx.guild.id, name, await sync_text(db, list_id))
+                    reply = f"Moved song {origin} of playlist `{name}` to position {target}"
+        await ctx.send(reply)
+
+    @_playlists.command(name="play", ignore_extra=False)
+    @commands.cooldown(1, 3, BucketType.user)
+    async def _play(self, ctx, name: str):
+        """Add every song in a playlist to the queue"""
+        music = self.bot.get_cog("Music")
+        if music is None:
+            raise commands.CommandError("Music extension not loaded")
+        async with self.bot.db.read() as db:
+            if (list_id := await playlist_id(db, ctx.guild.id, name)) is None:
+                await ctx.send(f"Playlist `{name}` doesn't exist")
+                return
+            async with db.execute(
+                "SELECT query FROM playlist_entries WHERE playlist_id = ? ORDER BY position;",
+                (list_id,),
+            ) as cursor:
+                queries = [query async for [query] in cursor]
+        if not queries:
+            await ctx.send(f"Playlist `{name}` has no songs")
+            return
+        await music.ensure_connected(ctx)
+        skipped = music.enqueue_streams(ctx, queries)
+        await ctx.send(f"Added playlist `{name}` to queue ({len(queries) - skipped} songs{f', skipped {skipped} duplicates' if skipped else ''})")
 
     @_playlists.command(name="regexfind", ignore_extra=False, hidden=True)
     @commands.is_owner()
     async def _regexfind(self, ctx, max_amount: typing.Optional[int] = -1, *, regex):
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_name FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                names = [row[0] async for row in cursor]
-        found = []
-        for name in names:
-            if len(found) == max_amount:
-                break
-            if not re.search(regex, name):
-                continue
-            found.append(f"`{name}`")
+        async with self.bot.db.read() as db:
+            found = await self.regex_names(db, ctx, "playlist_name", regex, max_amount)
         length = len(found)
+        found = [f"`{name}`" for name in found]
         if not found:
             found = ["None"]
         for i in range(1, len(found)):
             found[i] = f", {found[i]}"
         found.insert(0, f"Found {length}: ")
-        for message in self.pack(found):
-            await ctx.send(message)
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(found))
 
     @_playlists.command(name="regexsearch", ignore_extra=False, hidden=True)
     @commands.is_owner()
     async def _regexsearch(self, ctx, max_amount: typing.Optional[int] = -1, *, regex):
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_name, playlist_text FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                playlists = [row async for row in cursor]
-        found = []
-        for name, text in playlists:
-            if len(found) == max_amount:
-                break
-            if not re.search(regex, text):
-                continue
-            found.append(f"`{name}`")
+        async with self.bot.db.read() as db:
+            found = await self.regex_names(db, ctx, "playlist_text", regex, max_amount)
         length = len(found)
+        found = [f"`{name}`" for name in found]
         if not found:
             found = ["None"]
         for i in range(1, len(found)):
             found[i] = f", {found[i]}"
         found.insert(0, f"Found {length}: ")
-        for message in self.pack(found):
-            await ctx.send(message)
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(found))
 
     @_playlists.command(name="regexremove", ignore_extra=False, hidden=True)
     @commands.is_owner()
     async def _regexremove(self, ctx, max_amount: typing.Optional[int] = -1, *, regex):
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_name FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                names = [row[0] async for row in cursor]
-        removed = []
-        for name in names:
-            if len(removed) == max_amount:
-                break
-            if not re.search(regex, name):
-                continue
-            removed.append(name)  # Don't wrap around with `` because need to remove from DB
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            for name in removed:
-                await db.execute("DELETE FROM playlists WHERE server_id = ? AND playlist_name = ?;", (ctx.guild.id, name))
-                name = f"`{name}`"
-            await db.commit()
+        # Matched on a reader so a slow regex doesn't hold up every other write
+        async with self.bot.db.read() as db:
+            removed = await self.regex_names(db, ctx, "playlist_name", regex, max_amount)
+        async with self.write(ctx.guild.id) as db:
+            removed = await bulk_remove(db, ctx.guild.id, removed)
+            self.cache.removed(ctx.guild.id, removed)
         length = len(removed)
         # Before cuz in `None` would refer to a chant named `None`
         removed = [f"`{i}`" for i in removed]
@@ -223,8 +1078,108 @@ class Playlists(commands.Cog):
         for i in range(1, len(removed)):
             removed[i] = f", {removed[i]}"
         removed.insert(0, f"Removed {length}: ")
-        for message in self.pack(removed):
-            await ctx.send(message)
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(removed))
+
+    @_playlists.command(name="bulkremove", ignore_extra=False, hidden=True)
+    @commands.is_owner()
+    async def _bulkremove(self, ctx, name_pattern: str, max_amount: typing.Optional[int] = -1):
+        async with self.write(ctx.guild.id) as db:
+            names = await find_names(db, ctx.guild.id, name_pattern, max_amount)
+            removed = await bulk_remove(db, ctx.guild.id, names)
+            self.cache.removed(ctx.guild.id, removed)
+        length = len(removed)
+        removed = [f"`{i}`" for i in removed]
+        if not removed:
+            removed = ["None"]
+        for i in range(1, len(removed)):
+            removed[i] = f", {removed[i]}"
+        removed.insert(0, f"Removed {length}: ")
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(removed))
+
+    @_playlists.command(name="transfer", ignore_extra=False, hidden=True)
+    @commands.is_owner()
+    async def _transfer(self, ctx, old_owner: typing.Union[Dash, discord.User], new_owner: typing.Union[Dash, discord.Member]):
+        old_owner_value = None if old_owner == "-" else old_owner.id
+        new_owner_value = None if new_owner == "-" else new_owner.id
+        async with self.write(ctx.guild.id) as db:
+            guild = await self.cache.get(ctx.guild.id)
+            names = sorted(name for name, owner_id in guild.owners.items() if owner_id == old_owner_value)
+            transferred = await bulk_set_owner(db, ctx.guild.id, names, new_owner_value)
+            self.cache.owner_set(ctx.guild.id, transferred, new_owner_value)
+        length = len(transferred)
+        transferred = [f"`{i}`" for i in transferred]
+        if not transferred:
+            transferred = ["None"]
+        for i in range(1, len(transferred)):
+            transferred[i] = f", {transferred[i]}"
+        old_name = "no owner" if old_owner == "-" else old_owner.name
+        new_name = "no owner" if new_owner == "-" else new_owner.name
+        transferred.insert(0, f"Transferred {length} from {old_name} to {new_name}: ")
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(transferred))
+
+    @_playlists.command(name="prefixrename", ignore_extra=False, hidden=True)
+    @commands.is_owner()
+    async def _prefixrename(self, ctx, prefix: str, new_prefix: str):
+        if prefix == new_prefix:
+            await ctx.send("Playlists unchanged, new prefix is the same as old prefix")
+            return
+        # Also makes sure the prefix has no wildcards in it
+        check_name(prefix)
+        async with self.write(ctx.guild.id) as db:
+            guild = await self.cache.get(ctx.guild.id)
+            names = sorted(name for name in guild.owners if name.startswith(prefix))
+            renamed = await bulk_rename(db, ctx.guild.id, [
+                (name, new_prefix + name[len(prefix):]) for name in names
+            ])
+            self.cache.renamed(ctx.guild.id, renamed)
+        length = len(renamed)
+        renamed = [f"`{name}` -> `{new_name}`" for name, new_name in renamed]
+        if not renamed:
+            renamed = ["None"]
+        for i in range(1, len(renamed)):
+            renamed[i] = f", {renamed[i]}"
+        renamed.insert(0, f"Renamed {length}: ")
+        await self.bot.outbound.send_pages(ctx.channel, self.pack(renamed))
+
+    @_playlists.command(name="export", ignore_extra=False, hidden=True)
+    @commands.is_owner()
+    async def _export(self, ctx, scope: typing.Literal["all"] = None):
+        server_id = None if scope == "all" else ctx.guild.id
+        # Spills to disk once it gets big
+        with tempfile.SpooledTemporaryFile(max_size=1 << 20) as file:
+            count = 0
+            async with self.bot.db.read() as db:
+                async for line in export_playlists(db, server_id):
+                    file.write(line.encode())
+                    count += 1
+            if file.tell() > ctx.guild.filesize_limit:
+                raise ValueError(f"export too large to upload ({file.tell()} bytes), use `python -m jgm export` instead")
+            file.seek(0)
+            await ctx.send(
+                f"Exported {count} playlists",
+                file=discord.File(file, filename="playlists.jsonl"),
+            )
+
+    @_playlists.command(name="import", ignore_extra=False, hidden=True)
+    @commands.is_owner()
+    async def _import(self, ctx, scope: typing.Literal["all"] = None):
+        if not ctx.message.attachments:
+            raise ValueError("attach the file to import (from `;playlists export`)")
+        data = await ctx.message.attachments[0].read()
+        server_id = None if scope == "all" else ctx.guild.id
+        try:
+            records = read_playlists(io.StringIO(data.decode()), server_id)
+            servers, skipped, full = await import_playlists(self.bot.db, records)
+        finally:
+            # Earlier chunks are committed even if a later line is bad
+            if scope is None:
+                self.cache.invalidate(ctx.guild.id)
+            else:
+                self.cache.clear()
+        reply = f"Imported {sum(servers.values())} playlists into {len(servers)} servers, skipped {skipped} that already exist"
+        if full:
+            reply += f" and {sum(full.values())} that didn't fit in {len(full)} servers with {MAX_PLAYLISTS} playlists"
+        await ctx.send(reply)
 
     @_playlists.command(name="update")
     @commands.cooldown(1, 1, BucketType.user)
@@ -232,28 +1187,25 @@ class Playlists(commands.Cog):
         """Update a playlist"""
         if len(name) > 35:
             raise ValueError("name too long (length over 35)")
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+        async with self.write(ctx.guild.id) as db:
+            guild = await self.cache.get(ctx.guild.id)
             # Check if user can actually change it
-            async with db.execute("SELECT owner_id FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, name)) as cursor:
-                if not (row := await cursor.fetchone()):
-                    await ctx.send(f"Playlist `{name}` doesn't exist")
-                    return
-                else:
-                    current = row[0]
-            # If there's already an owner, make sure they are allowed to change it
-            if current is not None:
-                if ctx.author.id not in (self.bot.owner_id, ctx.guild.owner_id, current):
-                    await ctx.send("You do not have permission to update this playlist.")
-                    return
-            # Update the playlist
-            async with db.execute("SELECT COUNT(*) FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                if not (row := await cursor.fetchone()):
-                    raise ValueError("could not get count of playlists")
-                if row[0] >= 500:
-                    raise ValueError(f"too many playlists stored: {row[0]}")
-            await db.execute("INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?);", (ctx.guild.id, name, text, current))
-            await db.commit()
-        await ctx.send(f"Updated playlist `{name}`")
+            reply = self.refusal(ctx, guild, name, "update")
+            if reply is None:
+                # Update the playlist
+                if len(guild.owners) >= MAX_PLAYLISTS:
+                    raise ValueError(f"too many playlists stored: {len(guild.owners)}")
+                await db.execute("UPDATE playlists SET playlist_text = ? WHERE server_id = ? AND playlist_name = ?;", (text, ctx.guild.id, name))
+                # The song list follows the new text, like when it was added
+                list_id = await playlist_id(db, ctx.guild.id, name)
+                await db.execute("DELETE FROM playlist_entries WHERE playlist_id = ?;", (list_id,))
+                await db.executemany(
+                    "INSERT INTO playlist_entries (playlist_id, position, query) VALUES (?, ?, ?);",
+                    [(list_id, position, query) for position, query in enumerate(parse_entries(text))],
+                )
+                self.cache.updated(ctx.guild.id, name, text)
+                reply = f"Updated playlist `{name}`"
+        await ctx.send(reply)
 
     @_playlists.command(name="rename")
     async def _rename(self, ctx, name, *, new_name):
@@ -265,50 +1217,45 @@ class Playlists(commands.Cog):
         if name == new_name:
             await ctx.send("Playlist unchanged, new name is the same as old name")
             return
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+        async with self.write(ctx.guild.id) as db:
+            guild = await self.cache.get(ctx.guild.id)
             # Check if user can actually change it
-            async with db.execute("SELECT owner_id FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, name)) as cursor:
-                if not (row := await cursor.fetchone()):
-                    await ctx.send(f"Playlist `{name}` doesn't exist")
-                    return
-                else:
-                    current = row[0]
+            reply = self.refusal(ctx, guild, name, "rename")
             # Check if the new playlist name exists
-            async with db.execute("SELECT playlist_text FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, new_name)) as cursor:
-                if (row := await cursor.fetchone()):
-                    await ctx.send(f"Playlist `{new_name}` exists")
-                    return
-            # If there's already an owner, make sure they are allowed to update it
-            if current is not None:
-                if ctx.author.id not in (self.bot.owner_id, ctx.guild.owner_id, current):
-                    await ctx.send("You do not have permission to rename this playlist.")
-                    return
-            # Update the name
-            await db.execute("UPDATE playlists SET playlist_name = ? WHERE playlist_name = ? AND server_id = ?;", (new_name, name, ctx.guild.id))
-            await db.commit()
-        await ctx.send(f"Renamed playlist `{name}` to `{new_name}`")
+            if reply is None and new_name in guild.owners:
+                reply = f"Playlist `{new_name}` exists"
+            if reply is None:
+                # Update the name
+                await db.execute("UPDATE playlists SET playlist_name = ? WHERE playlist_name = ? AND server_id = ?;", (new_name, name, ctx.guild.id))
+                self.cache.renamed(ctx.guild.id, [(name, new_name)])
+                reply = f"Renamed playlist `{name}` to `{new_name}`"
+        await ctx.send(reply)
 
     @_playlists.command(name="add")
     @commands.cooldown(1, 5, BucketType.user)
     async def _add(self, ctx, name, *, text):
         """Add a playlist"""
-        if len(name) > 35:
-            raise ValueError("Name too long (length over 35)")
-        if not re.fullmatch(r"[a-zA-Z0-9_]*", name):
-            raise ValueError("Name does not conform to the regex ^[a-zA-Z0-9_]*$")
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_text FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, name)) as cursor:
-                if (row := await cursor.fetchone()):
-                    await ctx.send(f"Playlist `{name}` exists")
-                    return
-            async with db.execute("SELECT COUNT(*) FROM playlists WHERE server_id = ?;", (ctx.guild.id,)) as cursor:
-                if not (row := await cursor.fetchone()):
-                    raise ValueError("could not get count of playlists")
-                if row[0] >= 500:
-                    raise ValueError(f"too many playlists stored: {row[0]}")
-            await db.execute("INSERT INTO playlists VALUES (?, ?, ?, ?);", (ctx.guild.id, name, text, ctx.author.id))
-            await db.commit()
-        await ctx.send(f"Added playlist `{name}`")
+        check_name(name)
+        async with self.write(ctx.guild.id) as db:
+            guild = await self.cache.get(ctx.guild.id)
+            if name in guild.owners:
+                reply = f"Playlist `{name}` exists"
+            else:
+                if len(guild.owners) >= MAX_PLAYLISTS:
+                    raise ValueError(f"too many playlists stored: {len(guild.owners)}")
+                async with db.execute(
+                    "INSERT INTO playlists (server_id, playlist_name, playlist_text, owner_id) VALUES (?, ?, ?, ?);",
+                    (ctx.guild.id, name, text, ctx.author.id),
+                ) as cursor:
+                    list_id = cursor.lastrowid
+                # Start the song list off with whatever the text lists
+                await db.executemany(
+                    "INSERT INTO playlist_entries (playlist_id, position, query) VALUES (?, ?, ?);",
+                    [(list_id, position, query) for position, query in enumerate(parse_entries(text))],
+                )
+                self.cache.added(ctx.guild.id, name, text, ctx.author.id)
+                reply = f"Added playlist `{name}`"
+        await ctx.send(reply)
 
     @commands.command(aliases=["h1"], name="check", ignore_extra=False)
     @commands.cooldown(1, 1, BucketType.user)
@@ -316,70 +1263,62 @@ class Playlists(commands.Cog):
         """Output the text for a single playlist"""
         if not re.fullmatch(r"[a-zA-Z0-9_]*", name):
             raise ValueError("Not a valid playlist name")
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT playlist_text FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, name)) as cursor:
-                if (row := await cursor.fetchone()):
-                    await ctx.send(row[0])
-                else:
-                    await ctx.send(f"Playlist `{name}` doesn't exist")
+        text = await self.cache.text(ctx.guild.id, name)
+        if text is not None and len(text) > 2000:
+            # Long song lists are split between lines
+            await self.bot.outbound.send_pages(ctx.channel, self.pack(f"{line}\n" for line in text.splitlines()))
+        elif text is not None:
+            await ctx.send(text)
+        else:
+            await ctx.send(f"Playlist `{name}` doesn't exist")
 
     @_playlists.command(name="owner", ignore_extra=False)
     @commands.cooldown(1, 1, BucketType.user)
     async def _owner(self, ctx, name: str, new_owner: typing.Union[Dash, discord.Member] = None):
         """Check or set the owner of a playlist"""
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            async with db.execute("SELECT owner_id FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, name)) as cursor:
-                row = await cursor.fetchone()
-                if row is None:
-                    await ctx.send(f"Playlist `{name}` doesn't exist")
-                    return
-                current = row[0]
         # Get owner
         if new_owner is None:
+            guild = await self.cache.get(ctx.guild.id)
+            if name not in guild.owners:
+                await ctx.send(f"Playlist `{name}` doesn't exist")
+                return
+            current = guild.owners[name]
             if current is None:
                 await ctx.send(f"Playlist `{name}` has no owner")
             else:
-                await ctx.send(f"Playlist `{name}` owner is {ctx.guild.get_member(current).name}")
+                await ctx.send(f"Playlist `{name}` owner is {await self.member_name(ctx.guild, current)}")
             return
-        # If there's already an owner, make sure they are allowed to change it
-        if current is not None:
-            if ctx.author.id not in (self.bot.owner_id, ctx.guild.owner_id, current):
-                await ctx.send("You are not allowed to change this playlist's owner")
-                return
         # Store the playlist's new owner
         if new_owner == "-":
             new_owner_value = None
         else:
             new_owner_value = new_owner.id
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
-            await db.execute("UPDATE playlists SET owner_id = ? WHERE server_id = ? AND playlist_name = ?;", (new_owner_value, ctx.guild.id, name))
-            await db.commit()
-        # Respond with the new owner
-        if new_owner == "-":
-            await ctx.send(f"Playlist `{name}` now has no owner")
-        else:
-            await ctx.send(f"Playlist `{name}` owner now is {new_owner.name}")
+        async with self.write(ctx.guild.id) as db:
+            # Checked while holding the writer so the playlist can't be removed
+            # or given away in between
+            reply = self.refusal(ctx, await self.cache.get(ctx.guild.id), name, "change the owner of")
+            if reply is None:
+                await db.execute("UPDATE playlists SET owner_id = ? WHERE server_id = ? AND playlist_name = ?;", (new_owner_value, ctx.guild.id, name))
+                self.cache.owner_set(ctx.guild.id, [name], new_owner_value)
+                # Respond with the new owner
+                if new_owner == "-":
+                    reply = f"Playlist `{name}` now has no owner"
+                else:
+                    reply = f"Playlist `{name}` owner now is {new_owner.name}"
+        await ctx.send(reply)
 
     @_playlists.command(name="remove", ignore_extra=False)
     async def _remove(self, ctx, name: str):
         """Remove a playlist"""
-        async with aiosqlite.connect(os.environ["JOSHGONE_DB"]) as db:
+        async with self.write(ctx.guild.id) as db:
             # Check if user can actually change it
-            async with db.execute("SELECT owner_id FROM playlists WHERE server_id = ? AND playlist_name = ? LIMIT 1;", (ctx.guild.id, name)) as cursor:
-                if not (row := await cursor.fetchone()):
-                    await ctx.send(f"Playlist `{name}` doesn't exist")
-                    return
-                else:
-                    current = row[0]
-            # If there's already an owner, make sure they are allowed to change it
-            if current is not None:
-                if ctx.author.id not in (self.bot.owner_id, ctx.guild.owner_id, current):
-                    await ctx.send("You do not have permission to remove this playlist.")
-                    return
-            # Delete the playlist
-            await db.execute("DELETE FROM playlists WHERE server_id = ? AND playlist_name = ?;", (ctx.guild.id, name))
-            await db.commit()
-        await ctx.send(f"Removed playlist `{name}`")
+            reply = self.refusal(ctx, await self.cache.get(ctx.guild.id), name, "remove")
+            if reply is None:
+                # Delete the playlist
+                await db.execute("DELETE FROM playlists WHERE server_id = ? AND playlist_name = ?;", (ctx.guild.id, name))
+                self.cache.removed(ctx.guild.id, [name])
+                reply = f"Removed playlist `{name}`"
+        await ctx.send(reply)
 
 def setup(bot):
     return bot.add_cog(Playlists(bot))
@@ -0,0 +1,226 @@
+"""Persists music sessions so they survive a restart
+
+Queue mutations are journaled by `AudioQueue` and flushed here in small
+batches, along with the rest of the guild's state (loop, filters, current song
+and playhead). Once a guild's journal gets long it is compacted into a fresh
+snapshot. On startup, saved sessions are restored and resume where they left
+off.
+
+"""
+import json
+import time
+import traceback
+import asyncio
+
+from discord.ext import commands
+from discord.ext import tasks
+
+from jgm.cluster import owns_guild
+from jgm.extensions.music import Audio, AudioQueue, FilterData
+
+# Journal rows a guild can build up before they get compacted into a snapshot
+COMPACT_AT = 1000
+# Seconds between saves of a playing song's playhead when nothing else changed
+PLAYHEAD_EVERY = 30
+
+class ResumeContext:
+    """Stands in for the command context of a restored session
+
+    The music code only needs the guild, the output channel and a way to send
+    messages, which is all a restored session has.
+
+    """
+
+    def __init__(self, bot, guild, channel):
+        self.bot = bot
+        self.guild = guild
+        self.channel = channel
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def send(self, content=None, **kwargs):
+        return await self.bot.outbound.send(self.channel, content, **kwargs)
+
+class Session(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # Guild ID -> seq of the next journal row, for guilds with a snapshot
+        self.seqs = {}
+        # Guild ID -> last saved state (without the playhead), so unchanged
+        # state isn't rewritten
+        self.states = {}
+        # Guild ID -> when its playhead was last saved
+        self.saved_at = {}
+        # Loaded after startup (e.g. `;reload session`), nothing to restore
+        if bot.is_ready():
+            self.flusher.start()
+
+    async def cog_unload(self):
+        # The next instance starts without any seqs, so it snapshots every
+        # guild again and nothing drained by a cancelled flush is lost
+        self.flusher.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready fires again on reconnects
+        if self.flusher.is_running():
+            return
+        try:
+            await self.restore()
+        finally:
+            self.flusher.start()
+
+    # Returns the state to compare with the saved one, and the playhead, which
+    # moves on every tick so it's saved along with it only now and then
+    def state_of(self, guild_id, info):
+        guild = self.bot.get_guild(guild_id)
+        voice_client = guild.voice_client if guild is not None else None
+        filter_data = info.filter_data
+        current = info.current
+        # The current song keeps the filters it started with, which may not be
+        # the ones the next song gets
+        current_filter = None if current is None or current.filter_data is None else current.filter_data
+        return {
+            "channel_id": info.channel_id,
+            "voice_channel_id": None if voice_client is None else voice_client.channel.id,
+            "loop": info.loop,
+            "dedupe": info.dedupe,
+            "filter": [filter_data.tempo, filter_data.pitch, filter_data.filter_name],
+            "current": None if current is None else current.to_record(),
+            "current_filter": None if current_filter is None else [current_filter.tempo, current_filter.pitch, current_filter.filter_name],
+        }, 0 if current is None else current.sframes
+
+    @tasks.loop(seconds=2)
+    async def flusher(self):
+        try:
+            await self.flush()
+        except Exception as exc:
+            print("Exception occured while saving music sessions:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+            # Start over from snapshots since some ops may not have been saved
+            self.seqs.clear()
+            self.states.clear()
+            self.saved_at.clear()
+
+    async def flush(self):
+        data = getattr(self.bot, "_music_data", {})
+        async with self.bot.db.write() as db:
+            for guild_id, info in list(data.items()):
+                # Left behind by an older version, converted on next use
+                if isinstance(info, dict):
+                    continue
+                queue = info.queue
+                ops = queue.journal
+                seq = self.seqs.get(guild_id)
+                state, sframes = self.state_of(guild_id, info)
+                now = time.monotonic()
+                # Rewrite the whole queue if the journal isn't attached yet (new
+                # session or reload), if it was reordered all at once (a
+                # shuffle), or if replaying it would be more work than reading a
+                # snapshot
+                if ops is None or seq is None or ("replaced",) in ops or len(ops) > len(queue) or seq + len(ops) > COMPACT_AT:
+                    queue.journal = []
+                    snapshot = json.dumps([audio.to_record() for audio in queue])
+                    await db.execute("DELETE FROM music_journal WHERE server_id = ?;", (guild_id,))
+                    await db.execute(
+                        "INSERT OR REPLACE INTO music_sessions VALUES (?, ?, ?);",
+                        (guild_id, json.dumps(state | {"sframes": sframes}), snapshot),
+                    )
+                    self.seqs[guild_id] = 0
+                    self.states[guild_id] = state
+                    self.saved_at[guild_id] = now
+                    continue
+                if ops:
+                    queue.journal = []
+                    await db.executemany(
+                        "INSERT INTO music_journal VALUES (?, ?, ?);",
+                        [(guild_id, seq + i, json.dumps(op)) for i, op in enumerate(ops)],
+                    )
+                    self.seqs[guild_id] = seq + len(ops)
+                # A moving playhead alone only gets saved every PLAYHEAD_EVERY
+                # seconds, so a restart replays at most that much of the song
+                if state != self.states.get(guild_id) or (sframes and now - self.saved_at.get(guild_id, 0) >= PLAYHEAD_EVERY):
+                    await db.execute(
+                        "UPDATE music_sessions SET state = ? WHERE server_id = ?;",
+                        (json.dumps(state | {"sframes": sframes}), guild_id),
+                    )
+                    self.states[guild_id] = state
+                    self.saved_at[guild_id] = now
+            # Sessions that ended (;leave, sleep timer, ...) since the last flush
+            for guild_id in self.seqs.keys() - data.keys():
+                await self.forget(db, guild_id)
+
+    async def forget(self, db, guild_id):
+        await db.execute("DELETE FROM music_journal WHERE server_id = ?;", (guild_id,))
+        await db.execute("DELETE FROM music_sessions WHERE server_id = ?;", (guild_id,))
+        self.seqs.pop(guild_id, None)
+        self.states.pop(guild_id, None)
+        self.saved_at.pop(guild_id, None)
+
+    async def restore(self):
+        music = self.bot.get_cog("Music")
+        if music is None:
+            return
+        sessions = {}
+        async with self.bot.db.read() as db:
+            async with db.execute("SELECT server_id, state, queue FROM music_sessions;") as cursor:
+                async for guild_id, state, snapshot in cursor:
+                    # Another worker of the cluster resumes it
+                    if not owns_guild(self.bot, guild_id):
+                        continue
+                    queue = AudioQueue(Audio.from_record(record) for record in json.loads(snapshot))
+                    sessions[guild_id] = (json.loads(state), queue)
+            async with db.execute("SELECT server_id, op FROM music_journal ORDER BY server_id, seq;") as cursor:
+                async for guild_id, op in cursor:
+                    if guild_id in sessions:
+                        sessions[guild_id][1].replay([json.loads(op)])
+        results = await asyncio.gather(
+            *(self.resume(music, guild_id, state, queue) for guild_id, (state, queue) in sessions.items()),
+            return_exceptions=True,
+        )
+        async with self.bot.db.write() as db:
+            for guild_id, result in zip(sessions, results):
+                if isinstance(result, Exception):
+                    print(f"Could not resume music session for guild {guild_id}:")
+                    traceback.print_exception(None, result, result.__traceback__)
+                if result is not True:
+                    await self.forget(db, guild_id)
+        print(f"Resumed {sum(result is True for result in results)}/{len(sessions)} music sessions.")
+
+    # Returns True if the session was resumed
+    async def resume(self, music, guild_id, state, queue):
+        guild = self.bot.get_guild(guild_id)
+        # Already running (e.g. the extension was reloaded)
+        if guild is None or guild_id in music.data:
+            return False
+        channel = guild.get_channel(state["channel_id"])
+        voice_channel = guild.get_channel(state["voice_channel_id"] or 0)
+        if channel is None or voice_channel is None:
+            return False
+        ctx = ResumeContext(self.bot, guild, channel)
+        info = music.get_info(ctx)
+        info.queue = queue
+        info.loop = state["loop"]
+        info.dedupe = state["dedupe"]
+        filter_data = info.filter_data
+        filter_data.tempo, filter_data.pitch, filter_data.filter_name = state["filter"]
+        # Play the song that was cut off first, from where it was cut off
+        if state["current"] is not None:
+            queue.appendleft(Audio.from_record(state["current"]))
+            info.resume_sframes = state["sframes"]
+            # Saved by older versions without it, the song gets the next
+            # song's filters like it used to
+            if state.get("current_filter") is not None:
+                info.resume_filter = FilterData()
+                info.resume_filter.tempo, info.resume_filter.pitch, info.resume_filter.filter_name = state["current_filter"]
+        if guild.voice_client is None:
+            await voice_channel.connect()
+        await self.bot.outbound.send(channel, "Resuming music session after restart")
+        if queue:
+            music.schedule(ctx)
+        return True
+
+def setup(bot):
+    return bot.add_cog(Session(bot))
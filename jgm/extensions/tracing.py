@@ -0,0 +1,50 @@
+"""Traces commands, see `jgm.tracing`
+
+Set `JOSHGONE_TRACE` to the fraction of commands to trace (like `0.01`), they
+get written to `JOSHGONE_TRACE_FILE` (defaults to `traces.jsonl`) along with
+every command that took over `JOSHGONE_TRACE_SLOW` seconds (defaults to 2).
+
+"""
+import os
+
+from discord.ext import commands
+
+import jgm.tracing as tracing
+from jgm import logs
+
+class Tracing(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        tracing.configure(
+            float(os.environ.get("JOSHGONE_TRACE", "0")),
+            logs.worker_path(os.environ.get("JOSHGONE_TRACE_FILE", "traces.jsonl")),
+            slow=float(os.environ.get("JOSHGONE_TRACE_SLOW", "2")),
+        )
+
+    async def cog_unload(self):
+        tracing.configure(0.0, None)
+
+    # Starts the trace. on_command runs in a task of its own, so a trace
+    # started there wouldn't be seen by the command. Global checks run in the
+    # same task as the command, before its before_invoke hooks.
+    def bot_check_once(self, ctx):
+        guild_id = None if ctx.guild is None else ctx.guild.id
+        ctx.trace = tracing.start(ctx.command.qualified_name, guild_id)
+        return True
+
+    @commands.Cog.listener()
+    async def on_command_completion(self, ctx):
+        trace = getattr(ctx, "trace", None)
+        if trace is not None:
+            trace.release()
+
+    @commands.Cog.listener()
+    async def on_command_error(self, ctx, error):
+        trace = getattr(ctx, "trace", None)
+        if trace is not None:
+            trace.release(error)
+
+def setup(bot):
+    return bot.add_cog(Tracing(bot))
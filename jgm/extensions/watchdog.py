@@ -0,0 +1,150 @@
+"""Catches code that blocks the event loop
+
+While the event loop is stuck in a blocking call (reading a file's tags,
+starting FFmpeg, skipping through frames, ...), no other server gets anything
+done. A watchdog thread asks the loop to run a callback every 100ms. If the
+callback is more than `THRESHOLD` seconds late, it grabs the loop thread's
+stack, which shows what it's stuck on, and the stall is logged to
+`jgm.watchdog` (see `jgm.logs`) and counted towards that call site. `;lag` lists the call sites that blocked the most.
+
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter, deque
+
+from discord.ext import commands
+
+from jgm.metrics import LOOP_LAG_SECONDS
+
+_logger = logging.getLogger("jgm.watchdog")
+
+# Seconds the loop may be late before it counts as blocked
+THRESHOLD = 0.25
+# Seconds between checks
+INTERVAL = 0.1
+
+# Frames from here are what the bot itself did, as opposed to the library
+# code it called into
+_PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def call_site(stack):
+    """Return the innermost frame of the bot's own code, or the innermost one"""
+    for frame in reversed(stack):
+        if frame.filename.startswith(_PACKAGE_DIR):
+            return frame
+    return stack[-1] if stack else None
+
+class LagMonitor:
+    """Watches an event loop from another thread"""
+
+    def __init__(self, loop, *, threshold=THRESHOLD, interval=INTERVAL):
+        self.loop = loop
+        # Must be created on the loop's thread
+        self.loop_thread = threading.get_ident()
+        self.threshold = threshold
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = None
+        # Guards everything below, the watchdog thread writes, commands read
+        self.lock = threading.Lock()
+        # "file:line in function" -> times blocked there, seconds blocked
+        self.counts = Counter()
+        self.seconds = Counter()
+        # Latest stalls as (when, seconds, formatted stack)
+        self.recent = deque(maxlen=10)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="lag-monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            ran = threading.Event()
+            sent = time.monotonic()
+            try:
+                self.loop.call_soon_threadsafe(ran.set)
+            except RuntimeError:
+                # Loop closed
+                return
+            if ran.wait(self.threshold):
+                LOOP_LAG_SECONDS.observe(time.monotonic() - sent)
+                continue
+            # Blocked, see what on
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = traceback.extract_stack(frame) if frame is not None else []
+            del frame
+            while not ran.wait(1):
+                if self.stopping.is_set():
+                    return
+            lag = time.monotonic() - sent
+            LOOP_LAG_SECONDS.observe(lag)
+            self.record(lag, stack)
+
+    def record(self, lag, stack):
+        site = call_site(stack)
+        key = "unknown" if site is None else f"{site.filename}:{site.lineno} in {site.name}"
+        formatted = "".join(traceback.format_list(stack))
+        with self.lock:
+            self.counts[key] += 1
+            self.seconds[key] += lag
+            self.recent.append((time.time(), lag, formatted))
+        _logger.warning("Event loop blocked for %.3fs at %s:\n%s", lag, key, formatted.rstrip("\n"))
+
+    def report(self, top):
+        """Return the call sites that blocked for the longest, with counts"""
+        with self.lock:
+            return [(key, self.counts[key], seconds) for key, seconds in self.seconds.most_common(top)]
+
+    def clear(self):
+        with self.lock:
+            self.counts.clear()
+            self.seconds.clear()
+            self.recent.clear()
+
+class Watchdog(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.monitor = None
+
+    async def cog_load(self):
+        self.monitor = LagMonitor(asyncio.get_running_loop())
+        self.monitor.start()
+
+    async def cog_unload(self):
+        self.monitor.stop()
+
+    @commands.group(hidden=True, invoke_without_command=True)
+    @commands.is_owner()
+    async def lag(self, ctx, top: int = 10):
+        paginator = commands.Paginator()
+        paginator.add_line(f"Call sites that blocked the event loop for over {self.monitor.threshold}s, longest total first:")
+        report = self.monitor.report(top)
+        for i, (key, count, seconds) in enumerate(report, 1):
+            paginator.add_line(f"{i}: {key} [{count} times, {seconds:.2f}s total, {seconds / count:.3f}s average]")
+        if not report:
+            paginator.add_line("None")
+        with self.monitor.lock:
+            recent = list(self.monitor.recent)
+        if recent:
+            when, seconds, stack = recent[-1]
+            paginator.add_line(f"Latest ({seconds:.3f}s, {time.time() - when:.0f}s ago):")
+            for line in stack.splitlines()[-12:]:
+                paginator.add_line(line)
+        await self.bot.outbound.send_pages(ctx.channel, paginator.pages)
+
+    @lag.command(name="clear")
+    @commands.is_owner()
+    async def lag_clear(self, ctx):
+        self.monitor.clear()
+        await ctx.send("Cleared event loop lag records.")
+
+def setup(bot):
+    return bot.add_cog(Watchdog(bot))
@@ -1,3 +1,8 @@
+import time
+
+# For the startup report
+_started = time.perf_counter()
+
 import os
 import asyncio
 import inspect
@@ -5,19 +10,70 @@ import inspect
 import discord
 from discord.ext import commands
 
+from jgm.db import DatabasePool
+from jgm.outbound import Outbound
+from jgm.lazy import warm
+from jgm import logs
+
+_imported = time.perf_counter()
+
 # These extensions are loaded automatically on startup
 LOAD_ON_STARTUP = (
-    "admin", "playlists", "music", "database", "info"
+    "admin", "playlists", "music", "database", "info", "session", "history",
+    "metrics", "watchdog", "tracing",
 )
 
 # We need intents to resolve a name to a Member object
 intents = discord.Intents.all()
 
+def cache_profile(name):
+    """Return the gateway intents and cache options for a profile
+
+    - `full` receives every event and caches every member of every server
+    - `minimal` only receives what the bot uses (servers, voice states and
+      messages), caches just the members in voice channels and looks anyone
+      else up when a command needs them
+
+    """
+    if name == "full":
+        return {"intents": intents}
+    if name == "minimal":
+        minimal = discord.Intents.none()
+        minimal.guilds = True
+        minimal.voice_states = True
+        minimal.guild_messages = True
+        minimal.message_content = True
+        return {
+            "intents": minimal,
+            "member_cache_flags": discord.MemberCacheFlags(voice=True, joined=False),
+            "chunk_guilds_at_startup": False,
+            # Nothing reads old messages
+            "max_messages": None,
+        }
+    raise ValueError(f"unknown cache profile: {name!r} (expected 'full' or 'minimal')")
+
 # Our prefix is % or @joshgone
 command_prefix = commands.when_mentioned_or(";")
 
+# Replies go through `bot.outbound` so they count against the channel's
+# budget and go ahead of pending notices
+class Context(commands.Context):
+    async def send(self, content=None, **kwargs):
+        return await self.bot.outbound.send(self.channel, content, **kwargs)
+
+class HelpCommand(commands.DefaultHelpCommand):
+    async def send_pages(self):
+        await self.context.bot.outbound.send_pages(self.get_destination(), self.paginator.pages)
+
+class Bot(commands.Bot):
+    async def get_context(self, origin, /, *, cls=Context):
+        return await super().get_context(origin, cls=cls)
+
+class AutoShardedBot(Bot, commands.AutoShardedBot):
+    pass
+
 # Use v1.x help command
-help_command = commands.DefaultHelpCommand(
+help_command = HelpCommand(
     show_parameter_descriptions=False
 )
 # try:
@@ -35,28 +91,59 @@ def _wrap_async(value):
     future.set_result(value)
     return future
 
+async def _load(bot, module):
+    start = time.perf_counter()
+    await bot.load_extension(f"jgm.extensions.{module}")
+    print(f"Loaded {module} ({(time.perf_counter() - start) * 1000:.1f}ms)")
+
 # This function exists so that bot is garbage collected after the function
 # ends.
-async def _run(token, **bot_kwargs):
-    bot = commands.Bot(**bot_kwargs)
+async def _run(token, bot_class=Bot, **bot_kwargs):
+    bot = bot_class(**bot_kwargs)
 
     # Helper for improving compatibility between discord.py v1.x and v2.x
     bot.wrap_async = _wrap_async
 
+    # Per-channel scheduler for replies and bulk notices
+    bot.outbound = Outbound()
+
+    # Long-lived database connections shared by all extensions
+    bot.db = DatabasePool(os.environ["JOSHGONE_DB"])
+
     # Get list of extensions to load
     extensions = list(LOAD_ON_STARTUP)
     if int(os.environ.get("JOSHGONE_REPL", "0")):
         extensions.append("repl")
+    if "JOSHGONE_WORKER" in os.environ:
+        extensions.append("cluster")
 
-    # Load extensions
-    for module in extensions:
-        await bot.load_extension(f"jgm.extensions.{module}")
-        print(f"Loaded {module}")
-    print(f"All extensions loaded: [{', '.join(extensions)}]")
+    # Load extensions. They don't depend on each other being loaded (only
+    # imported), so their async setup can overlap.
+    print(f"Imported in {(_imported - _started) * 1000:.1f}ms")
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(_load(bot, module) for module in extensions),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    print(f"All extensions loaded in {(time.perf_counter() - start) * 1000:.1f}ms: [{', '.join(extensions)}]")
+
+    # Report how long startup took, then import the heavy modules that were
+    # put off (yt-dlp, ...) while nothing is playing yet
+    login = time.perf_counter()
+    async def on_ready():
+        bot.remove_listener(on_ready)
+        now = time.perf_counter()
+        print(f"Ready {(now - _started):.2f}s after starting ({(now - login):.2f}s logging in).")
+        print(f"Warmed lazy imports in {await warm() * 1000:.1f}ms.")
+    bot.add_listener(on_ready)
 
     try:
         await bot.start(token)
     finally:
+        await bot.db.close()
         # Force the GC to run before closing the loop so objects that use
         # loop.call_soon in their .__del__ methods can be garbage collected
         # without giving an annoying `Exception ignored in <something>
@@ -67,17 +154,30 @@ async def _run(token, **bot_kwargs):
 
 def run(token, **bot_kwargs):
     """Runs JoshGone with the provided token and bot options"""
+    # yt-dlp's and FFmpeg's output goes here instead of the terminal
+    logs.start(
+        logs.worker_path(os.environ.get("JOSHGONE_LOG", "jgm.log")),
+        level=os.environ.get("JOSHGONE_LOG_LEVEL", "INFO").upper(),
+    )
     # The actual bot is run and deleted inside the _run function.
     try:
         asyncio.run(_run(token, **bot_kwargs))
     except KeyboardInterrupt:
         pass
+    finally:
+        logs.stop()
 
 def main():
     """Entry point to run JoshGone"""
+    bot_kwargs = cache_profile(os.environ.get("JOSHGONE_CACHE", "full"))
+    # Set by the cluster supervisor (`python -m jgm cluster`)
+    if "JOSHGONE_SHARD_IDS" in os.environ:
+        bot_kwargs["bot_class"] = AutoShardedBot
+        bot_kwargs["shard_ids"] = [int(shard_id) for shard_id in os.environ["JOSHGONE_SHARD_IDS"].split(",")]
+        bot_kwargs["shard_count"] = int(os.environ["JOSHGONE_SHARD_COUNT"])
     run(
         os.environ["JOSHGONE_TOKEN"],
         command_prefix=command_prefix,
-        intents=intents,
-        help_command=help_command
+        help_command=help_command,
+        **bot_kwargs,
     )
@@ -0,0 +1,61 @@
+"""Modules that are only imported once they're used
+
+yt-dlp alone takes a few hundred milliseconds to import, and nothing needs it
+until the first song is queued. A `LazyModule` stands in for a module until an
+attribute is looked up on it, so extensions can keep using `module.attr` like
+usual without paying for the import at startup. `warm()` imports them on
+purpose, from a thread, once the bot is up.
+
+"""
+import asyncio
+import importlib
+import threading
+import time
+import weakref
+
+__all__ = ("LazyModule", "warm")
+
+# Every LazyModule, so warm() can find them
+_modules = weakref.WeakSet()
+
+class LazyModule:
+    def __init__(self, name, *, on_load=None):
+        self._name = name
+        # Called with the module right after it's imported
+        self._on_load = on_load
+        self._module = None
+        self._lock = threading.Lock()
+        _modules.add(self)
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load is not None:
+                        self._on_load(module)
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._name!r} ({state})>"
+
+async def warm():
+    """Imports every lazy module that isn't loaded yet, off the event loop
+
+    Returns how long it took in seconds.
+
+    """
+    start = time.perf_counter()
+    for module in list(_modules):
+        if not module.loaded:
+            await asyncio.to_thread(module.load)
+    return time.perf_counter() - start
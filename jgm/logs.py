@@ -0,0 +1,145 @@
+"""Log files, written by a thread of their own
+
+Records logged under `jgm` (yt-dlp's output goes to `jgm.ytdlp`, FFmpeg's to
+`jgm.ffmpeg`) are only put on a queue, which never blocks, so the audio
+threads and the event loop never wait on the disk or the terminal. A single
+writer thread takes them off the queue and writes them to rotating files.
+
+Records can be tagged with a server using `extra={"guild": guild_id}`, or by
+logging through `guild_logger`. When the same line keeps getting logged for a
+server, it's only written once every `REPEAT_WINDOW` seconds, followed by how
+many times it repeated.
+
+"""
+import os
+import queue
+import logging
+import logging.handlers
+
+__all__ = ("start", "stop", "route", "unroute", "guild_logger", "worker_path")
+
+FORMAT = "%(asctime)s %(levelname)s %(name)s [%(guild)s] %(message)s"
+REPEAT_WINDOW = 10
+
+_logger = logging.getLogger("jgm")
+
+def _tag(record):
+    if not hasattr(record, "guild"):
+        record.guild = "-"
+    return True
+
+def _file(path, format, max_bytes, backups):
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8", delay=True)
+    handler.setFormatter(logging.Formatter(format))
+    return handler
+
+class _Writer(logging.Handler):
+    """Sends each record to its logger's file, only runs on the writer thread"""
+
+    def __init__(self, window=REPEAT_WINDOW):
+        super().__init__()
+        self.window = window
+        # Logger name -> handler, records go to their closest ancestor's
+        self.routes = {}
+        # (logger name, guild) -> [message, first logged at, times repeated,
+        # last repeated at]
+        self.last = {}
+
+    def route(self, name):
+        while True:
+            handler = self.routes.get(name)
+            if handler is not None or not name:
+                return handler
+            name = name.rpartition(".")[0]
+
+    def emit(self, record):
+        handler = self.route(record.name)
+        if handler is None:
+            return
+        key = (record.name, record.guild)
+        message = record.getMessage()
+        last = self.last.get(key)
+        if last is not None and last[0] == message and record.created - last[1] < self.window:
+            last[2] += 1
+            last[3] = record.created
+            return
+        if last is not None and last[2]:
+            self.repeated(key, last, handler)
+        self.last[key] = [message, record.created, 0, record.created]
+        handler.handle(record)
+
+    def repeated(self, key, last, handler):
+        name, guild = key
+        handler.handle(logging.makeLogRecord({
+            "name": name, "guild": guild, "levelno": logging.INFO, "levelname": "INFO",
+            "msg": f"Last message repeated {last[2]} more times",
+            "created": last[3], "msecs": last[3] % 1 * 1000,
+        }))
+
+    def flush_repeats(self):
+        for key, last in self.last.items():
+            handler = self.route(key[0])
+            if last[2] and handler is not None:
+                self.repeated(key, last, handler)
+        self.last.clear()
+
+_queue = queue.SimpleQueue()
+_writer = _Writer()
+_listener = None
+_handler = None
+
+def start(path, *, level=logging.INFO, max_bytes=10 * 1024 * 1024, backups=3):
+    """Start writing the `jgm` loggers' records to a rotating file"""
+    global _listener, _handler
+    if _listener is not None:
+        return
+    _writer.routes["jgm"] = _file(path, FORMAT, max_bytes, backups)
+    _handler = logging.handlers.QueueHandler(_queue)
+    _handler.addFilter(_tag)
+    _logger.addHandler(_handler)
+    _logger.setLevel(level)
+    _logger.propagate = False
+    _listener = logging.handlers.QueueListener(_queue, _writer)
+    _listener.start()
+
+def stop():
+    """Write out what's left on the queue and close the files"""
+    global _listener, _handler
+    if _listener is None:
+        return
+    _logger.removeHandler(_handler)
+    _logger.propagate = True
+    # Waits for the writer thread to empty the queue
+    _listener.stop()
+    _writer.flush_repeats()
+    for handler in _writer.routes.values():
+        handler.close()
+    _writer.routes.clear()
+    _listener = _handler = None
+
+def route(name, path, *, format="%(message)s", max_bytes=10 * 1024 * 1024, backups=3):
+    """Write a logger's records to a file of their own"""
+    unroute(name)
+    _writer.routes[name] = _file(path, format, max_bytes, backups)
+
+def unroute(name):
+    handler = _writer.routes.pop(name, None)
+    if handler is not None:
+        handler.close()
+
+def worker_path(path):
+    """Return the path with the cluster worker's number added, if in a cluster
+
+    Processes can't share a rotating file, one of them would rotate it out from
+    under the others.
+
+    """
+    worker = os.environ.get("JOSHGONE_WORKER")
+    if worker is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{worker}{ext}"
+
+def guild_logger(name, guild_id):
+    """Return a logger whose records are tagged with the server"""
+    return logging.LoggerAdapter(logging.getLogger(name), {"guild": guild_id})
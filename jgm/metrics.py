@@ -0,0 +1,194 @@
+"""Counters, gauges and histograms in Prometheus' text format
+
+The metrics live here at module level so any part of the bot can record to
+them, and they survive extension reloads. The `metrics` extension serves them
+over HTTP.
+
+Counters and histograms are recorded from all sorts of places, including the
+threads that read from FFmpeg, so recording only appends to a deque (which is
+atomic) and never takes a lock. The appended values are added up when the
+metrics are collected, or every few seconds by the `metrics` extension.
+
+Server IDs make for a lot of label values, so only the first `MAX_GUILDS`
+servers seen get their own; the rest are all labelled "other".
+
+"""
+import bisect
+import contextlib
+import time
+from collections import deque
+
+__all__ = (
+    "Counter", "Gauge", "Histogram", "Registry", "REGISTRY", "guild_label",
+    "COMMANDS", "RESOLVE_SECONDS", "FFMPEG_SPAWN_SECONDS", "ADVANCE_SECONDS",
+    "DB_BORROW_SECONDS", "VOICE_CLIENTS", "QUEUE_LENGTH", "LOOP_LAG_SECONDS",
+)
+
+MAX_GUILDS = 100
+
+# Seconds, good for anything from a cached query to a slow yt-dlp lookup
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_guilds = set()
+
+def guild_label(guild_id):
+    """Return the label value for a server"""
+    if guild_id in _guilds:
+        return str(guild_id)
+    if len(_guilds) < MAX_GUILDS:
+        _guilds.add(guild_id)
+        return str(guild_id)
+    return "other"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=(), *, registry=None):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        # Label values -> aggregated value
+        self.values = {}
+        # (label values, value) recorded but not yet aggregated
+        self.pending = deque()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _check(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {labels}")
+
+    def drain(self):
+        """Aggregates the pending values, only call this from one thread"""
+        pending = self.pending
+        while pending:
+            labels, value = pending.popleft()
+            self._add(labels, value)
+
+    def _add(self, labels, value):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for name, labels, value in self.samples():
+            yield f"{name}{labels} {_format_value(value)}"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._check(labels)
+        self.pending.append((labels, amount))
+
+    def _add(self, labels, value):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._check(labels)
+        # A single assignment, so it's atomic too
+        self.values[labels] = value
+
+    def clear(self):
+        self.values = {}
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _format_labels(self.labels, labels), value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), *, buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, description, labels, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        self._check(labels)
+        self.pending.append((labels, value))
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        """Observes how long the block took, also works around awaits"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _add(self, labels, value):
+        data = self.values.get(labels)
+        if data is None:
+            # Per bucket counts (not cumulative), the +Inf count, then the sum
+            data = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def samples(self):
+        for labels, data in self.values.items():
+            total = 0
+            for bound, count in zip((*self.buckets, float("inf")), data):
+                total += count
+                yield f"{self.name}_bucket", _format_labels(self.labels, labels, [("le", _format_value(bound))]), total
+            yield f"{self.name}_sum", _format_labels(self.labels, labels), data[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, labels), total
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        # Called before rendering, to set gauges that are read on demand
+        self.collectors = []
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+
+    def drain(self):
+        for metric in self.metrics.values():
+            metric.drain()
+
+    def render(self):
+        """Return every metric in Prometheus' text format"""
+        for collector in self.collectors:
+            collector()
+        self.drain()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+REGISTRY = Registry()
+
+COMMANDS = Counter("jgm_commands_total", "Commands run, by how they ended", ("command", "outcome"))
+RESOLVE_SECONDS = Histogram("jgm_resolve_seconds", "Time taken to look a song up with yt-dlp")
+FFMPEG_SPAWN_SECONDS = Histogram("jgm_ffmpeg_spawn_seconds", "Time taken to start an FFmpeg process")
+ADVANCE_SECONDS = Histogram("jgm_advance_seconds", "Time taken to start the next song in the queue", ("guild",))
+DB_BORROW_SECONDS = Histogram("jgm_db_borrow_seconds", "Time a database connection was borrowed for, including whatever else the borrower awaited", ("mode",))
+VOICE_CLIENTS = Gauge("jgm_voice_clients", "Connected voice clients")
+QUEUE_LENGTH = Gauge("jgm_queue_length", "Songs waiting in the queue", ("guild",))
+LOOP_LAG_SECONDS = Histogram("jgm_loop_lag_seconds", "How late the event loop ran a callback scheduled from another thread")
@@ -0,0 +1,152 @@
+"""Schedules outgoing messages per channel
+
+Discord only lets a bot send about 5 messages every 5 seconds in a channel, and
+anything over that gets queued up behind a rate limit. Bulk commands used to
+send one message per item, which used up the budget and made replies to other
+commands wait behind them.
+
+There are two kinds of messages:
+
+- Replies (`send`, `send_pages`) are sent as soon as the channel has budget,
+  ahead of any pending notices.
+- Notices (`notice`) are status lines like "Appended to queue: ...". They are
+  merged into as few messages as possible (up to the 2000 character limit) and
+  only sent when no replies are waiting. If the channel is out of budget when
+  they are due, they are summarized into a single message instead.
+
+"""
+import asyncio
+import time
+import traceback
+from collections import deque
+
+__all__ = ("Outbound", "pack_lines")
+
+def pack_lines(lines, *, maxlen=2000):
+    """Joins lines with newlines into as few messages of at most maxlen as possible"""
+    current = []
+    length = 0
+    for line in lines:
+        line = line[:maxlen]
+        # +1 for the newline joining it to the previous line
+        if current and length + 1 + len(line) > maxlen:
+            yield "\n".join(current)
+            current = []
+            length = 0
+        length += len(line) + (1 if current else 0)
+        current.append(line)
+    if current:
+        yield "\n".join(current)
+
+class ChannelOutbox:
+    def __init__(self, channel, outbound):
+        self.channel = channel
+        self.outbound = outbound
+        # Times of the sends within the last `outbound.per` seconds
+        self.sent = deque()
+        # Notice lines waiting to be sent
+        self.notices = []
+        self.flush_task = None
+        # Number of replies waiting for budget, notices go after them
+        self.replies = 0
+        self.no_replies = asyncio.Event()
+        self.no_replies.set()
+
+    def budget(self):
+        now = time.monotonic()
+        while self.sent and now - self.sent[0] >= self.outbound.per:
+            self.sent.popleft()
+        return self.outbound.rate - len(self.sent)
+
+    def is_idle(self):
+        return not self.notices and self.replies == 0 and self.budget() == self.outbound.rate
+
+    async def acquire(self):
+        while self.budget() <= 0:
+            await asyncio.sleep(self.outbound.per - (time.monotonic() - self.sent[0]))
+        self.sent.append(time.monotonic())
+
+    async def send(self, content, **kwargs):
+        self.replies += 1
+        self.no_replies.clear()
+        try:
+            await self.acquire()
+        finally:
+            self.replies -= 1
+            if self.replies == 0:
+                self.no_replies.set()
+        return await self.channel.send(content, **kwargs)
+
+    def notice(self, line):
+        self.notices.append(line)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self.flush_notices())
+
+    async def flush_notices(self):
+        # Give the rest of a batch a chance to arrive so it can be merged
+        await asyncio.sleep(self.outbound.delay)
+        try:
+            while self.notices:
+                await self.no_replies.wait()
+                lines, self.notices = self.notices, []
+                messages = list(pack_lines(lines))
+                # Under pressure, don't spend the budget on a backlog of notices
+                if len(messages) > max(self.budget(), 1):
+                    messages = [summarize(lines)]
+                for message in messages:
+                    await self.no_replies.wait()
+                    await self.acquire()
+                    await self.channel.send(message)
+        except Exception as exc:
+            print(f"Exception occured while sending notices to channel {self.channel.id}:")
+            traceback.print_exception(None, exc, exc.__traceback__)
+            self.notices.clear()
+
+def summarize(lines, *, maxlen=2000):
+    """Returns a single message with as many lines as fit and a count of the rest"""
+    kept = []
+    length = 0
+    for i, line in enumerate(lines):
+        footer = f"... and {len(lines) - i} more"
+        if length + len(line) + 1 + len(footer) > maxlen:
+            kept.append(footer)
+            break
+        kept.append(line)
+        length += len(line) + 1
+    return "\n".join(kept)
+
+class Outbound:
+    """Bot-wide outgoing message scheduler, stored as `bot.outbound`"""
+
+    def __init__(self, *, rate=5, per=5, delay=0.5):
+        # Discord's per-channel limit is around `rate` messages every `per` seconds
+        self.rate = rate
+        self.per = per
+        # How long notices wait to be merged with ones sent right after them
+        self.delay = delay
+        self.outboxes = {}
+
+    def outbox(self, channel):
+        outbox = self.outboxes.get(channel.id)
+        if outbox is None:
+            # Don't keep state around for every channel ever sent to
+            if len(self.outboxes) >= 1000:
+                for channel_id, old in list(self.outboxes.items()):
+                    if old.is_idle():
+                        del self.outboxes[channel_id]
+            outbox = self.outboxes[channel.id] = ChannelOutbox(channel, self)
+        return outbox
+
+    async def send(self, channel, content, **kwargs):
+        """Sends a reply, ahead of any pending notices"""
+        return await self.outbox(channel).send(content, **kwargs)
+
+    async def send_pages(self, channel, pages, **kwargs):
+        """Sends multiple replies in order"""
+        outbox = self.outbox(channel)
+        for page in pages:
+            await outbox.send(page, **kwargs)
+
+    def notice(self, channel, line):
+        """Queues a status line to be merged with other notices and sent later"""
+        self.outbox(channel).notice(line)
@@ -9,27 +9,48 @@ If, for some reason, each FFmpeg subprocess is actually making a window, you
 can pass creationflags=subprocess.CREATE_NO_WINDOW to the constructor to set it
 again.
 
+FFmpeg's stderr is read by a thread of its own and logged to `jgm.ffmpeg`
+(tagged with guild_id if given) instead of going to the terminal.
+
 Source code is adapted from discord/player.py.
 
 """
 import sys
+import time
+import logging
+import threading
 import subprocess
 from collections import deque
 
 import discord
 from discord.opus import Encoder as OpusEncoder
 
+import jgm.tracing as tracing
+from jgm.metrics import FFMPEG_SPAWN_SECONDS
+
 __all__ = ("FFmpegPCMAudio",)
 
+_logger = logging.getLogger("jgm.ffmpeg")
+
+# Runs until FFmpeg exits and closes its end of the pipe
+def _log_stderr(stderr, guild_id):
+    extra = {"guild": "-" if guild_id is None else guild_id}
+    with stderr:
+        for line in stderr:
+            line = line.decode(errors="replace").rstrip()
+            if line:
+                _logger.warning(line, extra=extra)
+
 class FFmpegPCMAudio(discord.FFmpegPCMAudio):
     # Default is 0 for no flags (used to be subprocess.CREATE_NO_WINDOW). See
     # the documentation for discord.FFmpegPCMAudio for more info on kwargs.
     # TODO passing in source and current_ref redundant, maybe onl
-    def __init__(self, current_ref, *, creationflags=0, **kwargs):
+    def __init__(self, current_ref, *, creationflags=0, guild_id=None, **kwargs):
         # The superclass's __init__ calls self._spawn_process, so we need to
         # set creation flags before then, meaning this line can't be after the
         # super().__init__ call.
         self.creationflags = creationflags
+        self.guild_id = guild_id
 
         # MAX_BUF_SZ is the number of frames, frames can range from 10ms to 40ms
         # Assume 20ms (normal frame size) upper bound of 2**12 = 4096 bytes (actually closer to 3840)
@@ -49,8 +70,25 @@ class FFmpegPCMAudio(discord.FFmpegPCMAudio):
         # Creation flags only work in Windows
         if sys.platform == "win32":
             subprocess_kwargs["creationflags"] = self.creationflags
+        log_stderr = subprocess_kwargs.get("stderr") is None
+        if log_stderr:
+            subprocess_kwargs["stderr"] = subprocess.PIPE
         try:
-            return subprocess.Popen(args, **subprocess_kwargs)
+            start = time.perf_counter()
+            with tracing.span("ffmpeg_spawn"):
+                process = subprocess.Popen(args, **subprocess_kwargs)
+            FFMPEG_SPAWN_SECONDS.observe(time.perf_counter() - start)
+            if log_stderr:
+                # Taken off the process so Popen.communicate (used when
+                # killing it) doesn't read the pipe too
+                stderr, process.stderr = process.stderr, None
+                threading.Thread(
+                    target=_log_stderr,
+                    args=(stderr, self.guild_id),
+                    name=f"ffmpeg-stderr:{process.pid}",
+                    daemon=True,
+                ).start()
+            return process
         except FileNotFoundError:
             if isinstance(args, str):
                 executable = args.partition(" ")[0]
@@ -0,0 +1,92 @@
+"""Looking inside the running bot, for the profiling commands in `admin`
+
+`sample` is a sampling profiler: it looks at what every thread is running a
+couple hundred times a second, which covers the audio threads reading from
+FFmpeg as well as the event loop (cProfile only sees the thread it was started
+in). Nothing is hooked into the interpreter, so it costs nothing when it
+isn't running.
+
+"""
+import io
+import sys
+import time
+import asyncio
+import threading
+import traceback
+from collections import Counter
+
+__all__ = ("sample", "format_samples", "dump_stacks")
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", code.co_filename)
+    return f"{module}:{code.co_name}"
+
+def sample(seconds, interval=0.005):
+    """Sample every thread's stack for some seconds, blocking
+
+    Returns a Counter of stacks, each a tuple of the thread's name and then
+    the frames from outermost to innermost.
+
+    """
+    me = threading.get_ident()
+    end = time.monotonic() + seconds
+    stacks = Counter()
+    while time.monotonic() < end:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+def format_samples(stacks, seconds, *, top=40):
+    """Return a report of the hottest functions, then every stack
+
+    The stacks at the end are in the collapsed format that flame graph tools
+    (like flamegraph.pl or speedscope) read.
+
+    """
+    total = sum(stacks.values())
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        # Recursive functions only count once per sample
+        for name in set(stack[1:]):
+            inclusive[name] += count
+    out = io.StringIO()
+    print(f"{total} samples over {seconds}s", file=out)
+    for title, counter in (("Self", own), ("Total", inclusive)):
+        print(f"\n{title} samples:", file=out)
+        for name, count in counter.most_common(top):
+            print(f"{count:>8} {count / total:>7.1%}  {name}", file=out)
+    print("\nCollapsed stacks:", file=out)
+    for stack, count in stacks.most_common():
+        print(f"{';'.join(stack)} {count}", file=out)
+    return out.getvalue()
+
+def dump_stacks():
+    """Return the stack of every asyncio task and every thread"""
+    out = io.StringIO()
+    tasks = asyncio.all_tasks()
+    print(f"{len(tasks)} asyncio tasks:", file=out)
+    for task in sorted(tasks, key=lambda task: task.get_name()):
+        print(f"\n{task!r}", file=out)
+        task.print_stack(file=out)
+    names = {thread.ident: thread for thread in threading.enumerate()}
+    frames = sys._current_frames()
+    print(f"\n{len(frames)} threads:", file=out)
+    for ident, frame in frames.items():
+        thread = names.get(ident)
+        name = thread.name if thread is not None else str(ident)
+        daemon = " (daemon)" if thread is not None and thread.daemon else ""
+        print(f"\nThread {name}{daemon}:", file=out)
+        out.writelines(traceback.format_stack(frame))
+    return out.getvalue()
@@ -0,0 +1,145 @@
+"""Regexes from user input, for use inside SQLite
+
+`regexp` is registered on every database connection, so `X REGEXP Y` works in
+SQL and rows are filtered inside SQLite's row loop instead of being fetched
+first. Compiled patterns are cached since the same pattern is used for every
+row.
+
+Python's regex engine backtracks, so some patterns take exponential (or high
+polynomial) time on the wrong input (see ReDoS) and can't be interrupted once
+they start. `check_regex` rejects anything that could backtrack much before it
+gets anywhere near a query, and `regexp` only looks at the first `MAX_SUBJECT`
+characters of each value, so one row can't take long. `deadline` can then stop
+a query between rows.
+
+"""
+import functools
+import math
+import re
+
+from _sre import MAXREPEAT
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+__all__ = ("compile_regex", "check_regex", "regexp", "MAX_SUBJECT")
+
+# Characters of each value that REGEXP looks at
+MAX_SUBJECT = 4000
+# Rough number of steps a search of one value may take, allows a single
+# unbounded repeat like `.*` plus a few small ones
+MAX_STEPS = 16 * MAX_SUBJECT ** 2
+_TOO_MUCH = MAX_STEPS + 1
+
+@functools.lru_cache(256)
+def compile_regex(pattern):
+    return re.compile(pattern)
+
+def regexp(pattern, string):
+    """SQLite's REGEXP function: `string REGEXP pattern`"""
+    if pattern is None or string is None:
+        return None
+    return compile_regex(pattern).search(string, 0, MAX_SUBJECT) is not None
+
+_REPEATS = ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT")
+
+def _first(items):
+    """Return the characters items can start with, or None if unknown
+
+    Also returns None if items can match the empty string, since then it can
+    start with whatever comes after it.
+
+    """
+    if not items:
+        return None
+    op, av = items[0]
+    op = str(op)
+    if op == "LITERAL":
+        return {av}
+    if op == "IN":
+        chars = set()
+        for in_op, in_av in av:
+            in_op = str(in_op)
+            if in_op == "LITERAL":
+                chars.add(in_av)
+            elif in_op == "RANGE" and in_av[1] - in_av[0] < 256:
+                chars.update(range(in_av[0], in_av[1] + 1))
+            else:
+                return None
+        return chars
+    if op == "SUBPATTERN":
+        return _first(av[-1])
+    if op in _REPEATS and av[0] > 0:
+        return _first(av[2])
+    return None
+
+def _cost(items):
+    """Return a rough upper bound on the ways items can match at one position
+
+    An unbounded repeat counts as `MAX_SUBJECT` ways (one per length it could
+    stop at), and repeats or alternatives in a row multiply. Alternatives that
+    can't start with the same character only count as the costliest of them,
+    since at most one of them gets past its first character.
+
+    """
+    cost = 1
+    for op, av in items:
+        op = str(op)
+        if op in _REPEATS:
+            low, high, body = av
+            inner = _cost(body)
+            if op == "POSSESSIVE_REPEAT":
+                # Never backtracks into earlier iterations
+                cost *= inner
+            elif high == MAXREPEAT:
+                if inner > 1:
+                    return _TOO_MUCH
+                cost *= MAX_SUBJECT
+            elif inner > 1 and high * math.log2(inner) > 64:
+                return _TOO_MUCH
+            else:
+                cost *= inner ** high * (high - low + 1)
+        elif op == "BRANCH":
+            alternatives = av[1]
+            costs = [_cost(alternative) for alternative in alternatives]
+            seen = set()
+            for alternative in alternatives:
+                first = _first(alternative)
+                if first is None or first & seen:
+                    cost *= sum(costs)
+                    break
+                seen |= first
+            else:
+                cost *= max(costs)
+        elif op == "SUBPATTERN":
+            cost *= _cost(av[-1])
+        elif op in ("ASSERT", "ASSERT_NOT"):
+            cost *= _cost(av[1])
+        elif op == "ATOMIC_GROUP":
+            cost *= _cost(av)
+        elif op == "GROUPREF_EXISTS":
+            cost *= _cost(av[1]) + (1 if av[2] is None else _cost(av[2]))
+        if cost >= _TOO_MUCH:
+            return _TOO_MUCH
+    return cost
+
+def check_regex(pattern):
+    """Raise ValueError if pattern is invalid or could backtrack too much
+
+    This is deliberately conservative. Searching a subject of `MAX_SUBJECT`
+    characters may only take about `MAX_STEPS` steps, so it rejects repeats
+    nested inside repeats like `(a+)+` or `(.*a){12}`, unbounded repeats in a
+    row like `.*.*`, and alternatives inside unbounded repeats that can start
+    with the same character like `(a|a)+` or `(a|)+`.
+
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error as exc:
+        raise ValueError(f"invalid regex: {exc}") from None
+    if MAX_SUBJECT * _cost(parsed.data) > MAX_STEPS:
+        raise ValueError("regex can backtrack too much (repeats inside repeats, or more than one unbounded repeat in a row)")
+    # Cache it now that we know it's fine
+    compile_regex(pattern)
@@ -0,0 +1,192 @@
+"""Timing the steps of a command, for the `tracing` extension
+
+A trace follows one command from when it's invoked until everything it set
+off is done, including the advancer playing the song it queued. Code marks
+its steps with `span`, which does nothing outside a trace:
+
+    with span("resolve"):
+        data = await run_in_executor(loop, lambda: ytdl.extract_info(url))
+
+The current trace lives in a context variable, so it follows awaits and the
+tasks started from the command by itself. To carry it somewhere it doesn't
+follow on its own, hold the trace, then `resume` it there and release it once
+done (see `Music.schedule`). The executor doesn't copy the context either,
+which `run_in_executor` does.
+
+Finished traces are written as JSON Lines to a rotating file (by the
+`jgm.logs` writer thread) if they are sampled (a `rate` of them are) or slower
+than `slow` seconds. Slow ones are also logged to the main log file (as
+`jgm.slow`) along with the step that took the longest.
+
+"""
+import os
+import json
+import time
+import random
+import logging
+import itertools
+import contextlib
+import contextvars
+import functools
+
+from jgm import logs
+
+__all__ = (
+    "Trace", "configure", "start", "current", "resume", "span",
+    "run_in_executor",
+)
+
+# (trace, id of the innermost span)
+_current = contextvars.ContextVar("jgm_trace", default=None)
+
+# Routed to a file of its own by `configure`
+_logger = logging.getLogger("jgm.tracing")
+_logger.setLevel(logging.INFO)
+# Not under jgm.tracing, which would put the lines in the JSON Lines file
+_slow_logger = logging.getLogger("jgm.slow")
+
+_rate = 0.0
+_slow = 2.0
+
+def configure(rate, path, *, slow=2.0, max_bytes=10 * 1024 * 1024, backups=3):
+    """Set how many traces are sampled and where they get written"""
+    global _rate, _slow
+    _rate = rate
+    _slow = slow
+    if path is None:
+        logs.unroute(_logger.name)
+    else:
+        logs.route(_logger.name, path, max_bytes=max_bytes, backups=backups)
+
+class Trace:
+    def __init__(self, name, guild_id=None):
+        self.id = os.urandom(8).hex()
+        self.name = name
+        self.guild_id = guild_id
+        self.sampled = random.random() < _rate
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+        # (id, parent id, name, start, end), appended from any thread
+        self.spans = []
+        self._ids = itertools.count(1)
+        # Things still to happen before the trace is done, starting with the
+        # command itself. Only changed on the event loop.
+        self.holds = 1
+
+    def next_id(self):
+        return next(self._ids)
+
+    def add(self, name, start, end, parent=0):
+        """Record a span that wasn't timed with `span`"""
+        self.spans.append((self.next_id(), parent, name, start, end))
+
+    def hold(self):
+        self.holds += 1
+
+    def release(self, error=None):
+        if error is not None and self.error is None:
+            self.error = error
+        self.holds -= 1
+        if self.holds == 0:
+            self.finish()
+
+    @property
+    def duration(self):
+        end = time.perf_counter() if self.end is None else self.end
+        return end - self.start
+
+    def self_times(self):
+        """Return each span's name and time not spent in its child spans
+
+        The command itself is span 0, and whatever isn't covered by any span
+        counts towards it.
+
+        """
+        spans = [(0, None, self.name, self.start, self.end), *self.spans]
+        children = {}
+        for span_id, parent, name, start, end in spans[1:]:
+            children[parent] = children.get(parent, 0) + (end - start)
+        # Children running in parallel can add up to more than their parent
+        return [
+            (name, max(0.0, end - start - children.get(span_id, 0)))
+            for span_id, parent, name, start, end in spans
+        ]
+
+    def dominant(self):
+        """Return the name and self time of the span that took the longest"""
+        return max(self.self_times(), key=lambda pair: pair[1])
+
+    def to_record(self):
+        return {
+            "trace": self.id,
+            "command": self.name,
+            "guild": self.guild_id,
+            "time": self.started_at,
+            "seconds": round(self.duration, 6),
+            "error": None if self.error is None else repr(self.error),
+            "spans": [
+                {"id": span_id, "parent": parent, "name": name, "offset": round(start - self.start, 6), "seconds": round(end - start, 6)}
+                for span_id, parent, name, start, end in sorted(self.spans, key=lambda span: span[3])
+            ],
+        }
+
+    def finish(self):
+        self.end = time.perf_counter()
+        slow = self.duration >= _slow
+        if slow:
+            name, seconds = self.dominant()
+            _slow_logger.warning(
+                "Slow command: %s took %.3fs, mostly in %s (%.3fs), trace %s",
+                self.name, self.duration, name, seconds, self.id,
+                extra={"guild": "-" if self.guild_id is None else self.guild_id},
+            )
+        if slow or self.sampled:
+            _logger.info(json.dumps(self.to_record()))
+
+def start(name, guild_id=None):
+    """Start a trace and make it current"""
+    trace = Trace(name, guild_id)
+    _current.set((trace, 0))
+    return trace
+
+def current():
+    """Return the current trace, or None"""
+    current = _current.get()
+    return None if current is None else current[0]
+
+@contextlib.contextmanager
+def resume(trace, name):
+    """Make a held trace current for the block, timed as a span"""
+    if trace is None:
+        yield
+        return
+    token = _current.set((trace, 0))
+    try:
+        with span(name):
+            yield
+    finally:
+        _current.reset(token)
+
+@contextlib.contextmanager
+def span(name):
+    """Time the block as a step of the current trace, if there is one"""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    trace, parent = current
+    span_id = trace.next_id()
+    token = _current.set((trace, span_id))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.spans.append((span_id, parent, name, start, time.perf_counter()))
+        _current.reset(token)
+
+def run_in_executor(loop, func, executor=None):
+    """loop.run_in_executor, but func sees the current trace"""
+    context = contextvars.copy_context()
+    return loop.run_in_executor(executor, functools.partial(context.run, func))
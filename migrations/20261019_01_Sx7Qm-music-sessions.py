@@ -0,0 +1,28 @@
+"""
+Music-sessions
+"""
+
+from yoyo import step
+
+__depends__ = {"20230723_01_3Eccc-initial-tables"}
+
+steps = [
+    step(
+        '''CREATE TABLE music_sessions (
+            server_id INTEGER PRIMARY KEY,
+            state TEXT NOT NULL,
+            queue TEXT NOT NULL,
+            FOREIGN KEY (server_id) REFERENCES server (server_id)
+        );''',
+        "DROP TABLE music_sessions;",
+    ),
+    step(
+        '''CREATE TABLE music_journal (
+            server_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            PRIMARY KEY (server_id, seq)
+        ) WITHOUT ROWID;''',
+        "DROP TABLE music_journal;",
+    ),
+]
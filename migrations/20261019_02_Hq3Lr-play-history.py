@@ -0,0 +1,77 @@
+"""
+Play-history
+"""
+
+from yoyo import step
+
+__depends__ = {"20261019_01_Sx7Qm-music-sessions"}
+
+steps = [
+    step(
+        '''CREATE TABLE play_history (
+            play_id INTEGER PRIMARY KEY,
+            server_id INTEGER NOT NULL,
+            played_at INTEGER NOT NULL,
+            ty TEXT NOT NULL,
+            query TEXT NOT NULL,
+            user_id INTEGER,
+            seconds_played REAL NOT NULL,
+            filter_name TEXT NOT NULL,
+            tempo REAL NOT NULL,
+            pitch REAL NOT NULL,
+            FOREIGN KEY (server_id) REFERENCES server (server_id)
+        );''',
+        "DROP TABLE play_history;",
+    ),
+    # Paging through a server's (or a user's) history newest first
+    step(
+        "CREATE INDEX play_history_server ON play_history (server_id, play_id);",
+        "DROP INDEX play_history_server;",
+    ),
+    step(
+        "CREATE INDEX play_history_user ON play_history (server_id, user_id, play_id);",
+        "DROP INDEX play_history_user;",
+    ),
+    # Rolled-up aggregates, kept up to date by the triggers below
+    step(
+        '''CREATE TABLE play_counts (
+            server_id INTEGER NOT NULL,
+            ty TEXT NOT NULL,
+            query TEXT NOT NULL,
+            plays INTEGER NOT NULL,
+            seconds_played REAL NOT NULL,
+            last_played INTEGER NOT NULL,
+            PRIMARY KEY (server_id, ty, query)
+        ) WITHOUT ROWID;''',
+        "DROP TABLE play_counts;",
+    ),
+    step(
+        "CREATE INDEX play_counts_top ON play_counts (server_id, plays);",
+        "DROP INDEX play_counts_top;",
+    ),
+    step(
+        '''CREATE TABLE user_play_counts (
+            server_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            plays INTEGER NOT NULL,
+            seconds_played REAL NOT NULL,
+            PRIMARY KEY (server_id, user_id)
+        ) WITHOUT ROWID;''',
+        "DROP TABLE user_play_counts;",
+    ),
+    step(
+        '''CREATE TRIGGER play_history_rollup AFTER INSERT ON play_history
+        BEGIN
+            INSERT INTO play_counts VALUES (new.server_id, new.ty, new.query, 1, new.seconds_played, new.played_at)
+                ON CONFLICT (server_id, ty, query) DO UPDATE SET
+                    plays = plays + 1,
+                    seconds_played = seconds_played + excluded.seconds_played,
+                    last_played = excluded.last_played;
+            INSERT INTO user_play_counts SELECT new.server_id, new.user_id, 1, new.seconds_played WHERE new.user_id IS NOT NULL
+                ON CONFLICT (server_id, user_id) DO UPDATE SET
+                    plays = plays + 1,
+                    seconds_played = seconds_played + excluded.seconds_played;
+        END;''',
+        "DROP TRIGGER play_history_rollup;",
+    ),
+]
@@ -0,0 +1,79 @@
+"""
+Playlist-search
+"""
+
+from yoyo import step
+
+__depends__ = {"20261019_02_Hq3Lr-play-history"}
+
+steps = [
+    # The full-text index refers to playlists by rowid, so give them a stable
+    # one (an implicit rowid can change on VACUUM)
+    step(
+        '''CREATE TABLE playlists_new (
+            playlist_id INTEGER PRIMARY KEY,
+            server_id INTEGER,
+            playlist_name TEXT,
+            playlist_text TEXT,
+            owner_id INTEGER,
+            UNIQUE (server_id, playlist_name),
+            FOREIGN KEY (server_id) REFERENCES server (server_id)
+        );''',
+        "DROP TABLE playlists_new;",
+    ),
+    step(
+        '''INSERT INTO playlists_new (server_id, playlist_name, playlist_text, owner_id)
+        SELECT server_id, playlist_name, playlist_text, owner_id FROM playlists ORDER BY rowid;''',
+        '''INSERT INTO playlists (server_id, playlist_name, playlist_text, owner_id)
+        SELECT server_id, playlist_name, playlist_text, owner_id FROM playlists_new ORDER BY playlist_id;''',
+    ),
+    step(
+        "DROP TABLE playlists;",
+        '''CREATE TABLE playlists (
+            server_id INTEGER,
+            playlist_name TEXT,
+            playlist_text TEXT,
+            owner_id INTEGER,
+            UNIQUE (server_id, playlist_name),
+            FOREIGN KEY (server_id) REFERENCES server (server_id)
+        );''',
+    ),
+    step(
+        "ALTER TABLE playlists_new RENAME TO playlists;",
+        "ALTER TABLE playlists RENAME TO playlists_new;",
+    ),
+    # Trigram tokens let any substring of 3+ characters be looked up, which is
+    # what `;playlists search` matches on. Case sensitive like it always was.
+    step(
+        '''CREATE VIRTUAL TABLE playlists_fts USING fts5 (
+            playlist_text,
+            content = 'playlists',
+            content_rowid = 'playlist_id',
+            tokenize = 'trigram case_sensitive 1'
+        );''',
+        "DROP TABLE playlists_fts;",
+    ),
+    step(
+        "INSERT INTO playlists_fts (playlists_fts) VALUES ('rebuild');",
+    ),
+    # Keep the index in sync with the playlists
+    step(
+        '''CREATE TRIGGER playlists_fts_insert AFTER INSERT ON playlists BEGIN
+            INSERT INTO playlists_fts (rowid, playlist_text) VALUES (new.playlist_id, new.playlist_text);
+        END;''',
+        "DROP TRIGGER playlists_fts_insert;",
+    ),
+    step(
+        '''CREATE TRIGGER playlists_fts_delete AFTER DELETE ON playlists BEGIN
+            INSERT INTO playlists_fts (playlists_fts, rowid, playlist_text) VALUES ('delete', old.playlist_id, old.playlist_text);
+        END;''',
+        "DROP TRIGGER playlists_fts_delete;",
+    ),
+    step(
+        '''CREATE TRIGGER playlists_fts_update AFTER UPDATE OF playlist_text ON playlists BEGIN
+            INSERT INTO playlists_fts (playlists_fts, rowid, playlist_text) VALUES ('delete', old.playlist_id, old.playlist_text);
+            INSERT INTO playlists_fts (rowid, playlist_text) VALUES (new.playlist_id, new.playlist_text);
+        END;''',
+        "DROP TRIGGER playlists_fts_update;",
+    ),
+]
@@ -0,0 +1,89 @@
+"""
+Playlist-entries
+"""
+
+import re
+import itertools
+
+from yoyo import step
+
+__depends__ = {"20261019_03_Fp8Tn-playlist-search"}
+
+# Markdown list markers in front of a song, like "- ", "* " or "1. "
+LIST_MARKER = re.compile(r"^(?:[-*+]|\d+[.)])\s+")
+# A link on its own, anything else that isn't in a list is just text
+URL = re.compile(r"https?://\S+")
+# Same limit as the playlists extension
+MAX_ENTRIES = 1000
+
+def parse_entries(text):
+    """Return the songs listed in a playlist's text, one per line
+
+    Headings, quotes, code fences and blank lines are skipped, list markers are
+    stripped and so are the <> used to stop Discord from embedding links. Only
+    list items and links count as songs, other lines are taken to be notes.
+    Lines that `;stream` wouldn't accept are left out.
+
+    """
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", ">", "```")):
+            continue
+        marker = LIST_MARKER.match(line)
+        if marker is not None:
+            line = line[marker.end():].strip()
+        if line.startswith("<") and line.endswith(">"):
+            line = line[1:-1].strip()
+        if marker is None and not URL.fullmatch(line):
+            continue
+        if line and len(line) <= 100 and line.isprintable():
+            yield line
+
+def apply_step(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT playlist_id, playlist_text FROM playlists;")
+    rows = [
+        (playlist_id, position, query)
+        for playlist_id, text in cursor.fetchall()
+        for position, query in enumerate(itertools.islice(parse_entries(text), MAX_ENTRIES))
+    ]
+    cursor.executemany(
+        "INSERT INTO playlist_entries (playlist_id, position, query) VALUES (?, ?, ?);",
+        rows,
+    )
+
+def rollback_step(conn):
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM playlist_entries;")
+
+steps = [
+    step(
+        '''CREATE TABLE playlist_entries (
+            entry_id INTEGER PRIMARY KEY,
+            playlist_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            query TEXT NOT NULL,
+            title TEXT,
+            duration REAL,
+            FOREIGN KEY (playlist_id) REFERENCES playlists (playlist_id)
+        );''',
+        "DROP TABLE playlist_entries;",
+    ),
+    # Reading a playlist in order, and finding its last position
+    step(
+        "CREATE INDEX playlist_entries_position ON playlist_entries (playlist_id, position);",
+        "DROP INDEX playlist_entries_position;",
+    ),
+    # Filling in the title and duration of a song once it has been played
+    step(
+        "CREATE INDEX playlist_entries_query ON playlist_entries (query) WHERE title IS NULL;",
+        "DROP INDEX playlist_entries_query;",
+    ),
+    step(
+        '''CREATE TRIGGER playlist_entries_cascade AFTER DELETE ON playlists BEGIN
+            DELETE FROM playlist_entries WHERE playlist_id = old.playlist_id;
+        END;''',
+        "DROP TRIGGER playlist_entries_cascade;",
+    ),
+    step(apply_step, rollback_step),
+]
@@ -0,0 +1,40 @@
+"""
+Cluster
+"""
+
+from yoyo import step
+
+__depends__ = {"20261019_04_Ke2Wd-playlist-entries"}
+
+steps = [
+    # One row per running worker process, refreshed by its heartbeat
+    step(
+        '''CREATE TABLE cluster_workers (
+            worker_id INTEGER PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            shard_ids TEXT NOT NULL,
+            heartbeat_at REAL NOT NULL
+        );''',
+        "DROP TABLE cluster_workers;",
+    ),
+    # Owner commands every worker should run, like `;shutdown`
+    step(
+        '''CREATE TABLE cluster_commands (
+            command_id INTEGER PRIMARY KEY,
+            op TEXT NOT NULL,
+            arg TEXT,
+            issued_at REAL NOT NULL
+        );''',
+        "DROP TABLE cluster_commands;",
+    ),
+    step(
+        '''CREATE TABLE cluster_replies (
+            command_id INTEGER NOT NULL,
+            worker_id INTEGER NOT NULL,
+            reply TEXT NOT NULL,
+            PRIMARY KEY (command_id, worker_id),
+            FOREIGN KEY (command_id) REFERENCES cluster_commands (command_id)
+        );''',
+        "DROP TABLE cluster_replies;",
+    ),
+]
@@ -0,0 +1,17 @@
+"""
+Playlist-generation
+"""
+
+from yoyo import step
+
+__depends__ = {"20261019_05_Nv4Cp-cluster"}
+
+steps = [
+    # Bumped whenever playlists are imported, so running bots (and cluster
+    # workers) know to drop their playlist caches
+    step(
+        "CREATE TABLE playlist_generation (generation INTEGER NOT NULL);",
+        "DROP TABLE playlist_generation;",
+    ),
+    step("INSERT INTO playlist_generation VALUES (0);"),
+]